@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# Python 3.10
+
+'''
+    ./benchmark.py [work_folder = /tmp/pony_benchmark] [options]
+
+    Time each stage of process_pony.py on a synthetic dataset (see make_dataset.py) and report files/s and MB/s
+    Each stage runs as its own process_pony.py process, from a cold state (its index, cache or previous outputs are removed first)
+
+    options:
+    --stages ... comma separated stages to run (default all): check_tars, extract, check_integrity, sheets, movies, metadata_to_csv, archive
+    --sequences, --frames, --size, --noise, --chunk, --corrupt, --seed ... dataset options (see make_dataset.py)
+    --reuse ... reuse the dataset in <work_folder>/tars if it exists (generated with the same options)
+    --jobs ... passed on to process_pony.py
+    --out ... write results as json
+    --compare ... results json of a previous run: show the change in time per stage, and flag regressions (slower by more than --tolerance percent, default 10)
+
+    Stages that need missing utilities (e.g. ffmpeg for movies) are skipped.
+
+    work_folder has to be empty or created by benchmark.py (marked by <work_folder>/dataset.json); only the dataset (tars),
+    the extracted folder (tars_processed) and the stage logs in it are removed and regenerated
+'''
+
+WORK_FOLDER = '/tmp/pony_benchmark'
+TOLERANCE = 10 # percent
+STAGES = ['check_tars', 'extract', 'check_integrity', 'sheets', 'movies', 'metadata_to_csv', 'archive']
+
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import subprocess
+import argparse
+
+import make_dataset
+
+PROCESS_PONY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'process_pony.py')
+
+
+class COLORS:
+    GREEN = '\033[92m'
+    YELLOW = '\033[93m'
+    RED = '\033[91m'
+    END = '\033[0m'
+
+
+def folder_stats(*paths):
+    # number of files and bytes below paths (files or folders; missing ones count as empty)
+    files = 0
+    size = 0
+    for path in paths:
+        if os.path.isfile(path):
+            files += 1
+            size += os.path.getsize(path)
+            continue
+        for root, dirs, names in os.walk(path):
+            for name in names:
+                if name.startswith('.'): continue
+                files += 1
+                size += os.path.getsize(os.path.join(root, name))
+    return files, size
+
+
+def remove(*paths):
+    for path in paths:
+        if os.path.isdir(path): shutil.rmtree(path)
+        elif os.path.exists(path): os.remove(path)
+
+
+def stage_plan(stage, tars, work, ex):
+    '''
+    returns (process_pony.py args, paths to remove first, input paths to measure), or None if the stage can't run here
+    '''
+    tar_list = [ os.path.join(tars, name) for name in sorted(os.listdir(tars)) if name.endswith('.tar') ]
+    if stage == 'check_tars': return ([tars, '--check_tars'], [os.path.join(tars, '.tar_index.sqlite')], tar_list)
+    if stage == 'extract': return ([tars, work, '--extract'], [ex], tar_list)
+    if stage == 'check_integrity': return ([ex, '--check_integrity'], [os.path.join(ex, '.check_cache.sqlite')], [ex])
+    if stage == 'sheets':
+        try: import PIL
+        except ImportError:
+            if not shutil.which('gm'): return None
+        return ([ex, '--sheets'], [os.path.join(ex, 'overviews'), os.path.join(ex, '.build_journal.sqlite')], [os.path.join(ex, 'images')])
+    if stage == 'movies':
+        if not shutil.which('ffmpeg'): return None
+        return ([ex, '--movies'], [os.path.join(ex, 'videos'), os.path.join(ex, '.build_journal.sqlite')], [os.path.join(ex, 'frames')])
+    if stage == 'metadata_to_csv': return ([ex, '--metadata_to_csv'], [os.path.join(ex, 'metadata.csv'), os.path.join(ex, 'metadata.sqlite'), os.path.join(ex, '.build_journal.sqlite')], [os.path.join(ex, 'metadata')])
+    if stage == 'archive':
+        zips = [ os.path.join(ex, name) for name in os.listdir(ex) if '.z' in name ] if os.path.isdir(ex) else []
+        return ([ex, '--archive', 'all'], zips + [os.path.join(ex, '.build_journal.sqlite')], [ os.path.join(ex, d) for d in ['metadata', 'overviews', 'images', 'videos', 'frames'] ])
+    raise ValueError(f'unknown stage {stage}')
+
+
+def run_stage(stage, tars, work, jobs = None):
+    # returns result dict, or None if skipped
+    ex = os.path.join(work, os.path.basename(tars) + '_processed')
+    plan = stage_plan(stage, tars, work, ex)
+    if plan == None:
+        print(f'{stage}: {COLORS.YELLOW}skipped (missing utilities){COLORS.END}')
+        return None
+    args, cleanup, inputs = plan
+    remove(*cleanup)
+    cmd = [sys.executable, PROCESS_PONY, *args, '-y'] + (['--jobs', str(jobs)] if jobs != None else [])
+    files, size = folder_stats(*inputs)
+    log_path = os.path.join(work, f'{stage}.log')
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    with open(log_path, 'w') as log:
+        code = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT).returncode
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime)
+    return { 'stage': stage, 'seconds': elapsed, 'cpu_seconds': cpu, 'files': files, 'bytes': size, 'files_per_s': files / elapsed, 'mb_per_s': size / 1_000_000 / elapsed, 'exit_code': code, 'log': log_path }
+
+
+def print_results(results, previous = None, tolerance = TOLERANCE):
+    prev = { r['stage']: r for r in previous['stages'] } if previous else {}
+    print(f'\n{"stage":<16} {"time (s)":>9} {"cpu (s)":>9} {"files":>8} {"MB":>9} {"files/s":>9} {"MB/s":>8}' + ('   change' if previous else ''))
+    regressions = []
+    for r in results:
+        line = f'{r["stage"]:<16} {r["seconds"]:>9.2f} {r["cpu_seconds"]:>9.2f} {r["files"]:>8} {r["bytes"] / 1_000_000:>9.1f} {r["files_per_s"]:>9.1f} {r["mb_per_s"]:>8.1f}'
+        if r['stage'] in prev:
+            change = (r['seconds'] / prev[r['stage']]['seconds'] - 1) * 100
+            color = COLORS.RED if change > tolerance else (COLORS.GREEN if change < -tolerance else '')
+            line += f'   {color}{change:+.0f}%{COLORS.END if color else ""}'
+            if change > tolerance: regressions.append(r['stage'])
+        if r['exit_code'] != 0: line += f'   {COLORS.RED}exit code {r["exit_code"]} (see {r["log"]}){COLORS.END}'
+        print(line)
+    if len(regressions) > 0: print(f'\n{COLORS.RED}Regressions (slower by more than {tolerance}%): {", ".join(regressions)}{COLORS.END}')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('work_folder', nargs='?', default=WORK_FOLDER)
+    parser.add_argument('--stages', type=str, default='all')
+    parser.add_argument('--sequences', type=int, default=make_dataset.SEQUENCES)
+    parser.add_argument('--frames', type=int, default=make_dataset.FRAMES)
+    parser.add_argument('--size', type=int, default=make_dataset.SIZE)
+    parser.add_argument('--noise', type=float, default=make_dataset.NOISE)
+    parser.add_argument('--chunk', type=float, default=make_dataset.CHUNK)
+    parser.add_argument('--corrupt', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=make_dataset.SEED)
+    parser.add_argument('--reuse', action='store_true', default=False)
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--out', type=str, default=None)
+    parser.add_argument('--compare', type=str, default=None)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    stages = STAGES if args.stages == 'all' else [ s.strip() for s in args.stages.split(',') ]
+    for stage in stages:
+        if stage not in STAGES:
+            print(f'Unknown stage: {stage} ({", ".join(STAGES)})')
+            exit(1)
+
+    tars = os.path.join(args.work_folder, 'tars')
+    options = { k: getattr(args, k) for k in ['sequences', 'frames', 'size', 'noise', 'chunk', 'corrupt', 'seed'] }
+    options_path = os.path.join(args.work_folder, 'dataset.json') # also marks work_folder as created by benchmark.py
+    ex = os.path.join(args.work_folder, 'tars_processed')
+    if os.path.isdir(args.work_folder) and len(os.listdir(args.work_folder)) > 0 and not os.path.exists(options_path):
+        print(f'{COLORS.RED}{args.work_folder} is not empty and has no dataset.json, i.e. it wasn\'t created by benchmark.py; choose another work_folder{COLORS.END}')
+        exit(1)
+    reuse = args.reuse and os.path.exists(options_path) and json.load(open(options_path)) == options
+    if not reuse:
+        remove(tars, ex, *( os.path.join(args.work_folder, f'{stage}.log') for stage in STAGES ))
+        os.makedirs(args.work_folder, exist_ok=True)
+        with open(options_path, 'w') as file: json.dump(None, file) # marker before generating, so an interrupted run can be cleaned up
+        print(f'Generating dataset in {tars}')
+        make_dataset.make_dataset(tars, args.sequences, 1, args.frames, args.size, args.noise, args.chunk, args.corrupt, args.seed, print_progress=False)
+        with open(options_path, 'w') as file: json.dump(options, file)
+    tar_list = [ os.path.join(tars, name) for name in os.listdir(tars) if name.endswith('.tar') ]
+    files, size = folder_stats(*tar_list)
+    print(f'Dataset: {files} tars, {size / 1_000_000:.1f} MB ({", ".join(f"{k} {v}" for k, v in options.items())})')
+
+    # later stages need the extracted folder
+    if 'extract' not in stages and not os.path.isdir(ex) and any(s not in ['check_tars'] for s in stages):
+        print('Extracting (not timed)')
+        subprocess.run([sys.executable, PROCESS_PONY, tars, args.work_folder, '--extract', '-y'], stdout=subprocess.DEVNULL)
+
+    results = []
+    for stage in stages:
+        print(f'{stage} ...')
+        result = run_stage(stage, tars, args.work_folder, args.jobs)
+        if result != None: results.append(result)
+
+    previous = json.load(open(args.compare)) if args.compare else None
+    regressions = print_results(results, previous, args.tolerance)
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump({ 'dataset': options, 'jobs': args.jobs, 'cpus': os.cpu_count(), 'stages': results }, file, indent=2)
+        print(f'\nResults written to {args.out}')
+    if len(regressions) > 0: exit(1)
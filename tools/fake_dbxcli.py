@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# Python 3.10
+
+'''
+Stand-in for dbxcli, for testing upload.py without a dropbox account (./upload.py <source> --dbxcli=./fake_dbxcli.py)
+
+Supports the commands upload.py uses: put <src> <dst>, mkdir <folder>, ls [-l] [-R] <folder>
+The "dropbox" is a local folder; latency and failures are simulated. Configured by environment variables:
+
+FAKE_DBXCLI_REMOTE ...... local folder holding the uploaded files (default /tmp/fake_dropbox)
+FAKE_DBXCLI_DELAY ....... latency per command in seconds, random between min,max (default 0.05,0.3)
+FAKE_DBXCLI_FAIL ........ probability of a command failing (exit code 1), e.g. 0.3 (default 0)
+FAKE_DBXCLI_FAIL_FIRST .. put of each destination fails this many times before it succeeds (default 0)
+FAKE_DBXCLI_LOG ......... append each command and its exit code to this file (default none)
+'''
+
+REMOTE = '/tmp/fake_dropbox'
+DELAY = '0.05,0.3'
+
+import os
+import sys
+import time
+import random
+import shutil
+
+
+def log(path, args, code):
+    if not path: return
+    with open(path, 'a') as file:
+        file.write(f'{code} {" ".join(args)}\n')
+
+
+def put_attempts(path, dst):
+    # earlier put commands of dst in the log
+    try:
+        with open(path) as file:
+            return sum( 1 for line in file if line.rstrip('\n').split(' ', 1)[1].startswith('put ') and line.rstrip('\n').endswith(f' {dst}') )
+    except FileNotFoundError:
+        return 0
+
+
+def ls(remote, folder, recursive = False):
+    # output columns like dbxcli ls -l: revision (- for folders), size, last modified, path
+    if not os.path.isdir(remote + folder): return 1
+    print('Revision         Size    Last modified Path')
+    for root, dirs, files in os.walk(remote + folder):
+        for name in sorted(dirs): print(f'-                -       -             {os.path.join(root, name)[len(remote):]}')
+        for name in sorted(files): print(f'{random.randrange(1 << 48):012x}     {os.path.getsize(os.path.join(root, name))} B     1 minute ago  {os.path.join(root, name)[len(remote):]}')
+        if not recursive: break
+    return 0
+
+
+def main(args):
+    remote = os.environ.get('FAKE_DBXCLI_REMOTE', REMOTE).rstrip('/')
+    delay = [ float(x) for x in os.environ.get('FAKE_DBXCLI_DELAY', DELAY).split(',') ]
+    fail = float(os.environ.get('FAKE_DBXCLI_FAIL', '0'))
+    fail_first = int(os.environ.get('FAKE_DBXCLI_FAIL_FIRST', '0'))
+    log_path = os.environ.get('FAKE_DBXCLI_LOG')
+    time.sleep(random.uniform(delay[0], delay[-1]))
+    if len(args) == 0:
+        print('usage: fake_dbxcli.py put|mkdir|ls ...')
+        return 1
+    cmd = args[0]
+    if cmd == 'put' and fail_first > 0 and log_path and put_attempts(log_path, args[2]) < fail_first: code = 1
+    elif random.random() < fail: code = 1
+    elif cmd == 'put':
+        dst = remote + args[2]
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        shutil.copyfile(args[1], dst)
+        code = 0
+    elif cmd == 'mkdir':
+        os.makedirs(remote + args[1], exist_ok=True)
+        code = 0
+    elif cmd == 'ls':
+        code = ls(remote, args[-1], '-R' in args)
+    else:
+        print(f'unknown command: {cmd}')
+        code = 1
+    log(log_path, args, code)
+    return code
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# Python 3.10
+
+'''
+    ./make_dataset.py <out_folder> [options]
+
+    Generate a synthetic, scaled-down dataset with the same structure as the real renders, for testing and benchmarking process_pony.py
+    Tars are written like the recorder does (libs/recorder.js): <timestamp>_NNNN.tar, a new tar is started once the current one reaches --chunk MB,
+    so sequences are split across tar boundaries. Each sequence is written as images/NNNN.png, metadata/NNNN.json, frames/NNNN/NNNN_XXXX.png
+
+    options:
+    --sequences ... number of sequences (default 10)
+    --first ... number of the first sequence (default 1)
+    --frames ... frames per sequence (default 300)
+    --size ... width and height of images and frames in pixels (default 256)
+    --noise ... fraction of random (incompressible) pixel data 0..1, the rest is a gradient (default 0.5); controls png file sizes
+    --chunk ... max. tar size in MB (default 20)
+    --corrupt ... number of corruptions to inject (default 0): truncated png, png crc error, invalid json, missing frame, missing image
+                  injected corruptions are listed in <out_folder>/corruptions.json
+    --seed ... random seed (default 1); the same options produce identical tars
+'''
+
+SEQUENCES = 10
+FRAMES = 300
+SIZE = 256
+NOISE = 0.5
+CHUNK = 20 # MB
+SEED = 1
+TAR_TIMESTAMP = '2022-07-08T16_19_35.537Z' # tar names as downloaded from the browser (: replaced by _)
+MTIME = 1657297175 # mtime of tar members
+CORRUPTIONS = ['truncate_png', 'png_crc', 'invalid_json', 'missing_frame', 'missing_image']
+
+import os
+import io
+import json
+import random
+import struct
+import tarfile
+import zlib
+import argparse
+
+
+def png_bytes(size, rnd, noise = NOISE):
+    # rgb png: each row is partly a gradient (compressible), partly random
+    n_noise = int(size * noise) * 3
+    n_grad = size * 3 - n_noise
+    grad = bytes(range(256)) * (n_grad // 256 + 2)
+    raw = bytearray()
+    base = rnd.randrange(256)
+    for y in range(size):
+        raw.append(0) # filter type none
+        raw += grad[(base + y) % 256:(base + y) % 256 + n_grad]
+        raw += rnd.randbytes(n_noise)
+    def chunk(type, data):
+        return struct.pack('>I', len(data)) + type + data + struct.pack('>I', zlib.crc32(type + data))
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0)) + chunk(b'IDAT', zlib.compress(bytes(raw), 6)) + chunk(b'IEND', b'')
+
+
+def metadata_bytes(no, rnd):
+    # metadata json with the fields process_pony.py relies on (see metadata_row and json_error there)
+    ranks = ['1_kingdom', '2_phylum', '3_class', '4_order', '5_family', '6_genus', '7_species']
+    depth = rnd.randint(1, len(ranks))
+    meta = {
+        '_category_name': f'Category {no % 12 + 1}',
+        '_category_no': no % 12 + 1,
+        'No.': no,
+        'eDNA Target': '/' + '/'.join( f'Taxon{rnd.randrange(100)}' for i in range(depth) ),
+        'eDNA Sequences': rnd.randrange(1, 100000),
+        'eDNA Fraction (%)': f'{rnd.uniform(0, 100):.2f}',
+        'Sample': f'Sample {rnd.randrange(1, 9)}',
+        'Geolocation (Lat, Lon)': f'{rnd.uniform(46, 49):.5f}, {rnd.uniform(9, 17):.5f}',
+        'Timestamp': f'2021-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d} {rnd.randint(0, 23):02d}:00:00 +0000 UTC',
+        'Temperature (°C)': round(rnd.uniform(-10, 35), 2),
+        'Wind Direction (°)': rnd.randrange(360),
+        'Humus (Organic Matter)': round(rnd.uniform(1, 10), 1),
+        'Calcium (Ca)': round(rnd.uniform(100, 5000)),
+        'Magnesium (Mg)': round(rnd.uniform(10, 500)),
+        'Potassium (K)': round(rnd.uniform(10, 500)),
+        'Phosphor (P)': round(rnd.uniform(10, 500)),
+        'Nitrogen (N)': round(rnd.uniform(0.1, 1), 2),
+        'Sulfate (SO4)': round(rnd.uniform(1, 100)),
+        'Iron (Fe)': round(rnd.uniform(10, 500)),
+        '_edna_target': { rank: (f'Taxon{rnd.randrange(100)}' if i < depth else '*') for i, rank in enumerate(ranks) },
+        '_weather_extra': {
+            'Atmospheric Pressure (hPa)': rnd.randrange(980, 1040),
+            'Humidity (%)': rnd.randrange(20, 100),
+            'Wind Speed (m/s)': round(rnd.uniform(0, 15), 2),
+            'Rain (mm/h)': round(rnd.uniform(0, 5), 2) if rnd.random() < 0.2 else 0,
+        },
+    }
+    params = { 'general': { 'seq_no': no, 'fill_seed': rnd.randrange(1 << 16), 'form_seed': rnd.randrange(1 << 16) }, '_nft_metadata': meta }
+    return json.dumps(params, indent=2, ensure_ascii=False).encode()
+
+
+def corrupt(name, data, kind, rnd):
+    # returns corrupted data, or None to drop the file
+    if kind == 'truncate_png': return data[:len(data) // 2]
+    if kind == 'png_crc':
+        pos = rnd.randrange(41, len(data) - 12) # inside IDAT data
+        return data[:pos] + bytes([data[pos] ^ 0xff]) + data[pos+1:]
+    if kind == 'invalid_json': return data[:len(data) // 2]
+    return None # missing_frame, missing_image
+
+
+def plan_corruptions(first, sequences, frames, count, rnd):
+    # member name -> kind
+    out = {}
+    while len(out) < count:
+        no = rnd.randrange(first, first + sequences)
+        kind = rnd.choice(CORRUPTIONS)
+        if kind in ['truncate_png', 'png_crc', 'missing_frame'] and frames > 0: name = f'frames/{no:04d}/{no:04d}_{rnd.randrange(frames):04d}.png'
+        elif kind == 'invalid_json': name = f'metadata/{no:04d}.json'
+        else: name = f'images/{no:04d}.png'
+        out.setdefault(name, kind)
+    return out
+
+
+def make_dataset(out_folder, sequences = SEQUENCES, first = 1, frames = FRAMES, size = SIZE, noise = NOISE, chunk = CHUNK, corruptions = 0, seed = SEED, print_progress = True):
+    '''
+    write tars to out_folder; returns dict with tars, number of files and bytes (of members), and injected corruptions
+    '''
+    os.makedirs(out_folder, exist_ok=True)
+    rnd = random.Random(seed)
+    planned = plan_corruptions(first, sequences, frames, corruptions, random.Random(seed + 1))
+    tars = []
+    tar = None
+    files = 0
+    total = 0
+
+    def add(name, data):
+        nonlocal tar, files, total
+        if name in planned:
+            data = corrupt(name, data, planned[name], rnd)
+            if data == None: return
+        if tar == None:
+            tars.append( os.path.join(out_folder, f'{TAR_TIMESTAMP}_{len(tars):04d}.tar') )
+            tar = tarfile.open(tars[-1], 'w', format=tarfile.USTAR_FORMAT)
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = MTIME
+        tar.addfile(info, io.BytesIO(data))
+        files += 1
+        total += len(data)
+        if tar.offset >= chunk * 1_000_000:
+            tar.close()
+            tar = None
+
+    for no in range(first, first + sequences):
+        add(f'images/{no:04d}.png', png_bytes(size, rnd, noise))
+        add(f'metadata/{no:04d}.json', metadata_bytes(no, rnd))
+        for frame in range(frames):
+            add(f'frames/{no:04d}/{no:04d}_{frame:04d}.png', png_bytes(size, rnd, noise))
+        if print_progress: print(f'({no - first + 1}/{sequences}) Sequence {no:04d}: {len(tars)} tars, {files} files, {total / 1_000_000:.1f} MB')
+    if tar != None: tar.close()
+    with open(os.path.join(out_folder, 'corruptions.json'), 'w') as file:
+        json.dump(planned, file, indent=2, sort_keys=True)
+    return { 'tars': tars, 'files': files, 'bytes': total, 'corruptions': planned }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('out_folder')
+    parser.add_argument('--sequences', type=int, default=SEQUENCES)
+    parser.add_argument('--first', type=int, default=1)
+    parser.add_argument('--frames', type=int, default=FRAMES)
+    parser.add_argument('--size', type=int, default=SIZE)
+    parser.add_argument('--noise', type=float, default=NOISE)
+    parser.add_argument('--chunk', type=float, default=CHUNK)
+    parser.add_argument('--corrupt', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=SEED)
+    args = parser.parse_args()
+
+    result = make_dataset(args.out_folder, args.sequences, args.first, args.frames, args.size, args.noise, args.chunk, args.corrupt, args.seed)
+    print(f'{len(result["tars"])} tars, {result["files"]} files, {result["bytes"] / 1_000_000:.1f} MB -> {args.out_folder}')
+    for name, kind in sorted(result['corruptions'].items()):
+        print(f'   {kind}: {name}')
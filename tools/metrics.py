@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# Python 3.10
+
+'''
+Metrics for process_pony.py and upload.py
+
+    stage = metrics.stage('movies', total=len(folders))
+    stage.item('0001', seconds, bytes, cpu)   # per item (e.g. a movie), with duration and subprocess cpu time
+    stage.add(count, bytes)                   # many small items at once (e.g. checked files), without per item events
+    stage.end()
+    metrics.summary()
+
+Events are written as json lines (one object per line, with t ... unix time, event ... run_start, stage_start, item, retry, stage_end, summary)
+once a log is opened with open_log(path). A progress line (done/total, rate, ETA) is printed every PROGRESS_INTERVAL seconds per stage.
+The summary lists per stage: items, failures, time, throughput, percentiles of item durations and the slowest items
+(stages with the same name, e.g. of batches or --watch rounds, are combined; their time is the sum of their durations).
+'''
+
+PROGRESS_INTERVAL = 10 # seconds between progress lines
+SLOWEST = 5 # slowest items listed in summary
+
+import os
+import sys
+import json
+import time
+import types
+import datetime
+import resource
+import threading
+
+_log = None
+_lock = threading.Lock()
+_stages = [] # all stages of this run, for summary
+
+
+def open_log(path):
+    # append events to path (json lines)
+    global _log
+    _log = open(path, 'a', buffering=1)
+    emit('run_start', argv=sys.argv, pid=os.getpid(), cpus=os.cpu_count())
+
+
+def emit(event, **fields):
+    if _log == None: return
+    line = json.dumps({ 't': round(time.time(), 3), 'event': event, **fields }, ensure_ascii=False, default=str)
+    with _lock: _log.write(line + '\n')
+
+
+def format_duration(seconds):
+    return str( datetime.timedelta(seconds=round(seconds)) )
+
+
+def percentile(values, p):
+    # nearest rank; values sorted
+    if len(values) == 0: return None
+    return values[ min(len(values) - 1, max(0, round(p / 100 * len(values) + 0.5) - 1)) ]
+
+
+def timed_call(fn, *args):
+    # run fn in this process (e.g. a pool worker), returns (result, seconds, cpu seconds of this process)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    result = fn(*args)
+    seconds = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    return result, seconds, (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime)
+
+
+def wait_cpu(proc):
+    # wait for a subprocess.Popen, returns (returncode, cpu seconds of the process and its waited for children)
+    try:
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        return proc.returncode, usage.ru_utime + usage.ru_stime
+    except ChildProcessError: # already reaped
+        return proc.wait(), None
+
+
+class Stage:
+    def __init__(self, name, total = None):
+        self.name = name
+        self.total = total
+        self.start = time.time()
+        self.end_time = None
+        self.count = 0
+        self.bytes = 0
+        self.cpu = 0
+        self.failures = 0
+        self.durations = [] # (seconds, item)
+        self.last_progress = self.start
+        self.lock = threading.Lock()
+        emit('stage_start', stage=name, total=total)
+
+    def item(self, name, seconds = None, bytes = 0, cpu = None, ok = True, error = None, **fields):
+        with self.lock:
+            self.count += 1
+            self.bytes += bytes or 0
+            self.cpu += cpu or 0
+            if not ok: self.failures += 1
+            if seconds != None: self.durations.append( (seconds, name) )
+        emit('item', stage=self.name, item=name, seconds=seconds and round(seconds, 4), bytes=bytes, cpu=cpu and round(cpu, 4), ok=ok, error=error, **fields)
+        self.progress()
+
+    def add(self, count = 1, bytes = 0, failures = 0):
+        with self.lock:
+            self.count += count
+            self.bytes += bytes
+            self.failures += failures
+        self.progress()
+
+    def progress(self, force = False):
+        now = time.time()
+        with self.lock:
+            if not force and now - self.last_progress < PROGRESS_INTERVAL: return
+            self.last_progress = now
+            elapsed = max(now - self.start, 1e-6)
+            rate = self.count / elapsed
+            line = f'   [{self.name}] {self.count}' + (f'/{self.total} ({self.count / max(self.total, 1) * 100:.1f}%)' if self.total else '')
+            line += f', {rate:.1f}/s'
+            if self.bytes > 0: line += f', {self.bytes / 1_000_000 / elapsed:.1f} MB/s'
+            if self.failures > 0: line += f', {self.failures} failed'
+            if self.total and rate > 0 and self.count < self.total: line += f', ETA {format_duration((self.total - self.count) / rate)}'
+        print(line, flush=True)
+
+    def end(self):
+        if self.end_time != None: return
+        self.end_time = time.time()
+        emit('stage_end', stage=self.name, seconds=round(self.end_time - self.start, 3), items=self.count, bytes=self.bytes, cpu=round(self.cpu, 3), failures=self.failures)
+        with _lock: _stages.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.end()
+
+
+def stage(name, total = None):
+    return Stage(name, total)
+
+
+def merged_stages():
+    # stages ended so far, those with the same name (e.g. run once per batch) combined, in order of first end
+    merged = {}
+    for s in _stages:
+        m = merged.setdefault(s.name, types.SimpleNamespace(name=s.name, seconds=0, count=0, bytes=0, cpu=0, failures=0, durations=[]))
+        m.seconds += s.end_time - s.start
+        m.count += s.count
+        m.bytes += s.bytes
+        m.cpu += s.cpu
+        m.failures += s.failures
+        m.durations += s.durations
+    return list(merged.values())
+
+
+def summary():
+    # print (and emit) summary of all stages ended so far
+    if len(_stages) == 0: return
+    print('\nSummary:')
+    out = []
+    for s in merged_stages():
+        seconds = s.seconds
+        durations = sorted(d for d, name in s.durations)
+        line = f'   {s.name}: {s.count} items in {format_duration(seconds)}, {s.count / max(seconds, 1e-6):.1f}/s'
+        if s.bytes > 0: line += f', {s.bytes / 1_000_000_000:.2f} GB ({s.bytes / 1_000_000 / max(seconds, 1e-6):.1f} MB/s)'
+        if s.cpu > 0: line += f', subprocess cpu {format_duration(s.cpu)}'
+        if s.failures > 0: line += f', {s.failures} failed'
+        print(line)
+        stats = { 'stage': s.name, 'seconds': round(seconds, 3), 'items': s.count, 'bytes': s.bytes, 'cpu': round(s.cpu, 3), 'failures': s.failures }
+        if len(durations) > 0:
+            stats.update({ f'p{p}': round(percentile(durations, p), 4) for p in [50, 90, 99] })
+            stats['max'] = round(durations[-1], 4)
+            stats['slowest'] = [ (name, round(d, 4)) for d, name in sorted(s.durations, reverse=True)[:SLOWEST] ]
+            print(f'      item seconds: p50 {stats["p50"]:.2f}, p90 {stats["p90"]:.2f}, p99 {stats["p99"]:.2f}, max {stats["max"]:.2f}')
+            print(f'      slowest: {", ".join(f"{name} ({d:.2f}s)" for name, d in stats["slowest"])}')
+        out.append(stats)
+    emit('summary', stages=out)
@@ -16,28 +16,84 @@
         --from, --to ... only the specified tars (sorted order)
         --tar_v ... tar option v, verbose
         --tar_k ... tar option k, keep old files, i.e. don't overwrite
+        --jobs ... number of tars to extract concurrently (default 1)
+        --bwlimit ... limit total read bandwidth of all concurrent extractions, in MB/s (default 0 ... no limit)
+        completed tars are recorded in out_folder/<in_folder_basename>_processed/.extract_journal; an interrupted extraction resumes with unfinished tars (remove the journal to extract everything again)
+        --seq ... only images, metadata and frames of the specified sequence numbers, e.g. 1501-3000 or 42; uses the tar member index (see --check_tars) to read only the needed bytes
+        --disk_budget ... with --movies: extract and encode in batches, so no more than the given size of frames (e.g. 2t) is on disk at once;
+                          the next batch is extracted while the current one is encoded, frames are deleted as soon as their movie passes the check
+                          (frames of failed movies are kept and stay counted; the pipeline stops when they leave no room for the next batch)
+                          (batches are planned from the tar member index; --seq limits the sequences)
     
     --sheets ... generate contact sheets; specify extracted folder with in_folder (when --extract is not present)
         --from, --to ... only the specified sequence numbers
+        --jobs ... number of sheets to render concurrently (default 0 ... number of CPUs)
     --movies ... generate movies; specify extracted folder with in_folder (when --extract is not present)
         --from, --to ... only the specified sequence numbers
+        --jobs ... number of movies to encode concurrently (default 1)
+        --threads ... total ffmpeg thread budget, split across jobs (default 0 ... number of CPUs)
+        --stream ... encode frames directly from the tars in in_folder, without extracting them to disk; movies will be placed in out_folder/<in_folder_basename>_processed
+                     up to date movies are skipped by fingerprints of their frames in the tar member index (see --tar_index), tars without frames to encode aren't read
+        --profile ... encoder profile (see MOVIE_PROFILES: x264_veryslow, x264_youtube, x264_fast, x264_veryfast, videotoolbox, nvenc, x265, gif)
+                      auto (default) ... first of MOVIE_PROFILE_ORDER the local ffmpeg can encode with (encoders are probed on startup)
+                      fastest ... highest frames/s recorded by --calibrate on this machine; --max_size limits the calibrated movie size (e.g. 20m)
+        --segments ... encode each movie as this many GOP aligned segments in parallel, joined with the concat demuxer (no re-encode), e.g. for re-encoding a few long or high resolution movies;
+                       the joined movie is checked for the frame count, duration and timestamps of a single-pass encode
+                       (single output only; profiles with a fixed keyframe interval: x264_youtube, x264_fast, x264_veryfast, nvenc)
+        --outputs ... encode several deliverables in one pass, decoding the frames of each sequence once (instead of --profile), e.g. x264_veryslow@3840,x264_youtube@1080,gif@540
+                      comma separated profile[@resolution] (width, or WxH; default MOVIE_RES); each output goes to out_folder/videos_<profile>[_<resolution>]
+                      with MOVIE_LOOPS > 1, loops are served from memory (up to MOVIE_LOOP_BUFFER), not read from disk again
+    --calibrate ... encode a sample sequence (the first animation folder, or --from) with each usable profile (or the comma separated --profile list),
+                    and record frames/s and movie size per machine in out_folder/.movie_calibration.json
     
     --metadata_to_csv ... generate single csv file of all metadata (with special structure according to client)
+    --query ... list images whose metadata matches an sql condition on the columns of METADATA_COLUMNS, e.g. "category_no = 3 AND temperature > 25"
+    both use a metadata store (<extract_folder>/metadata.sqlite), which is updated from new or changed metadata files
     
-    --check_tars ... check presence of files within tars
+    --check_tars ... check presence of files within tars (uses a member index, only new or changed tars are scanned)
+        --tar_index ... path of the tar member index (default: <in_folder>/.tar_index.sqlite)
+        --jobs ... number of worker processes for scanning tars (default 0 ... number of CPUs)
     --check_extracted ... check presence of files in extracted folder
     --check_integrity ... check presence as well as png and json file integrity in extracted folder
-    --check_movies ... check movies for errors
+        --check_zlib ... additionally check that the compressed image data of each png decompresses
+        metadata files verified before (unchanged size and mtime) are skipped (cached in <extract_folder>/.check_cache.sqlite)
+        --jobs ... number of worker processes (default 0 ... number of CPUs)
+    --check_movies ... check movies for errors: structure, frame count, duration and resolution (mp4), then decode every movie
+        --fast ... skip decoding, only check structure
+        --jobs ... number of movies to check concurrently (default 0 ... number of CPUs)
+        movies verified before (unchanged size and mtime) are skipped (cached in out_folder/.check_cache.sqlite)
+        --snapshot ... for --check_extracted and --check_integrity: reuse the file listing of the extract folder saved by a previous run (if no folders changed since), or save it (<extract_folder>.inventory)
     
     --archive ... compress stuff from extracted folder ('all', 'images', 'frames', 'movies', 'meta', 'sheets')
-        --001 ... use split utility to produce .zip.001, .zip.002, etc. instead of multipart .zip, .z01, .z02, etc.
+        --001 ... produce .zip.001, .zip.002, etc. (split of a single zip) instead of multipart .zip, .z01, .z02, etc.
+        --jobs ... number of threads reading and compressing files (default 0 ... number of CPUs)
+        png and mp4 files are stored, others (json, csv) are deflated
+        --shard ... instead of a single (split) zip, write shards of the given number of sequences each (e.g. 100) to out_folder/shards/<folder>_0001-0100.zip,
+                    and record the offset of every file in out_folder/shards/manifest.sqlite
+    --fetch ... restore files from sharded archives, reading each file with a single seek; specify the shards folder with in_folder, files are written to out_folder
+                comma separated targets ('images', 'frames', ...) and/or file names (e.g. images/0042.png); --seq limits targets to a sequence number range, e.g. 42 or 1501-3000
+    
+    --watch ... process tars while they are being recorded (specify tar folder with in_folder, like --extract): the folder is listed every --poll seconds (default 30),
+                a tar is complete once its size hasn't changed for --stable seconds (default 60); complete tars are indexed (see --check_tars), extracted and their files verified,
+                with --movies each sequence is encoded as soon as all of its frames are in complete tars (--jobs, --threads, --profile, --outputs, --segments apply)
+        --idle ... stop after this many seconds without a new tar and list incomplete sequences (default 0 ... run until ctrl-c)
+    
+    --queue ... share --extract, --sheets and --movies between workers on several hosts: run the same command on each host, with a folder on shared storage
+                (one per run); workers claim units (QUEUE_TARS tars, QUEUE_PAGES sheets, QUEUE_SEQUENCES sequences) and record completion there (see workqueue.py)
+                units of crashed workers are taken over once their claim has no heartbeat for --lease seconds (default 300); failed units are recorded as <unit>.failed (remove to retry)
+        --worker ... worker name (default host:pid)
+    
+    Sheets, movies, metadata csv and archives are skipped if they are up to date, i.e. their inputs (paths, sizes, mtimes)
+    and settings didn't change since they were built (recorded in out_folder/.build_journal.sqlite)
+    --force ... build everything, even if up to date (also re-extracts tars recorded in the extraction journal)
+    
+    Each stage prints a progress line (done/total, rate, ETA) every 10 seconds, and a summary (throughput, failures, percentiles and slowest items per stage) at the end
+    --metrics ... also append an event per stage, item (e.g. tar, movie, shard) and the summary to the given file as json lines (see metrics.py)
     
     Required utilities:
     * tar
-    * zip
-    * split
     * ffmpeg
-    * graphicsmagick
+    * Pillow (python module, for --sheets; falls back to graphicsmagick if not installed)
 '''
 
 OUTDIR_SUFFIX = '_processed'
@@ -47,8 +103,12 @@ TAR_FRAMES_DIR = 'frames'
 TAR_META_DIR = 'metadata'
 OUT_SHEETS_DIR = 'overviews'
 OUT_MOVIES_DIR = 'videos'
+OUT_SHARDS_DIR = 'shards'
 
 SHEET_PREFIX = 'overview_'
+SHEET_POINTSIZE = 30 # label font size
+SHEET_FONT = 'DejaVuSans.ttf' # label font (Pillow), uses Pillow's default font if not found
+SHEET_JOBS = 0 # sheets rendered concurrently (--jobs); 0 ... use number of CPUs
 
 MOVIE_FRAMES = 300
 MOVIE_LOOPS = 1
@@ -57,29 +117,78 @@ MOVIE_OUTPUT_FPS = 25
 MOVIE_RES = (1080, 1080) # use -1 for both components to keep resolution unchanged
 MOVIE_CRF_H264 = 20 # default 23
 MOVIE_CRF_H265 = 25 # default 28
-MOVIE_BITRATE_H264 = 3.6 # in Mbit (only applies to videotoolbox encoder)
-
-# H264 (needs level 5 for 1920, level 6 for 3840)
-# Only '-preset veryslow' produces no artifacts; Adding '-tune animation' fixes artifacts with faster presets, but results in bigger files and worse seeking time; Note: Artifacts only in quicktime player, NOT in VLC; Artifacts appear both on ffmpeg 4.4.2 (Ubuntu) and 5.0.1 (Darwin) 
-# MOVIE_ENCODE = (f'-c:v libx264 -profile:v main -level:v 6 -crf {MOVIE_CRF_H264} -preset veryslow -pix_fmt yuv420p -color_range tv -colorspace bt709 -color_primaries bt709 -color_trc bt709 -movflags +faststart', 'mp4')
-# H264 Youtube Recommended Settings https://support.google.com/youtube/answer/1722171 (MP4, faststart, high profile, 2 b-frames, GOP half the framerate, 4:2:0 chroma) + from handbrake "creator" preset (level 5.2, ref=1, b-pyramid=none, vbv limits). Testing shows that Level 6 shows artifacts on mac + win (w/hw decoding), while Level 5.2 always works, even though it gives limit warnings.
-#MOVIE_ENCODE = (f'-c:v libx264 -profile:v high -level:v 5.2 -crf {MOVIE_CRF_H264} -pix_fmt yuv420p -color_range tv -colorspace bt709 -color_primaries bt709 -color_trc bt709 -movflags +faststart -x264-params bframes=2:keyint={MOVIE_OUTPUT_FPS//2}:ref=1:b-pyramid=none:vbv-bufsize=300000:vbv-maxrate=300000', 'mp4')
-# H264 Apple Videotoolbox Framework (on defaults produces L6, CABAC, 2 ref frames, 12 keyframe interval), hw encode, bigger filesize, works out of the box on win/mac w/hw decode
-MOVIE_ENCODE = (f'-c:v h264_videotoolbox -profile:v high -pix_fmt yuv420p -color_range tv -colorspace bt709 -color_primaries bt709 -color_trc bt709 -movflags +faststart -b:v {MOVIE_BITRATE_H264}M', 'mp4')
-# H265
-#MOVIE_ENCODE = (f'-c:v libx265 -crf {MOVIE_CRF_H265} -preset medium -tag:v hvc1 -pix_fmt yuv420p -color_range tv -colorspace bt709 -color_primaries bt709 -color_trc bt709 -movflags +faststart', 'mp4')
-# GIF
-#MOVIE_ENCODE = (f'-vf "fps={MOVIE_OUTPUT_FPS},scale={MOVIE_RES[0]}:{MOVIE_RES[1]}:flags=lanczos,split[s0][s1];[s0]palettegen[p];[s1][p]paletteuse" -loop 0', 'gif')
+MOVIE_BITRATE_H264 = 3.6 # in Mbit (only applies to videotoolbox and nvenc encoders)
+MOVIE_JOBS = 1 # concurrent ffmpeg processes (--jobs)
+MOVIE_THREADS = 0 # total thread budget for all concurrent ffmpeg processes (--threads); 0 ... use number of CPUs
+
+MOVIE_GIF_FILTER = 'fps={fps},scale={w}:{h}:flags=lanczos,split[{l}s0][{l}s1];[{l}s0]palettegen[{l}p];[{l}s1][{l}p]paletteuse' # l ... label prefix (unique per output in a filter graph)
+MOVIE_SEGMENTS = 0 # encode each movie as this many segments in parallel (--segments); 0 ... single pass
+MOVIE_LOOP_BUFFER = 4 * 1024 * 1024 * 1024 # max. memory for serving loops (MOVIE_LOOPS > 1) from decoded frames (rgba); frames are read from disk again otherwise
+
+# Encoder profiles (--profile): name -> (ffmpeg encoder, output options, file extension)
+MOVIE_PROFILES = {
+    # H264 (needs level 5 for 1920, level 6 for 3840)
+    # Only '-preset veryslow' produces no artifacts; Adding '-tune animation' fixes artifacts with faster presets, but results in bigger files and worse seeking time; Note: Artifacts only in quicktime player, NOT in VLC; Artifacts appear both on ffmpeg 4.4.2 (Ubuntu) and 5.0.1 (Darwin) 
+    'x264_veryslow': ('libx264', f'-c:v libx264 -profile:v main -level:v 6 -crf {MOVIE_CRF_H264} -preset veryslow -pix_fmt yuv420p -color_range tv -colorspace bt709 -color_primaries bt709 -color_trc bt709 -movflags +faststart', 'mp4'),
+    # H264 Youtube Recommended Settings https://support.google.com/youtube/answer/1722171 (MP4, faststart, high profile, 2 b-frames, GOP half the framerate, 4:2:0 chroma) + from handbrake "creator" preset (level 5.2, ref=1, b-pyramid=none, vbv limits). Testing shows that Level 6 shows artifacts on mac + win (w/hw decoding), while Level 5.2 always works, even though it gives limit warnings.
+    'x264_youtube': ('libx264', f'-c:v libx264 -profile:v high -level:v 5.2 -crf {MOVIE_CRF_H264} -pix_fmt yuv420p -color_range tv -colorspace bt709 -color_primaries bt709 -color_trc bt709 -movflags +faststart -x264-params bframes=2:keyint={MOVIE_OUTPUT_FPS//2}:ref=1:b-pyramid=none:vbv-bufsize=300000:vbv-maxrate=300000', 'mp4'),
+    # Same with faster presets, for machines without hw encoder (see --calibrate for speed and size)
+    'x264_fast': ('libx264', f'-c:v libx264 -profile:v high -level:v 5.2 -crf {MOVIE_CRF_H264} -preset fast -pix_fmt yuv420p -color_range tv -colorspace bt709 -color_primaries bt709 -color_trc bt709 -movflags +faststart -x264-params bframes=2:keyint={MOVIE_OUTPUT_FPS//2}:ref=1:b-pyramid=none:vbv-bufsize=300000:vbv-maxrate=300000', 'mp4'),
+    'x264_veryfast': ('libx264', f'-c:v libx264 -profile:v high -level:v 5.2 -crf {MOVIE_CRF_H264} -preset veryfast -pix_fmt yuv420p -color_range tv -colorspace bt709 -color_primaries bt709 -color_trc bt709 -movflags +faststart -x264-params bframes=2:keyint={MOVIE_OUTPUT_FPS//2}:ref=1:b-pyramid=none:vbv-bufsize=300000:vbv-maxrate=300000', 'mp4'),
+    # H264 Apple Videotoolbox Framework (on defaults produces L6, CABAC, 2 ref frames, 12 keyframe interval), hw encode, bigger filesize, works out of the box on win/mac w/hw decode
+    'videotoolbox': ('h264_videotoolbox', f'-c:v h264_videotoolbox -profile:v high -pix_fmt yuv420p -color_range tv -colorspace bt709 -color_primaries bt709 -color_trc bt709 -movflags +faststart -b:v {MOVIE_BITRATE_H264}M', 'mp4'),
+    # H264 NVIDIA NVENC, hw encode (linux render boxes with a gpu), constant quality capped at the videotoolbox bitrate
+    'nvenc': ('h264_nvenc', f'-c:v h264_nvenc -profile:v high -preset p5 -rc vbr -cq {MOVIE_CRF_H264} -maxrate {MOVIE_BITRATE_H264}M -bufsize {MOVIE_BITRATE_H264 * 2}M -g {MOVIE_OUTPUT_FPS//2} -bf 2 -pix_fmt yuv420p -color_range tv -colorspace bt709 -color_primaries bt709 -color_trc bt709 -movflags +faststart', 'mp4'),
+    # H265
+    'x265': ('libx265', f'-c:v libx265 -crf {MOVIE_CRF_H265} -preset medium -tag:v hvc1 -pix_fmt yuv420p -color_range tv -colorspace bt709 -color_primaries bt709 -color_trc bt709 -movflags +faststart', 'mp4'),
+    # GIF
+    'gif': ('gif', f'-vf "{MOVIE_GIF_FILTER.format(fps=MOVIE_OUTPUT_FPS, w=MOVIE_RES[0], h=MOVIE_RES[1], l="")}" -loop 0', 'gif'),
+}
+MOVIE_PROFILE = 'auto' # --profile; auto ... first profile of MOVIE_PROFILE_ORDER the local ffmpeg can encode with, fastest ... fastest calibrated profile on this machine (see --calibrate)
+MOVIE_PROFILE_ORDER = ['videotoolbox', 'nvenc', 'x264_youtube', 'x265']
+MOVIE_ENCODE = MOVIE_PROFILES['videotoolbox'][1:] # (output options, extension), set from the selected profile on startup
+MOVIE_CALIBRATION_FILE = '.movie_calibration.json' # frames/s and size per profile and machine (--calibrate), placed in the output folder
 
 CHECK_IMAGES = 8760
 CHECK_FRAMES = 300
+CHECK_JOBS = 0 # worker processes for integrity checks (--jobs); 0 ... use number of CPUs
+CHECK_CHUNKSIZE = 64 # files per task sent to a worker process
+CHECK_AHEAD = 4 # tasks in flight per worker process (frame checks)
+CHECK_CACHE_FILE = '.check_cache.sqlite' # previously verified files, placed in the extract folder
+
+SCAN_JOBS = 8 # threads listing directories concurrently
+SCAN_AHEAD = 64 # number of directories listed ahead of the consumer
+INVENTORY_SUFFIX = '.inventory' # snapshot of the extract folder listing (--snapshot), placed beside the folder (inside, it would change the folder's mtime and invalidate itself)
+
+ZIP_SPLIT = '5g' # volume size (k, m, g, t)
+ARCHIVE_STORE_EXTS = ('.png', '.mp4', '.gif', '.jpg', '.zip') # already compressed, stored without deflating
+ARCHIVE_DEFLATE_LEVEL = 6
+ARCHIVE_JOBS = 0 # threads reading and deflating files (--jobs); 0 ... use number of CPUs
+ARCHIVE_AHEAD = 64 # files prepared ahead of the writer
+ARCHIVE_AHEAD_BYTES = 512 * 1_000_000 # bytes of files prepared ahead of the writer; bounds memory used for deflating (a small multiple of this, at least one file)
+ARCHIVE_STREAM_SIZE = 256 * 1_000_000 # larger files aren't deflated in memory, but stored and streamed by the writer
+ARCHIVE_BUFFER = 16 * 1024 * 1024 # write buffer / read chunk size
+ARCHIVE_MANIFEST_FILE = 'manifest.sqlite' # member offsets of sharded archives (--shard), placed in the shards folder
+
+TAR_INDEX_FILE = '.tar_index.sqlite' # tar member index, placed in the tar folder (--tar_index to override)
+EXTRACT_JOURNAL_FILE = '.extract_journal' # completed tars, placed in the extract folder
+BUILD_JOURNAL_FILE = '.build_journal.sqlite' # fingerprints of built outputs, placed in the output folder
+METADATA_DB_FILE = 'metadata.sqlite' # metadata store, placed in the extract folder
+EXTRACT_JOBS = 1 # concurrent tar processes (--jobs)
+EXTRACT_BWLIMIT = 0 # total read bandwidth in MB/s (--bwlimit); 0 ... no limit
 
-ZIP_SPLIT = '5g'
+QUEUE_TARS = 4 # tars per extract unit (--queue)
+QUEUE_PAGES = 5 # contact sheets per sheets unit
+QUEUE_SEQUENCES = 20 # sequences per movies unit
+
+WATCH_POLL = 30 # seconds between listings of the tar folder (--watch)
+WATCH_STABLE = 60 # seconds a tar's size and mtime must stay unchanged until it's considered complete (the recorder appends to the current tar)
 
 import sys
 import os
 import os.path
 import math
+import itertools
 import re
 import fnmatch
 import signal
@@ -90,8 +199,21 @@ import time
 import datetime
 import tarfile
 from functools import reduce
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
 import glob
 import json
+import tempfile
+import mmap
+import struct
+import zlib
+import sqlite3
+import threading
+import hashlib
+import queue
+import socket
+import metrics
+import workqueue
 
 class COLORS:
     GREEN = '\033[92m'
@@ -101,6 +223,7 @@ class COLORS:
 
 def signal_handler(sig, stack=None):
     print(f'\nCaught signal {signal.Signals(sig).name}: Exiting')
+    metrics.summary()
     print_elapsed()
     exit(1)
     
@@ -111,42 +234,172 @@ def run_cmd(cmd, return_exitcode_only=True):
     if return_exitcode_only: return completed_process.returncode
     else: return completed_process
 
+def run_cmd_cancelable(cmd, procs, capture_output=False):
+    # like run_cmd, but runs in a separate session (ctrl-c doesn't reach it directly) and registers the process in procs, so it can be stopped with cancel_cmds()
+    proc = subprocess.Popen(cmd, shell=True, start_new_session=True, stdin=subprocess.DEVNULL, stdout=(subprocess.PIPE if capture_output else None), stderr=(subprocess.STDOUT if capture_output else None), text=True)
+    procs.add(proc)
+    try:
+        stdout = proc.stdout.read() if capture_output else None
+        code, cpu = metrics.wait_cpu(proc)
+    finally:
+        procs.discard(proc)
+        if proc.stdout: proc.stdout.close()
+    result = subprocess.CompletedProcess(cmd, code, stdout)
+    result.cpu = cpu # cpu seconds of the command (see metrics.wait_cpu)
+    return result
+
+def cancel_cmds(procs):
+    for proc in list(procs):
+        try: os.killpg(proc.pid, signal.SIGTERM) # kill the whole group (shell and its children)
+        except ProcessLookupError: pass
+
 # patterns are matches using fnmatch https://docs.python.org/3/library/fnmatch.html
 def list_files(folder, pattern = '*', ignore_hidden = True):
+    if ignore_hidden: pattern = '[!.]' + pattern
     try:
-        files = os.listdir(folder)
+        with os.scandir(folder) as it: # uses d_type from directory listing, no stat per file
+            files = [ entry.name for entry in it if fnmatch.fnmatch(entry.name, pattern) and entry.is_file() ]
     except FileNotFoundError:
         return []
-    if ignore_hidden: pattern = '[!.]' + pattern
-    files = filter(lambda x: os.path.isfile(folder + '/' + x), files)
-    files = list( filter(lambda x: fnmatch.fnmatch(x, pattern), files) ) 
     files.sort()
-    files = list( map(lambda x: folder + '/' + x, files) )
-    return files
+    return [ folder + '/' + x for x in files ]
 
 def list_folders(folder, pattern = '*'):
     try:
-        files = os.listdir(folder)
+        with os.scandir(folder) as it:
+            files = [ entry.name for entry in it if fnmatch.fnmatch(entry.name, pattern) and entry.is_dir() ]
     except FileNotFoundError:
         return []
-    files = filter(lambda x: os.path.isdir(folder + '/' + x), files)
-    files = list( filter(lambda x: fnmatch.fnmatch(x, pattern), files) ) 
     files.sort()
-    files = list( map(lambda x: folder + '/' + x, files) )
+    return [ folder + '/' + x for x in files ]
+
+def scan_dir(folder, rel, exclude_dotfiles = True, with_stat = False):
+    # list a single directory: returns (files, dirs, mtime_ns of the directory) sorted by name; files as (name, size, mtime_ns) if with_stat, else (name, None, None)
+    files = []
+    dirs = []
+    mtime_ns = os.stat(os.path.join(folder, rel)).st_mtime_ns if with_stat else None # before listing, so later changes invalidate the snapshot
+    with os.scandir(os.path.join(folder, rel)) as it:
+        for entry in it:
+            if exclude_dotfiles and entry.name.startswith('.'): continue
+            if entry.is_dir(follow_symlinks=False): dirs.append(entry.name)
+            elif entry.is_file():
+                if with_stat:
+                    stat = entry.stat()
+                    files.append( (entry.name, stat.st_size, stat.st_mtime_ns) )
+                else: files.append( (entry.name, None, None) )
+    files.sort()
+    dirs.sort()
+    return files, dirs, mtime_ns
+
+def read_snapshot(folder, snapshot):
+    '''
+    returns list of (path, size, mtime_ns) from snapshot, or None if it doesn't exist or is outdated
+    a snapshot is outdated if the mtime of any listed directory changed (i.e. entries were added or removed)
+    the top folder itself is only checked for added or removed subfolders, since journals and caches are kept there
+    '''
+    try:
+        with open(snapshot, 'r') as file:
+            lines = file.read().splitlines()
+    except FileNotFoundError:
+        return None
+    files = []
+    top_dirs = []
+    for line in lines:
+        kind, path, size, mtime_ns = line.split('\t')
+        if kind == 'D' and path != '' and '/' not in path: top_dirs.append(path)
+        if kind == 'D' and path != '':
+            try:
+                if os.stat(os.path.join(folder, path)).st_mtime_ns != int(mtime_ns): return None
+            except FileNotFoundError:
+                return None
+        elif kind == 'F': files.append( (path, int(size), int(mtime_ns)) )
+    try:
+        if scan_dir(folder, '')[1] != sorted(top_dirs): return None
+    except FileNotFoundError:
+        return None
     return files
 
+def inventory(folder, exclude_dotfiles = True, jobs = SCAN_JOBS, snapshot = None, print_progress = True):
+    '''
+    yields (path relative to folder, size, mtime_ns) of all files below folder, depth first, sorted by name
+    directories are listed with os.scandir by a thread pool, up to SCAN_AHEAD directories ahead of the consumer (e.g. the sibling folders frames/0001..8760)
+    size and mtime_ns are None, unless a snapshot is used
+    snapshot ... path of a snapshot file: if it is still valid, files are read from it instead of walking the tree; otherwise it is written while walking
+    '''
+    if snapshot:
+        files = read_snapshot(folder, snapshot)
+        if files != None:
+            if print_progress: print(f'Listing {folder}: using snapshot {snapshot} ({len(files)} files)')
+            yield from files
+            return
+    out = open(snapshot + '.part', 'w') if snapshot else None
+    count = 0
+    dir_count = 0
+    pool = ThreadPoolExecutor(max_workers=(jobs if jobs > 0 else None))
+    try:
+        stack = [ ['', None] ] # [relative path, future]; top of stack is listed next
+        while len(stack) > 0:
+            # list the next few directories ahead of time
+            for item in stack[-1:-SCAN_AHEAD-1:-1]:
+                if item[1] == None: item[1] = pool.submit(scan_dir, folder, item[0], exclude_dotfiles, snapshot != None)
+            rel, future = stack.pop()
+            files, dirs, dir_mtime_ns = future.result()
+            if out: out.write(f'D\t{rel}\t0\t{dir_mtime_ns}\n')
+            for name, size, mtime_ns in files:
+                path = os.path.join(rel, name)
+                if out: out.write(f'F\t{path}\t{size}\t{mtime_ns}\n')
+                yield (path, size, mtime_ns)
+            count += len(files)
+            dir_count += 1
+            stack.extend( [os.path.join(rel, d), None] for d in reversed(dirs) )
+            if print_progress and (dir_count % 100 == 0 or len(stack) == 0): print(f'Listing {folder}: {dir_count} folders, {count} files')
+        if out:
+            out.close()
+            os.replace(snapshot + '.part', snapshot)
+            out = None
+            if print_progress: print(f'Saved snapshot {snapshot}')
+    finally:
+        pool.shutdown(cancel_futures=True)
+        if out: # walk didn't finish
+            out.close()
+            os.remove(snapshot + '.part')
+
 def list_files_recursive(folder, exclude_dotfiles = True, print_progress=True):
-    out = []
-    for root, dirs, files in os.walk(folder):
-        if exclude_dotfiles: files = filter(lambda x: not x.startswith('.'), files)
-        root = root[len(folder)+1:] if root.startswith(folder + '/') else root # remove base folder from path
-        paths = list( map(lambda x: os.path.join(root, x) , files) )
-        out = out + paths
-        if print_progress: print(f'Listing {root}: {len(paths)} files — {len(out)} total')
-    out.sort()
-    return out
+    return [ path for path, size, mtime_ns in inventory(folder, exclude_dotfiles, print_progress=print_progress) ]
+
+def bandwidth_limiter(limit):
+    # returns wait(nbytes), which sleeps as needed to keep the total rate of all callers (threads) below limit bytes/s
+    lock = threading.Lock()
+    next_time = time.monotonic()
+    def wait(nbytes):
+        nonlocal next_time
+        with lock:
+            now = time.monotonic()
+            start = max(now, next_time)
+            next_time = start + nbytes / limit
+        if start > now: time.sleep(start - now)
+    return wait
+
+def read_journal(path):
+    # journal lines: <tar basename> <size> <mtime_ns>
+    try:
+        with open(path, 'r') as file:
+            return set( tuple(line.rsplit(' ', 2)) for line in file.read().splitlines() if line )
+    except FileNotFoundError:
+        return set()
 
-def extract_tars(tarlist, dest_folder, from_ = 0, to_ = 0):
+def journal_entry(path):
+    stat = os.stat(path)
+    return (os.path.basename(path), str(stat.st_size), str(stat.st_mtime_ns))
+
+def extract_tars(tarlist, dest_folder, from_ = 0, to_ = 0, jobs = EXTRACT_JOBS, bwlimit = EXTRACT_BWLIMIT, force = False):
+    '''
+    extract tars from_..to_ (1-based, sorted order) with up to jobs tar processes at once
+    bwlimit ... total read bandwidth in MB/s (tars are piped through python to throttle them), 0 ... no limit
+    completed tars are appended to a journal in dest_folder and skipped when extracting again (unless force)
+    note: with jobs > 1, files contained in multiple tars are not guaranteed to be overwritten in sorted order
+    returns the number of failed tars
+    '''
     from_ = max(1, from_)
     if to_ <= 0: to_ = len(tarlist)
     to_ = max(from_, to_)
@@ -159,23 +412,198 @@ def extract_tars(tarlist, dest_folder, from_ = 0, to_ = 0):
         # Linux: --skip-old-files ... Don't replace existing files when extracting, silently skip over them.
         k = '-k' if sys.platform == 'darwin' else '--skip-old-files'
     else: k = ''
-    for i, tar in enumerate(tarlist):
-        if (i+1) < from_ or (i+1) > to_: continue # skip
-        print(f'({i+1}/{len(tars)}) Extracting {tar}')
-        # x .. extract, f .. from file; tar overwrites by default (k to keep)
-        run_cmd(f'tar xf{v} "{tar}" {k} --directory "{dest_folder}"')
+    journal_path = os.path.join(dest_folder, EXTRACT_JOURNAL_FILE)
+    journal = read_journal(journal_path) if not force else set()
+    todo = [ (i, tar) for i, tar in enumerate(tarlist) if (i+1) >= from_ and (i+1) <= to_ ]
+    done = [ (i, tar) for i, tar in todo if journal_entry(tar) in journal ]
+    if len(done) > 0:
+        print(f'Skipping {len(done)} already extracted tars (see {journal_path})')
+        todo = [ x for x in todo if x not in done ]
+    jobs = max(1, jobs)
+    if jobs > 1: print(f'Extracting {jobs} tars concurrently')
+    wait = bandwidth_limiter(bwlimit * 1_000_000) if bwlimit > 0 else None
+    if wait: print(f'Limiting read bandwidth to {bwlimit} MB/s')
+    procs = set() # running tar processes
+    lock = threading.Lock() # for journal and output
+    
+    stage = metrics.stage('extract', len(todo))
+    
+    def extract(i, tar):
+        with lock: print(f'({i+1}/{len(tarlist)}) Extracting {tar}')
+        start = time.perf_counter()
+        if not wait:
+            # x .. extract, f .. from file; tar overwrites by default (k to keep)
+            result = run_cmd_cancelable(f'tar xf{v} "{tar}" {k} --directory "{dest_folder}"', procs)
+            code, cpu = result.returncode, result.cpu
+        else:
+            proc = subprocess.Popen(f'tar xf{v} - {k} --directory "{dest_folder}"', shell=True, start_new_session=True, stdin=subprocess.PIPE)
+            procs.add(proc)
+            try:
+                with open(tar, 'rb') as file:
+                    while buf := file.read(1 << 20):
+                        wait(len(buf))
+                        proc.stdin.write(buf)
+                proc.stdin.close()
+            except BrokenPipeError: pass
+            finally:
+                code, cpu = metrics.wait_cpu(proc)
+                procs.discard(proc)
+        stage.item(os.path.basename(tar), time.perf_counter() - start, os.path.getsize(tar), cpu, ok=(code == 0), error=(f'exit code {code}' if code != 0 else None))
+        if code == 0:
+            with lock, open(journal_path, 'a') as file:
+                file.write(' '.join(journal_entry(tar)) + '\n')
+        else:
+            with lock: print(f'({i+1}/{len(tarlist)}) {COLORS.RED}FAILED ({code}): {tar}{COLORS.END}')
+        return code
+    
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    try:
+        codes = list( executor.map(lambda x: extract(*x), todo) )
+        failed = len( [c for c in codes if c != 0] )
+        if failed > 0: print(f'{COLORS.RED}{failed} tar(s) failed{COLORS.END}')
+        return failed
+    finally:
+        # on exit (e.g. SIGINT) stop pending and running extractions; they are not journaled
+        executor.shutdown(wait=False, cancel_futures=True)
+        cancel_cmds(procs)
+        executor.shutdown(wait=True)
+        stage.end()
 
-def list_tar_contents(tarlist, remove_duplicates = False, print_progress=True):
+def scan_tar(path):
+    '''
+    returns list of (name, size, header offset, data offset, mtime) for all members of a tar
+    returns None if the tar can't be read
+    '''
+    try:
+        with tarfile.open(path) as tar:
+            return [ (m.name, m.size, m.offset, m.offset_data, m.mtime) for m in tar ]
+    except (tarfile.TarError, OSError):
+        return None
+
+def open_tar_index(index_path):
+    db = sqlite3.connect(index_path)
+    if 'mtime' not in [ row[1] for row in db.execute('PRAGMA table_info(members)') ]:
+        db.executescript('DROP TABLE IF EXISTS members; DROP TABLE IF EXISTS tars;') # index of an older version (without member mtimes), scanned again
+    db.executescript('''
+        CREATE TABLE IF NOT EXISTS tars (id INTEGER PRIMARY KEY, name TEXT UNIQUE, size INTEGER, mtime_ns INTEGER);
+        CREATE TABLE IF NOT EXISTS members (tar_id INTEGER, name TEXT, size INTEGER, header_offset INTEGER, data_offset INTEGER, mtime INTEGER);
+        CREATE INDEX IF NOT EXISTS members_tar ON members (tar_id);
+        CREATE INDEX IF NOT EXISTS members_name ON members (name);
+    ''')
+    return db
+
+def update_tar_index(tarlist, index_path, jobs = CHECK_JOBS, print_progress = True):
+    '''
+    bring the tar member index at index_path up to date and return the (open) database
+    tars are keyed by basename, size and mtime; only new or changed tars are scanned (in parallel)
+    '''
+    db = open_tar_index(index_path)
+    known = { name: (size, mtime_ns) for name, size, mtime_ns in db.execute('SELECT name, size, mtime_ns FROM tars') }
+    stale = []
+    for path in tarlist:
+        stat = os.stat(path)
+        if known.get(os.path.basename(path)) != (stat.st_size, stat.st_mtime_ns): stale.append( (path, stat) )
+    if print_progress: print(f'TAR index {index_path}: {len(tarlist) - len(stale)} tars up to date, {len(stale)} to scan')
+    if len(stale) == 0: return db
+    stage = metrics.stage('tar_index', len(stale))
+    with stage, ProcessPoolExecutor(max_workers=(jobs if jobs > 0 else None)) as pool:
+        results = pool.map(scan_tar, [path for path, _ in stale], chunksize=4)
+        for i, ((path, stat), members) in enumerate(zip(stale, results)):
+            name = os.path.basename(path)
+            stage.add(1, stat.st_size, failures=(members == None))
+            if members == None:
+                print(f'({i+1}/{len(stale)}) {COLORS.RED}Can\'t read {name}{COLORS.END}')
+                continue # not recorded, will be scanned again next time
+            with db: # one transaction per tar, so an interrupted update keeps its progress
+                db.execute('DELETE FROM members WHERE tar_id IN (SELECT id FROM tars WHERE name = ?)', (name,))
+                db.execute('DELETE FROM tars WHERE name = ?', (name,))
+                tar_id = db.execute('INSERT INTO tars (name, size, mtime_ns) VALUES (?, ?, ?)', (name, stat.st_size, stat.st_mtime_ns)).lastrowid
+                db.executemany('INSERT INTO members VALUES (?, ?, ?, ?, ?, ?)', ( (tar_id,) + m for m in members ))
+            if print_progress: print(f'({i+1}/{len(stale)}) Indexed {name}: {len(members)} files')
+    return db
+
+def list_tar_contents(tarlist, remove_duplicates = False, print_progress=True, index_path=None, jobs = CHECK_JOBS):
+    # index_path ... use (and update) the tar member index instead of reading all tar headers
     out = []
+    db = update_tar_index(tarlist, index_path, jobs, print_progress) if index_path else None
     for i, name in enumerate(tarlist):
-        tar = tarfile.open(name)
-        files = tar.getnames()
-        tar.close()
+        if db:
+            files = [ row[0] for row in db.execute('SELECT members.name FROM members JOIN tars ON members.tar_id = tars.id WHERE tars.name = ? ORDER BY header_offset', (os.path.basename(name),)) ]
+        else:
+            tar = tarfile.open(name)
+            files = tar.getnames()
+            tar.close()
         if remove_duplicates: files = list(set(files))
-        out = out + files
-        if print_progress: print(f'({i+1}/{len(tarlist)}) Listing {os.path.basename(name)}: {len(files)} files — {len(out)} total')
+        out.extend(files)
+        if print_progress and (not db or (i+1) % 1000 == 0 or i+1 == len(tarlist)):
+            print(f'({i+1}/{len(tarlist)}) Listing {os.path.basename(name)}: {len(files)} files — {len(out)} total')
+    if db: db.close()
     return out
 
+def parse_range(range_):
+    # '1501-3000' -> (1501, 3000), '42' -> (42, 42)
+    parts = range_.split('-')
+    from_ = int(parts[0])
+    to_ = int(parts[1]) if len(parts) > 1 else from_
+    return (from_, to_)
+
+MEMBER_SEQ = re.compile(rf'(?:{TAR_IMAGES_DIR}/(\d+)\.png|{TAR_META_DIR}/(\d+)\.json|{TAR_FRAMES_DIR}/(\d+)/\3_(\d+)\.png)') # images/NNNN.png, metadata/NNNN.json, frames/NNNN/NNNN_XXXX.png
+
+def member_seq(name):
+    # sequence number of a tar member (image, metadata or frame), None for other members
+    match = MEMBER_SEQ.fullmatch(name)
+    if not match: return None
+    return int( next(filter(None, match.groups())) )
+
+def extract_members(tarlist, dest_folder, index_path, from_, to_, keep_old = False, jobs = CHECK_JOBS):
+    '''
+    extract only the images, metadata and frames of sequences from_..to_
+    members are located with the tar member index and copied by seeking to their data offset,
+    so tars without any of these members aren't read at all, and others only partially
+    each file is written to a partial file first and moved into place once complete, with the member's mtime (like tar)
+    '''
+    db = update_tar_index(tarlist, index_path, jobs)
+    by_tar = {} # tar name -> [(member name, size, data offset, mtime)]
+    for dir in [TAR_IMAGES_DIR, TAR_META_DIR, TAR_FRAMES_DIR]:
+        # names are zero-padded to 4 digits, so a range on the name index covers a range of sequence numbers;
+        # beyond 9999 names get longer and don't sort by number, so the whole folder is read (and filtered by sequence number below)
+        bounds = (f'{dir}/{from_:04d}', f'{dir}/{to_+1:04d}') if to_ < 9999 else (f'{dir}/', f'{dir}/\uffff')
+        rows = db.execute('SELECT tars.name, members.name, members.size, members.data_offset, members.mtime FROM members JOIN tars ON members.tar_id = tars.id WHERE members.name >= ? AND members.name < ?', bounds)
+        for tar, name, size, offset, mtime in rows:
+            no = member_seq(name)
+            if no == None or no < from_ or no > to_: continue
+            by_tar.setdefault(tar, []).append( (name, size, offset, mtime) )
+    db.close()
+    folder = os.path.dirname(tarlist[0]) if len(tarlist) > 0 else ''
+    tars = [ name for name in map(os.path.basename, tarlist) if name in by_tar ] # sorted order, later tars overwrite earlier ones (like tar)
+    print(f'Sequences {from_}-{to_}: {sum(len(by_tar[t]) for t in tars)} files in {len(tars)}/{len(tarlist)} TAR files')
+    stage = metrics.stage('extract', len(tars))
+    for i, tar in enumerate(tars):
+        members = sorted(by_tar[tar], key=lambda x: x[2]) # read sequentially
+        print(f'({i+1}/{len(tars)}) Extracting {len(members)} files from {tar}')
+        start = time.perf_counter()
+        with open(os.path.join(folder, tar), 'rb') as src:
+            for name, size, offset, mtime in members:
+                path = os.path.join(dest_folder, name)
+                if keep_old and os.path.exists(path): continue
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                partfile = partial_path(path)
+                src.seek(offset)
+                try:
+                    with open(partfile, 'wb') as dst:
+                        remaining = size
+                        while remaining > 0:
+                            buf = src.read(min(remaining, 1 << 20))
+                            if len(buf) == 0: raise EOFError(f'{tar} truncated at {name}')
+                            dst.write(buf)
+                            remaining -= len(buf)
+                    os.replace(partfile, path)
+                finally:
+                    if os.path.exists(partfile): os.remove(partfile)
+                os.utime(path, (mtime, mtime))
+        stage.item(tar, time.perf_counter() - start, sum(size for name, size, offset, mtime in members), files=len(members))
+    stage.end()
+
 def filename_only(path, include_ext = True):
     filename = os.path.basename(path)
     if not include_ext:
@@ -194,38 +622,782 @@ def input_dir_type(dir):
     # assume tar folder (avoid listing)
     return 'tar'
 
-def create_contactsheets(pnglist, dest_folder, size = 500, border_w = 30, border_h = 8, tiles_x = 8, tiles_y = 5):
+def render_contactsheet(imgs, outfile, size = 500, border_w = 30, border_h = 8, tiles_x = 8, tiles_y = 5):
+    '''
+    render a contact sheet with Pillow, with the same layout as gm montage (see create_contactsheets):
+    tiles of size x size (+ borders) with the filename as label below, plus an outer border of border_w x (2*border_w - border_h)
+    '''
+    from PIL import Image, ImageDraw, ImageFont
+    try: font = ImageFont.truetype(SHEET_FONT, SHEET_POINTSIZE)
+    except OSError: font = ImageFont.load_default(SHEET_POINTSIZE)
+    ascent, descent = font.getmetrics()
+    label_h = ascent + descent
+    tile_w = size + 2 * border_w
+    tile_h = size + 2 * border_h + label_h
+    cols = min(len(imgs), tiles_x)
+    rows = math.ceil(len(imgs) / tiles_x)
+    outer_w, outer_h = border_w, 2 * border_w - border_h
+    sheet = Image.new('RGB', (cols * tile_w + 2 * outer_w, rows * tile_h + 2 * outer_h), 'white')
+    draw = ImageDraw.Draw(sheet)
+    for i, path in enumerate(imgs):
+        x = outer_w + (i % tiles_x) * tile_w
+        y = outer_h + (i // tiles_x) * tile_h
+        with Image.open(path) as img:
+            img.draft('RGB', (size, size)) # decode at reduced size where the format supports it (JPEG); PNGs need a full decode
+            img.thumbnail((size, size), Image.LANCZOS, reducing_gap=2.0) # fast integer reduce before resampling
+            img = img.convert('RGBA')
+            sheet.paste(img, (x + border_w + (size - img.width) // 2, y + border_h + (size - img.height) // 2), img)
+        label = filename_only(path, include_ext=False)
+        draw.text((x + tile_w // 2, y + border_h + size), label, fill='black', font=font, anchor='ma')
+    partfile = partial_path(outfile)
+    sheet.save(partfile, 'PNG')
+    os.replace(partfile, outfile)
+
+def create_contactsheets(pnglist, dest_folder, size = 500, border_w = 30, border_h = 8, tiles_x = 8, tiles_y = 5, jobs = SHEET_JOBS, journal = None, force = False, first_page = 0):
+    # sheets that are up to date in journal are skipped (unless force); first_page ... number of pages before pnglist (for numbering, when rendering part of the sheets)
+    # returns the number of failed sheets
     per_page = tiles_x * tiles_y
-    pages = math.ceil( len(pnglist) / per_page )
-    print(f'{pages} sheets, {per_page} images each')
-    
-    for i in range(pages):
-        imgs = pnglist[0:per_page] # take a batch
+    pages = [ pnglist[i:i+per_page] for i in range(0, len(pnglist), per_page) ]
+    print(f'{len(pages)} sheets, {per_page} images each')
+    try:
+        import PIL
+        renderer = 'pillow'
+    except ImportError:
+        print('Pillow not installed, using graphicsmagick')
+        renderer = 'gm'
+    settings = repr( (renderer, size, border_w, border_h, tiles_x, tiles_y, SHEET_POINTSIZE, SHEET_FONT) )
+    todo = [] # (page no, imgs, outfile, fingerprint)
+    for i, imgs in enumerate(pages):
         first = filename_only(imgs[0], include_ext=False)
         last = filename_only(imgs[-1], include_ext=False)
-        outfile = os.path.join(dest_folder, f'{SHEET_PREFIX}{i+1:03d}_{first}-{last}.png')
-        print(f'({i+1}/{pages}) {first}..{last} ({len(imgs)}) -> {outfile}')
-        run_cmd(f'gm montage -pointsize 30 -label \'%t\' -geometry {size}x{size}+{border_w}+{border_h} -tile {tiles_x}x{tiles_y} -background white -depth 8 {" ".join(imgs)} miff:- | gm convert - -bordercolor white -border {border_w}x{2*border_w-border_h} "{outfile}"')
-        pnglist = pnglist[per_page:] # rest of list
+        outfile = os.path.join(dest_folder, f'{SHEET_PREFIX}{first_page+i+1:03d}_{first}-{last}.png')
+        fp = fingerprint(imgs, os.path.dirname(imgs[0]), settings) if journal else None
+        if force or not up_to_date(journal, outfile, fp): todo.append( (i, imgs, outfile, fp) )
+    if len(todo) < len(pages): print(f'Skipping {len(pages) - len(todo)} up to date sheets')
+    
+    stage = metrics.stage('sheets', len(todo))
+    failed = 0
+    if renderer == 'gm':
+        for i, imgs, outfile, fp in todo:
+            print(f'({i+1}/{len(pages)}) {filename_only(imgs[0], False)}..{filename_only(imgs[-1], False)} ({len(imgs)}) -> {outfile}')
+            start = time.perf_counter()
+            code = run_cmd(f'gm montage -pointsize {SHEET_POINTSIZE} -label \'%t\' -geometry {size}x{size}+{border_w}+{border_h} -tile {tiles_x}x{tiles_y} -background white -depth 8 {" ".join(imgs)} miff:- | gm convert - -bordercolor white -border {border_w}x{2*border_w-border_h} "{outfile}"')
+            stage.item(os.path.basename(outfile), time.perf_counter() - start, ok=(code == 0))
+            if code == 0: record_output(journal, outfile, fp)
+            else: failed += 1
+        stage.end()
+        return failed
+    
+    with stage, ProcessPoolExecutor(max_workers=(jobs if jobs > 0 else None)) as pool:
+        futures = [ pool.submit(metrics.timed_call, render_contactsheet, imgs, outfile, size, border_w, border_h, tiles_x, tiles_y) for i, imgs, outfile, fp in todo ]
+        try:
+            for (i, imgs, outfile, fp), future in zip(todo, futures): # report in order
+                try:
+                    result, seconds, cpu = future.result()
+                    record_output(journal, outfile, fp)
+                    stage.item(os.path.basename(outfile), seconds, os.path.getsize(outfile), cpu)
+                    print(f'({i+1}/{len(pages)}) {filename_only(imgs[0], False)}..{filename_only(imgs[-1], False)} ({len(imgs)}) -> {outfile}')
+                except Exception as e:
+                    stage.item(os.path.basename(outfile), ok=False, error=str(e))
+                    print(f'({i+1}/{len(pages)}) {COLORS.RED}FAILED: {outfile} ({e}){COLORS.END}')
+                    failed += 1
+        finally:
+            for future in futures: future.cancel()
+    return failed
 
-def ffmpeg(pattern, in_fps, out_fps, target='out.mp4'):
-    scale = f'-filter:v scale={MOVIE_RES[0]}:{MOVIE_RES[1]}:force_divisible_by=2:force_original_aspect_ratio=decrease' if MOVIE_RES and (MOVIE_RES[0] > 0 or MOVIE_RES[1] > 0) else ''
+def scale_filter(res):
+    return f'scale={res[0]}:{res[1]}:force_divisible_by=2:force_original_aspect_ratio=decrease' if res and (res[0] > 0 or res[1] > 0) else None
+
+def ffmpeg_cmd(pattern, in_fps, out_fps, target='out.mp4', threads=0, quiet=False, encode=None, res=None):
+    # pattern ... image2 filename pattern, or None to read PNGs from stdin (image2pipe; loops need to be piped in as well)
+    # encode ... (output options, extension) of a profile, default MOVIE_ENCODE; res ... default MOVIE_RES
+    encode = encode or MOVIE_ENCODE
+    scale = f'-filter:v {scale_filter(res or MOVIE_RES)}' if scale_filter(res or MOVIE_RES) else ''
     frames = int(MOVIE_FRAMES * MOVIE_LOOPS)
-    # signals don't seem to work with os.system, see: https://stackoverflow.com/a/27083472
-    if MOVIE_ENCODE[1] == 'gif':
-        return run_cmd(f'ffmpeg -y -f image2 -framerate {in_fps} -i \'{pattern}\' {MOVIE_ENCODE[0]} \'{target}\'')
+    t = f'-threads {threads}' if threads > 0 else ''
+    v = '-v error -nostats' if quiet else ''
+    if pattern == None:
+        inp = f'-f image2pipe -framerate {in_fps} -i -'
+        n = ''
+    else:
+        inp = f'-f image2 {"-loop 1 " if encode[1] != "gif" else ""}-framerate {in_fps} -i \'{pattern}\''
+        n = '-nostdin'
+    if encode[1] == 'gif':
+        return f'ffmpeg -y {n} {v} {inp} {encode[0]} {t} \'{target}\''
+    else:
+        return f'ffmpeg -y {n} {v} {inp} -r {out_fps} -frames:v {frames} {encode[0]} {scale} {t} \'{target}\''
+
+def ffmpeg_multi_cmd(pattern, in_fps, out_fps, targets, threads=0, quiet=False, frame_size=None):
+    '''
+    single ffmpeg process that decodes the frames once, and splits them to several outputs (each with its own scale and encoder)
+    targets ... list of (encode, res, target)
+    loops (MOVIE_LOOPS > 1) are served from memory by the loop filter, if MOVIE_FRAMES decoded frames of frame_size (w, h) fit into MOVIE_LOOP_BUFFER,
+    otherwise frames are read from disk again (image2 -loop 1)
+    '''
+    frames = int(MOVIE_FRAMES * MOVIE_LOOPS)
+    loops = math.ceil(MOVIE_LOOPS)
+    in_memory = loops > 1 and frame_size != None and MOVIE_FRAMES * frame_size[0] * frame_size[1] * 4 <= MOVIE_LOOP_BUFFER
+    t = f'-threads {threads}' if threads > 0 else ''
+    v = '-v error -nostats' if quiet else ''
+    inp = f'-f image2 {"-loop 1 " if loops > 1 and not in_memory else ""}-framerate {in_fps} -i \'{pattern}\''
+    graph = f'[0:v]{f"loop=loop={loops - 1}:size={MOVIE_FRAMES}:start=0," if in_memory else ""}split={len(targets)}' + ''.join( f'[s{i}]' for i in range(len(targets)) )
+    outs = []
+    for i, (encode, res, target) in enumerate(targets):
+        if encode[1] == 'gif':
+            # palette filter of the profile, at this output's resolution
+            graph += f';[s{i}]' + MOVIE_GIF_FILTER.format(fps=out_fps, w=res[0], h=res[1], l=f'o{i}') + f'[v{i}]'
+            options = re.sub(r'-vf "[^"]*" *', '', encode[0])
+            outs.append( f'-map \'[v{i}]\' -frames:v {MOVIE_FRAMES} {options} {t} \'{target}\'' )
+        else:
+            graph += f';[s{i}]{scale_filter(res) or "null"}[v{i}]'
+            outs.append( f'-map \'[v{i}]\' -r {out_fps} -frames:v {frames} {encode[0]} {t} \'{target}\'' )
+    return f'ffmpeg -y -nostdin {v} {inp} -filter_complex \'{graph}\' {" ".join(outs)}'
+
+def ffmpeg_segment_cmd(pattern, in_fps, out_fps, target, start, end, threads=0, quiet=False, encode=None, res=None):
+    # frames start..end-1 of the movie ffmpeg_cmd encodes (MOVIE_FRAMES, looped), with timestamps starting at 0; needs in_fps == out_fps (movie frame n is png n % MOVIE_FRAMES)
+    # the pngs are opened at the segment's first frame (image2 -start_number), so no frames before it are decoded;
+    # a segment that wraps around the end of the sequence continues with a second input from frame 0 (looped), joined with the concat filter
+    encode = encode or MOVIE_ENCODE
+    scale = scale_filter(res or MOVIE_RES)
+    t = f'-threads {threads}' if threads > 0 else ''
+    v = '-v error -nostats' if quiet else ''
+    first = start % MOVIE_FRAMES
+    inp = f'-f image2 -start_number {first} -framerate {in_fps} -i \'{pattern}\''
+    if end - start > MOVIE_FRAMES - first:
+        inp += f' -f image2 -loop 1 -framerate {in_fps} -i \'{pattern}\''
+        vf = '-filter_complex \'[0:v][1:v]concat=n=2' + (f',{scale}' if scale else '') + '\''
     else:
-        return run_cmd(f'ffmpeg -y -f image2 -loop 1 -framerate {in_fps} -i \'{pattern}\' -r {out_fps} -frames:v {frames} {MOVIE_ENCODE[0]} {scale} \'{target}\'')
+        vf = f'-filter:v {scale}' if scale else ''
+    return f'ffmpeg -y -nostdin {v} {inp} {vf} -r {out_fps} -frames:v {end - start} {encode[0]} {t} \'{target}\''
+
+def profile_gop(encode):
+    # fixed keyframe interval of a profile's output options (x264 keyint, -g), None if the encoder decides
+    match = re.search(r'(?:keyint=|-g )(\d+)', encode[0])
+    return int(match[1]) if match else None
+
+def segment_ranges(frames, segments, gop):
+    # split frames into at most segments ranges (start, end), each starting at a multiple of gop
+    size = math.ceil(frames / max(1, segments) / gop) * gop
+    return [ (start, min(start + size, frames)) for start in range(0, frames, size) ]
+
+def encode_segments(pattern, target, segments, threads = 0, procs = None, encode = None, res = None):
+    '''
+    encode a movie as GOP aligned segments in parallel, and join them without re-encoding (concat demuxer)
+    the joined movie is checked for the frame count, duration and evenly spaced timestamps of a single-pass encode (see mp4_error, mp4_timestamps_error)
+    threads ... thread budget, split across segments (0 ... let ffmpeg decide)
+    returns CompletedProcess (with output of the failed step, and cpu of all steps)
+    '''
+    procs = procs if procs != None else set()
+    ranges = segment_ranges(int(MOVIE_FRAMES * MOVIE_LOOPS), segments, profile_gop(encode or MOVIE_ENCODE))
+    segment_threads = max(1, threads // len(ranges)) if threads > 0 else 0
+    folder = tempfile.mkdtemp(prefix='.segments_', dir=os.path.dirname(target) or '.') # hidden, beside the target
+    try:
+        paths = [ os.path.join(folder, f'{i:03d}.mp4') for i in range(len(ranges)) ]
+        def encode_segment(i):
+            return run_cmd_cancelable(ffmpeg_segment_cmd(pattern, MOVIE_INPUT_FPS, MOVIE_OUTPUT_FPS, paths[i], *ranges[i], segment_threads, True, encode, res), procs, capture_output=True)
+        with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+            results = list( pool.map(encode_segment, range(len(ranges))) )
+        cpu = sum( r.cpu or 0 for r in results )
+        for i, r in enumerate(results):
+            if r.returncode != 0:
+                r.stdout = f'segment {i+1}/{len(ranges)} (frames {ranges[i][0]}-{ranges[i][1]-1}): {(r.stdout or "").strip()}'
+                r.cpu = cpu
+                return r
+        list_path = os.path.join(folder, 'segments.txt')
+        with open(list_path, 'w') as file:
+            for path in paths: file.write(f"file '{path}'\n")
+        join = run_cmd_cancelable(f'ffmpeg -y -nostdin -v error -f concat -safe 0 -i \'{list_path}\' -c copy -movflags +faststart \'{target}\'', procs, capture_output=True)
+        join.cpu = cpu + (join.cpu or 0)
+        if join.returncode != 0: return join
+        error = mp4_error(target) or mp4_timestamps_error(target)
+        if error:
+            join.returncode = 1
+            join.stdout = f'joined movie: {error}'
+        return join
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+def png_size(path):
+    # (width, height) from the IHDR chunk, or None
+    try:
+        with open(path, 'rb') as file: data = file.read(24)
+    except OSError:
+        return None
+    if len(data) < 24 or not data.startswith(PNG_SIGNATURE): return None
+    return struct.unpack('>II', data[16:24])
+
+def parse_outputs(spec):
+    '''
+    comma separated profile[@resolution] (e.g. x264_veryslow@3840,x264_youtube@1080,gif@540x540) -> list of (profile, res, folder name)
+    resolution ... width (square) or WxH, default MOVIE_RES
+    '''
+    out = []
+    for item in spec.split(','):
+        name, _, res = item.strip().partition('@')
+        if res == '': size = MOVIE_RES
+        elif 'x' in res: size = tuple( int(x) for x in res.split('x') )
+        else: size = (int(res), int(res))
+        out.append( (name, size, f'{OUT_MOVIES_DIR}_{name}' + (f'_{res}' if res else '')) )
+    return out
+
+def ffmpeg(pattern, in_fps, out_fps, target='out.mp4', threads=0):
+    # signals don't seem to work with os.system, see: https://stackoverflow.com/a/27083472
+    return run_cmd(ffmpeg_cmd(pattern, in_fps, out_fps, target, threads))
+
+def ffmpeg_encoders():
+    # names of the encoders the local ffmpeg was built with (ffmpeg -encoders), or None if ffmpeg can't be run
+    try:
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'], capture_output=True, text=True)
+    except OSError:
+        return None
+    if result.returncode != 0: return None
+    lines = result.stdout.splitlines()
+    start = next( (i + 1 for i, line in enumerate(lines) if line.strip().startswith('---')), 0 ) # list follows the legend
+    return set( line.split()[1] for line in lines[start:] if len(line.split()) > 1 )
+
+def encoder_works(encoder):
+    # built in encoders may still be unusable (e.g. hw encoders without the hardware): encode a few frames of a test source
+    cmd = ['ffmpeg', '-nostdin', '-v', 'error', '-f', 'lavfi', '-i', 'testsrc=size=256x256:rate=25:duration=0.2', '-c:v', encoder, '-pix_fmt', 'rgb8' if encoder == 'gif' else 'yuv420p', '-f', 'null', '-']
+    try: return subprocess.run(cmd, capture_output=True).returncode == 0
+    except OSError: return False
+
+def usable_profiles(encoders, names = None):
+    # profiles (of names, default all, in order) whose encoder is built in and works
+    works = {}
+    out = []
+    for name in (names if names != None else MOVIE_PROFILES):
+        encoder = MOVIE_PROFILES[name][0]
+        if encoder not in encoders: continue
+        if encoder not in works: works[encoder] = encoder_works(encoder)
+        if works[encoder]: out.append(name)
+    return out
+
+def read_calibration(path):
+    # host -> profile -> results (see calibrate_profiles)
+    try:
+        with open(path) as file: return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+def select_profile(name, encoders, calibration_path = None, max_size = 0):
+    '''
+    returns the name of a profile the local ffmpeg can encode with, or None
+    name ... profile name, 'auto' (first usable of MOVIE_PROFILE_ORDER) or 'fastest' (highest frames/s calibrated on this host, with movies no larger than max_size bytes if > 0)
+    '''
+    if name == 'fastest':
+        results = read_calibration(calibration_path).get(socket.gethostname(), {}) if calibration_path else {}
+        candidates = [ (r['fps'], p) for p, r in results.items() if p in MOVIE_PROFILES and r['ok'] and (max_size <= 0 or r['bytes'] <= max_size) ]
+        for fps, p in sorted(candidates, reverse=True):
+            if len(usable_profiles(encoders, [p])) > 0: return p
+        print(f'{COLORS.YELLOW}No calibrated profile for {socket.gethostname()}{" within " + str(max_size) + " bytes" if max_size > 0 else ""} (see --calibrate), using auto{COLORS.END}')
+        name = 'auto'
+    if name == 'auto':
+        usable = usable_profiles(encoders, MOVIE_PROFILE_ORDER)
+        return usable[0] if len(usable) > 0 else None
+    return name if len(usable_profiles(encoders, [name])) > 0 else None
+
+def calibrate_profiles(folder, profiles, calibration_path, threads = MOVIE_THREADS):
+    '''
+    encode the frames in folder with each profile, and record frames/s and movie size for this host in calibration_path (json)
+    returns results: profile -> { fps, bytes, seconds, cpu, ok }
+    '''
+    pattern = os.path.join(folder, f'{os.path.basename(folder)}_%04d.png')
+    in_frames = len(list_files(folder, '*.png'))
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, name in enumerate(profiles):
+            encoder, options, ext = MOVIE_PROFILES[name]
+            outfile = os.path.join(tmp, f'{name}.{ext}')
+            print(f'({i+1}/{len(profiles)}) {name} ({encoder})', end=' ', flush=True)
+            start = time.perf_counter()
+            result = run_cmd_cancelable(ffmpeg_cmd(pattern, MOVIE_INPUT_FPS, MOVIE_OUTPUT_FPS, outfile, threads, quiet=True, encode=(options, ext)), set(), capture_output=True)
+            seconds = time.perf_counter() - start
+            frames = in_frames if ext == 'gif' else int(MOVIE_FRAMES * MOVIE_LOOPS)
+            ok = result.returncode == 0 and os.path.exists(outfile)
+            size = os.path.getsize(outfile) if ok else 0
+            results[name] = { 'fps': round(frames / seconds, 2) if ok else 0, 'bytes': size, 'seconds': round(seconds, 3), 'cpu': round(result.cpu or 0, 3), 'ok': ok, 'date': datetime.datetime.now().isoformat(timespec='seconds') }
+            if ok: print(f'{frames / seconds:.1f} frames/s, {size / 1_000_000:.2f} MB, cpu {result.cpu or 0:.1f}s')
+            else: print(f'{COLORS.RED}FAILED{COLORS.END} {(result.stdout or "").strip()}')
+    calibration = read_calibration(calibration_path)
+    calibration.setdefault(socket.gethostname(), {}).update(results)
+    with open(calibration_path, 'w') as file: json.dump(calibration, file, indent=2, sort_keys=True)
+    return results
 
-def create_movies(png_folders, dest_folder):
-    for i, folder in enumerate(png_folders):
+def partial_path(path):
+    # hidden sibling file to write to, before moving to path once complete (hidden files are ignored by list_files and list_files_recursive)
+    folder, name = os.path.split(path)
+    base, ext = os.path.splitext(name)
+    return os.path.join(folder, f'.{base}.part{ext}')
+
+def open_build_journal(folder):
+    db = sqlite3.connect(os.path.join(folder, BUILD_JOURNAL_FILE))
+    db.execute('CREATE TABLE IF NOT EXISTS outputs (output TEXT PRIMARY KEY, fingerprint TEXT, files TEXT)')
+    return db
+
+def fingerprint(inputs, root, settings = ''):
+    # hash of settings and input files (paths relative to root, sizes, mtimes)
+    h = hashlib.sha1(settings.encode())
+    for path in sorted(inputs):
+        stat = os.stat(path)
+        h.update(f'\0{os.path.relpath(path, root)}\0{stat.st_size}\0{stat.st_mtime_ns}'.encode())
+    return h.hexdigest()
+
+def file_stats(files):
+    out = []
+    for path in files:
+        stat = os.stat(path)
+        out.append( [path, stat.st_size, stat.st_mtime_ns] )
+    return out
+
+def up_to_date(journal, output, fp):
+    '''
+    true if output was recorded with fingerprint fp, and its files are unchanged since
+    output ... path of the output (a single file, or the first file of a multi-file output)
+    '''
+    if journal == None: return False
+    row = journal.execute('SELECT fingerprint, files FROM outputs WHERE output = ?', (os.path.abspath(output),)).fetchone()
+    if row == None or row[0] != fp: return False
+    try:
+        return file_stats( path for path, size, mtime_ns in json.loads(row[1]) ) == json.loads(row[1])
+    except FileNotFoundError:
+        return False
+
+def record_output(journal, output, fp, files = None):
+    # files ... all files making up the output (default: output itself)
+    if journal == None: return
+    with journal:
+        journal.execute('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?)', (os.path.abspath(output), fp, json.dumps(file_stats(files if files != None else [output]))))
+
+def movie_settings(encode = None, res = None):
+    return repr( (encode or MOVIE_ENCODE, res or MOVIE_RES, MOVIE_FRAMES, MOVIE_LOOPS, MOVIE_INPUT_FPS, MOVIE_OUTPUT_FPS) )
+
+def create_movies(png_folders, dest_folder, jobs = MOVIE_JOBS, threads = MOVIE_THREADS, journal = None, force = False, on_done = None, outputs = None, segments = MOVIE_SEGMENTS):
+    '''
+    encode up to jobs movies concurrently; the thread budget (0 ... number of CPUs) is split evenly across jobs
+    movies are written to a hidden partial file first and only moved into place when ffmpeg succeeds
+    movies that are up to date in journal are skipped (unless force)
+    on_done(folder, outfile, ok) ... called for each movie once it's finished (or skipped), in order (outfile of the first output)
+    outputs ... list of (encode, res, folder) to encode each sequence to, in one pass (see ffmpeg_multi_cmd); default MOVIE_ENCODE and MOVIE_RES to dest_folder
+    segments ... encode each (single, mp4) movie as this many segments in parallel (see encode_segments), using the movie's share of the thread budget;
+                 only for profiles with a fixed keyframe interval (see profile_gop), others are encoded in a single pass
+    returns the number of failed movies
+    '''
+    outputs = outputs or [ (MOVIE_ENCODE, MOVIE_RES, dest_folder) ]
+    jobs = max(1, jobs)
+    budget = threads if threads > 0 else (os.cpu_count() or 1)
+    job_threads = max(1, budget // jobs) if jobs > 1 or threads > 0 else 0 # 0 ... let ffmpeg decide
+    if jobs > 1: print(f'Encoding {jobs} movies concurrently, {job_threads} thread(s) each')
+    if segments > 1 and profile_gop(outputs[0][0]): print(f'Encoding each movie as {len(segment_ranges(int(MOVIE_FRAMES * MOVIE_LOOPS), segments, profile_gop(outputs[0][0])))} segments in parallel, {max(1, budget // jobs // segments)} thread(s) each')
+    procs = set() # running ffmpeg processes
+    
+    def encode(folder, todo):
+        # todo ... list of (encode, res, outfile, fp)
         seq = os.path.basename(folder)
-        outfile = os.path.join(dest_folder, f'{seq}.{MOVIE_ENCODE[1]}')
         pattern = os.path.join(folder, f'{seq}_%04d.png')
-        print()
-        print(f'({i+1}/{len(png_folders)}) {folder} -> {outfile}')
-        code = ffmpeg(pattern, MOVIE_INPUT_FPS, MOVIE_OUTPUT_FPS, outfile)
-        print_elapsed()
+        partfiles = [ partial_path(outfile) for settings, res, outfile, fp in todo ]
+        # quiet, and capture output with multiple jobs, so output from concurrent encodes doesn't interleave
+        segmented = segments > 1 and len(todo) == 1 and todo[0][0][1] == 'mp4' and profile_gop(todo[0][0]) != None
+        if segmented:
+            cmd = None
+        elif len(todo) == 1 and MOVIE_LOOPS <= 1:
+            cmd = ffmpeg_cmd(pattern, MOVIE_INPUT_FPS, MOVIE_OUTPUT_FPS, partfiles[0], job_threads, quiet=(jobs > 1), encode=todo[0][0], res=todo[0][1])
+        else:
+            targets = [ (settings, res, partfile) for (settings, res, outfile, fp), partfile in zip(todo, partfiles) ]
+            cmd = ffmpeg_multi_cmd(pattern, MOVIE_INPUT_FPS, MOVIE_OUTPUT_FPS, targets, job_threads, quiet=(jobs > 1), frame_size=png_size(pattern % 0))
+        try:
+            start = time.perf_counter()
+            if segmented: result = encode_segments(pattern, partfiles[0], segments, max(1, budget // jobs), procs, todo[0][0], todo[0][1])
+            else: result = run_cmd_cancelable(cmd, procs, capture_output=(jobs > 1))
+            result.seconds = time.perf_counter() - start
+            if result.returncode == 0:
+                for (settings, res, outfile, fp), partfile in zip(todo, partfiles): os.replace(partfile, outfile)
+            return result
+        finally:
+            for partfile in partfiles:
+                if os.path.exists(partfile): os.remove(partfile)
+    
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    stage = metrics.stage('movies', len(png_folders))
+    try:
+        futures = []
+        skipped = 0
+        for folder in png_folders:
+            inputs = list_files(folder, '*.png') if journal else []
+            todo = [] # outputs that aren't up to date
+            for settings, res, out_folder in outputs:
+                outfile = os.path.join(out_folder, f'{os.path.basename(folder)}.{settings[1]}')
+                fp = fingerprint(inputs, folder, movie_settings(settings, res)) if journal else None
+                if force or not up_to_date(journal, outfile, fp): todo.append( (settings, res, outfile, fp) )
+            outfile = os.path.join(outputs[0][2], f'{os.path.basename(folder)}.{outputs[0][0][1]}')
+            if len(todo) == 0:
+                skipped += 1
+                stage.add(1)
+                if on_done: on_done(folder, outfile, True)
+                continue
+            futures.append( (folder, outfile, todo, executor.submit(encode, folder, todo)) )
+        if skipped > 0: print(f'Skipping {skipped} up to date movies')
+        # report in order
+        failed = []
+        for i, (folder, outfile, todo, future) in enumerate(futures):
+            outfiles = ', '.join( t[2] for t in todo )
+            if jobs == 1: print(f'\n({i+1}/{len(futures)}) {folder} -> {outfiles}')
+            result = future.result()
+            if jobs > 1: print(f'\n({i+1}/{len(futures)}) {folder} -> {outfiles}')
+            stage.item(os.path.basename(folder), result.seconds, sum( os.path.getsize(t[2]) for t in todo ) if result.returncode == 0 else 0, result.cpu, ok=(result.returncode == 0), error=(f'exit code {result.returncode}' if result.returncode != 0 else None), outputs=len(todo))
+            if result.returncode == 0:
+                for settings, res, path, fp in todo: record_output(journal, path, fp)
+            else:
+                failed.append(os.path.basename(folder))
+                if result.stdout: print(result.stdout.rstrip())
+                print(f'   {COLORS.RED}FAILED ({result.returncode}){COLORS.END}')
+            if on_done: on_done(folder, outfile, result.returncode == 0)
+            print_elapsed()
+        if len(failed) > 0:
+            print(f'\n{COLORS.RED}{len(failed)} movie(s) failed:{COLORS.END} {", ".join(failed)}')
+        return len(failed)
+    finally:
+        # on exit (e.g. SIGINT) stop pending and running encodes; partial files are removed by the workers
+        executor.shutdown(wait=False, cancel_futures=True)
+        cancel_cmds(procs)
+        executor.shutdown(wait=True)
+        stage.end()
+
+FRAME_MEMBER = re.compile(TAR_FRAMES_DIR + r'/(\d+)/\1_(\d+)\.png') # frames/NNNN/NNNN_XXXX.png
+
+def create_movies_from_tars(tarlist, dest_folder, from_ = 0, to_ = 0, jobs = MOVIE_JOBS, threads = MOVIE_THREADS, journal = None, force = False, index_path = None, index_jobs = CHECK_JOBS):
+    '''
+    encode movies by piping frames directly from the tars into ffmpeg (image2pipe), without extracting them to disk
+    tars are read once, sequentially, in sorted order; sequences may continue across tar boundaries
+    a sequence is finished when a frame of another sequence (or the end of the last tar) is reached
+    with jobs > 1, the next sequences are fed while previous ones are still encoding
+    from_, to_ ... only the specified sequence numbers
+    frames have to be in order within a sequence; duplicate frames are skipped, frames out of order (after a later frame of the same
+    sequence, or after the sequence was finished) can't be piped anymore and are reported, the movie fails as incomplete
+    journal, index_path ... movies that are up to date in journal are skipped (unless force), tars with only frames of those aren't read;
+                            sequences are fingerprinted by their frame members in the tar index (see stream_fingerprints)
+    returns the number of failed movies
+    '''
+    jobs = max(1, jobs)
+    budget = threads if threads > 0 else (os.cpu_count() or 1)
+    job_threads = max(1, budget // jobs) if jobs > 1 or threads > 0 else 0
+    loops = math.ceil(MOVIE_LOOPS) if MOVIE_ENCODE[1] != 'gif' else 1 # image2pipe can't loop, so frames are piped multiple times
+    procs = set() # running ffmpeg processes
+    started = set() # sequence numbers, that have been fed already
+    in_flight = [] # encodes that have all their frames, oldest first
+    current = None # encode currently being fed
+    failed = []
+    late = {} # sequence number -> number of frames found after the sequence was finished
+    count = 0
+    fps = {} # sequence number -> fingerprint
+    skip = set() # up to date sequence numbers
+    if journal != None and index_path:
+        db = update_tar_index(tarlist, index_path, index_jobs)
+        fps, tars = stream_fingerprints(db, from_, to_)
+        db.close()
+        skip = { no for no, fp in fps.items() if not force and up_to_date(journal, os.path.join(dest_folder, f'{no:04d}.{MOVIE_ENCODE[1]}'), fp) }
+        if len(skip) > 0:
+            needed = { name for no, names in tars.items() if no not in skip for name in names }
+            tarlist = [ path for path in tarlist if os.path.basename(path) in needed ]
+            print(f'Skipping {len(skip)} up to date movies, reading {len(tarlist)} tars')
+    stage = metrics.stage('movies')
+    
+    def start(no):
+        seq = f'{no:04d}'
+        outfile = os.path.join(dest_folder, f'{seq}.{MOVIE_ENCODE[1]}')
+        partfile = partial_path(outfile)
+        log = tempfile.TemporaryFile(mode='w+') # not a pipe, so ffmpeg can't block on a full stderr while we write to stdin
+        cmd = ffmpeg_cmd(None, MOVIE_INPUT_FPS, MOVIE_OUTPUT_FPS, partfile, job_threads, quiet=True)
+        proc = subprocess.Popen(cmd, shell=True, start_new_session=True, stdin=subprocess.PIPE, stdout=log, stderr=log)
+        procs.add(proc)
+        started.add(no)
+        return { 'no': no, 'seq': seq, 'outfile': outfile, 'partfile': partfile, 'proc': proc, 'log': log, 'frame': -1, 'frames': set(), 'unordered': [], 'buffer': [], 'broken': False, 'start': time.perf_counter() }
+    
+    def feed(enc, data):
+        if enc['broken']: return
+        try: enc['proc'].stdin.write(data)
+        except BrokenPipeError: enc['broken'] = True # ffmpeg exited early; reported when finished
+    
+    def finish(enc):
+        for i in range(loops - 1):
+            for data in enc['buffer']: feed(enc, data)
+        enc['buffer'] = []
+        try: enc['proc'].stdin.close()
+        except BrokenPipeError: pass
+        in_flight.append(enc)
+    
+    def reap(limit):
+        nonlocal count
+        while len(in_flight) > limit:
+            enc = in_flight.pop(0)
+            code, cpu = metrics.wait_cpu(enc['proc'])
+            procs.discard(enc['proc'])
+            count += 1
+            ok = code == 0 and len(enc['frames']) == MOVIE_FRAMES and len(enc['unordered']) == 0
+            stage.item(enc['seq'], time.perf_counter() - enc['start'], os.path.getsize(enc['partfile']) if ok else 0, cpu, ok=ok, error=(None if ok else f'exit code {code}, {len(enc["frames"])} frames, {len(enc["unordered"])} out of order'))
+            print(f'\n({count}) {enc["seq"]}: {len(enc["frames"])} frames -> {enc["outfile"]}')
+            if ok:
+                os.replace(enc['partfile'], enc['outfile'])
+                if enc['no'] in fps: record_output(journal, enc['outfile'], fps[enc['no']])
+            else:
+                failed.append(enc['seq'])
+                enc['log'].seek(0)
+                log = enc['log'].read().rstrip()
+                if log: print(log)
+                if len(enc['unordered']) > 0: print(f'   {COLORS.RED}OUT OF ORDER ({len(enc["unordered"])} frame(s) not encoded: {", ".join( f"{frame} after {after}" for frame, after in enc["unordered"][:10] )}{", ..." if len(enc["unordered"]) > 10 else ""}){COLORS.END}')
+                if code == 0: print(f'   {COLORS.RED}INCOMPLETE ({len(enc["frames"])}/{MOVIE_FRAMES} frames){COLORS.END}')
+                else: print(f'   {COLORS.RED}FAILED ({code}){COLORS.END}')
+            enc['log'].close()
+            if os.path.exists(enc['partfile']): os.remove(enc['partfile'])
+            print_elapsed()
+    
+    try:
+        for i, name in enumerate(tarlist):
+            print(f'({i+1}/{len(tarlist)}) Reading {name}')
+            with tarfile.open(name, mode='r|') as tar: # stream mode: single sequential read
+                for member in tar:
+                    match = FRAME_MEMBER.fullmatch(member.name)
+                    if not match or not member.isfile(): continue
+                    no, frame = int(match[1]), int(match[2])
+                    if (from_ > 0 and no < from_) or (to_ > 0 and no > to_) or no in skip: continue
+                    if current == None or current['no'] != no:
+                        if no in started:
+                            late[no] = late.get(no, 0) + 1 # frame of a finished sequence (e.g. tars out of order)
+                            continue
+                        if current != None: finish(current)
+                        reap(jobs - 1)
+                        current = start(no)
+                    if frame in current['frames']: continue # duplicate
+                    if frame < current['frame']:
+                        current['unordered'].append( (frame, current['frame']) ) # a later frame was piped already
+                        continue
+                    data = tar.extractfile(member).read()
+                    feed(current, data)
+                    if loops > 1: current['buffer'].append(data)
+                    current['frame'] = frame
+                    current['frames'].add(frame)
+        if current != None:
+            finish(current)
+            current = None
+        reap(0)
+        if len(late) > 0:
+            print(f'\n{COLORS.RED}{sum(late.values())} frame(s) found after their sequence was finished (out of order across tars), not encoded:{COLORS.END} {", ".join( f"{no:04d} ({n})" for no, n in sorted(late.items()) )}')
+        if len(failed) > 0:
+            print(f'\n{COLORS.RED}{len(failed)} movie(s) failed:{COLORS.END} {", ".join(failed)}')
+        return len(failed)
+    finally:
+        # on exit (e.g. SIGINT) stop running encodes and remove partial files
+        cancel_cmds(procs)
+        for enc in in_flight + ([current] if current != None else []):
+            enc['proc'].wait()
+            enc['log'].close()
+            if os.path.exists(enc['partfile']): os.remove(enc['partfile'])
+        stage.end()
+
+def stream_fingerprints(db, from_ = 0, to_ = 0):
+    '''
+    fingerprints of sequences for movies encoded from tars (settings, and name and size of each frame member and the tar containing it),
+    from the tar member index db; returns (sequence number -> fingerprint, sequence number -> set of tar basenames)
+    '''
+    entries = {}
+    tars = {}
+    for tar, tar_size, tar_mtime_ns, name, size in db.execute('SELECT tars.name, tars.size, tars.mtime_ns, members.name, members.size FROM members JOIN tars ON members.tar_id = tars.id WHERE members.name >= ? AND members.name < ?', (f'{TAR_FRAMES_DIR}/', f'{TAR_FRAMES_DIR}0')):
+        match = FRAME_MEMBER.fullmatch(name)
+        if not match: continue
+        no = int(match[1])
+        if (from_ > 0 and no < from_) or (to_ > 0 and no > to_): continue
+        entries.setdefault(no, []).append(f'\0{name}\0{size}\0{tar}\0{tar_size}\0{tar_mtime_ns}')
+        tars.setdefault(no, set()).add(tar)
+    fps = {}
+    for no, lines in entries.items():
+        h = hashlib.sha1(repr( ('stream', movie_settings()) ).encode())
+        for line in sorted(lines): h.update(line.encode())
+        fps[no] = h.hexdigest()
+    return fps, tars
+
+def frame_sizes(db, from_ = 0, to_ = 0):
+    # bytes of frames per sequence number, according to the tar member index (members in several tars are counted once)
+    members = dict( db.execute('SELECT name, size FROM members WHERE name >= ? AND name < ?', (f'{TAR_FRAMES_DIR}/', f'{TAR_FRAMES_DIR}0')) )
+    sizes = {}
+    for name, size in members.items():
+        no = member_seq(name)
+        if no == None or (from_ > 0 and no < from_) or (to_ > 0 and no > to_): continue
+        sizes[no] = sizes.get(no, 0) + size
+    return sizes
+
+def plan_batches(sizes, budget):
+    '''
+    split sequences into consecutive batches of at most budget / 2 bytes of frames each,
+    so one batch can be extracted while the previous one is encoded; returns list of (from, to, bytes)
+    a sequence larger than that gets a batch of its own
+    '''
+    batches = []
+    for no in sorted(sizes):
+        if len(batches) > 0 and batches[-1][2] + sizes[no] <= budget // 2: batches[-1] = (batches[-1][0], no, batches[-1][2] + sizes[no])
+        else: batches.append( (no, no, sizes[no]) )
+    return batches
+
+def run_pipeline(tarlist, dest_folder, index_path, budget, from_ = 0, to_ = 0, jobs = MOVIE_JOBS, threads = MOVIE_THREADS, journal = None, force = False, index_jobs = CHECK_JOBS):
+    '''
+    extract and encode in batches, keeping frames on disk below budget (bytes)
+    batches are planned from frame sizes in the tar member index; the next batch is extracted while the current one is encoded
+    the frames of a sequence are deleted as soon as its movie passes the structural check (frame count, duration, resolution)
+    images and metadata are kept and not counted against the budget; frames of failed movies are kept as well, and stay counted:
+    once only those are left on disk and they don't leave room for the next batch, the pipeline stops (fix or remove them and run again)
+    '''
+    db = update_tar_index(tarlist, index_path, index_jobs)
+    sizes = frame_sizes(db, from_, to_)
+    db.close()
+    batches = plan_batches(sizes, budget)
+    print(f'Pipeline: {len(sizes)} sequences, {sum(sizes.values()) / 1_000_000_000:.1f} GB of frames in {len(batches)} batches (budget {budget / 1_000_000_000:.1f} GB)')
+    frames_dir = os.path.join(dest_folder, TAR_FRAMES_DIR)
+    movies_dir = os.path.join(dest_folder, OUT_MOVIES_DIR)
+    os.makedirs(movies_dir, exist_ok=True)
+    pending = dict(sizes) # sequence -> bytes of frames, until its frames are deleted (or given up on)
+    on_disk = 0 # bytes of frames extracted and not yet released (including kept frames)
+    kept = 0 # bytes of frames of failed movies, kept on disk
+    cond = threading.Condition()
+    ready = queue.Queue() # extracted batches, None when done, or an exception
+    stop = threading.Event()
+    
+    def release(no):
+        nonlocal on_disk
+        with cond:
+            on_disk -= pending.pop(no, 0)
+            cond.notify_all()
+    
+    def keep(no):
+        nonlocal kept
+        with cond:
+            kept += pending.pop(no, 0) # still on disk and counted, but won't be released
+            cond.notify_all()
+    
+    def extractor():
+        nonlocal on_disk
+        try:
+            for first, last, size in batches:
+                with cond:
+                    cond.wait_for(lambda: stop.is_set() or on_disk == 0 or on_disk + size <= budget or on_disk == kept)
+                    if stop.is_set(): return
+                    if on_disk > 0 and on_disk + size > budget:
+                        print(f'\n{COLORS.RED}Pipeline: stopping before {first}-{last}, frames of failed movies ({kept / 1_000_000_000:.1f} GB) and the next batch ({size / 1_000_000_000:.1f} GB) would exceed the budget{COLORS.END}')
+                        break
+                    on_disk += size
+                print(f'\nPipeline: extracting {first}-{last} ({size / 1_000_000_000:.1f} GB, {on_disk / 1_000_000_000:.1f} GB of frames on disk)')
+                extract_members(tarlist, dest_folder, index_path, first, last, jobs=index_jobs)
+                ready.put( (first, last) )
+            ready.put(None)
+        except BaseException as e:
+            ready.put(e)
+    
+    def done(folder, outfile, ok):
+        no = int(os.path.basename(folder))
+        if ok:
+            valid, size, mtime_ns, error = check_mp4(outfile, full=False)
+            if valid:
+                shutil.rmtree(folder)
+                release(no)
+                return
+            print(f'   {COLORS.RED}CORRUPT {outfile} ({error}), keeping frames{COLORS.END}')
+        keep(no)
+    
+    thread = threading.Thread(target=extractor, daemon=True)
+    thread.start()
+    try:
+        while (item := ready.get()) != None:
+            if isinstance(item, BaseException): raise item
+            first, last = item
+            folders = [ folder for folder in list_folders(frames_dir, '[0-9]*') if first <= int(os.path.basename(folder)) <= last ]
+            print(f'\nPipeline: encoding {first}-{last} ({len(folders)} sequences)')
+            create_movies(folders, movies_dir, jobs, threads, journal, force, on_done=done)
+            for no in range(first, last + 1): release(no) # sequences without frames folder
+            print_elapsed()
+    finally:
+        stop.set()
+        with cond: cond.notify_all()
+
+def watch_tars(tar_folder, dest_folder, index_path, movies = False, poll = WATCH_POLL, stable = WATCH_STABLE, idle = 0, jobs = MOVIE_JOBS, threads = MOVIE_THREADS, journal = None, force = False, outputs = None, segments = MOVIE_SEGMENTS, check_jobs = CHECK_JOBS):
+    '''
+    process tars while they are being recorded: the tar folder is listed every poll seconds, a tar is complete once its size and mtime
+    haven't changed for stable seconds (counted from its mtime, so tars finished before the start are picked up right away)
+    complete tars are indexed (see update_tar_index), extracted (see extract_tars) and their images, metadata and frames verified
+    (after a restart, images and frames of tars extracted before aren't verified again; metadata is, using the check cache)
+    with movies, a sequence is encoded as soon as all MOVIE_FRAMES of its frames are in complete tars, unless one of its files is corrupt
+    a tar that changes again (e.g. the recorder resumed it) is processed again
+    idle ... stop after this many seconds without a new complete tar, once no tar is being written (0 ... run until interrupted)
+    '''
+    frames_dir = os.path.join(dest_folder, TAR_FRAMES_DIR)
+    movies_dir = os.path.join(dest_folder, OUT_MOVIES_DIR)
+    journal_path = os.path.join(dest_folder, EXTRACT_JOURNAL_FILE)
+    if movies: os.makedirs(movies_dir, exist_ok=True)
+    cache = open_check_cache(dest_folder)
+    seen = {} # tar path -> (size, mtime_ns, unchanged since)
+    processed = set() # (tar basename, size, mtime_ns) of complete tars
+    frames = {} # sequence number -> frame numbers in complete tars
+    corrupt = set() # sequence numbers with corrupt files
+    encoded = set() # sequence numbers encoded (or tried to)
+    last_new = time.time()
+    print(f'Watching {tar_folder} (every {poll}s, tars complete after {stable}s unchanged{f", stopping after {idle}s without new tars" if idle > 0 else ", ctrl-c to stop"})')
+    while True:
+        now = time.time()
+        complete = []
+        writing = 0
+        for path in list_files(tar_folder, '*.tar'):
+            try: stat = os.stat(path)
+            except FileNotFoundError: continue
+            if seen.get(path, ())[:2] != (stat.st_size, stat.st_mtime_ns): seen[path] = (stat.st_size, stat.st_mtime_ns, min(now, stat.st_mtime)) # new or changed
+            if (os.path.basename(path), str(stat.st_size), str(stat.st_mtime_ns)) in processed: continue
+            if now - seen[path][2] >= stable: complete.append(path)
+            else: writing += 1
+        if len(complete) > 0:
+            last_new = now
+            print(f'\nWATCH: {len(complete)} new complete TAR file(s), {writing} still being written')
+            db = update_tar_index(complete, index_path, check_jobs)
+            extracted = read_journal(journal_path)
+            readable = []
+            for path in complete:
+                entry = (os.path.basename(path),) + seen[path][:2]
+                processed.add( (entry[0], str(entry[1]), str(entry[2])) )
+                if db.execute('SELECT 1 FROM tars WHERE name = ? AND size = ? AND mtime_ns = ?', entry).fetchone(): readable.append(path)
+                else: print(f'{COLORS.RED}Skipping unreadable {path}{COLORS.END}')
+            extract_tars(readable, dest_folder, jobs=1, force=force)
+            now_extracted = read_journal(journal_path)
+            members = []
+            verify = [] # members of newly extracted tars (images and frames of tars extracted before were verified then)
+            for path in readable:
+                entry = journal_entry(path)
+                if entry not in now_extracted: continue # failed, reported by extract_tars
+                names = [ row[0] for row in db.execute('SELECT members.name FROM members JOIN tars ON members.tar_id = tars.id WHERE tars.name = ?', (entry[0],)) ]
+                members.extend(names)
+                if force or entry not in extracted: verify.extend(names)
+            db.close()
+            pngs = [ os.path.join(dest_folder, name) for name in verify if name.endswith('.png') and member_seq(name) != None ]
+            jsons = [ os.path.join(dest_folder, name) for name in members if name.endswith('.json') and member_seq(name) != None ] # all, cached
+            print(f'Verifying {len(pngs)} images and frames, {len(jsons)} metadata files')
+            errors = []
+            if len(pngs) > 0:
+                with metrics.stage('check_images', len(pngs)) as stage: errors += check_pngs(pngs, check_jobs, stage=stage)
+            if len(jsons) > 0:
+                with metrics.stage('check_metadata', len(jsons)) as stage: errors += check_jsons(jsons, check_jobs, cache=cache, stage=stage)
+            corrupt.update( member_seq(os.path.relpath(path, dest_folder)) for path in errors )
+            for name in members:
+                match = FRAME_MEMBER.fullmatch(name)
+                if match: frames.setdefault(int(match[1]), set()).add(int(match[2]))
+            ready = [ no for no in sorted(frames) if len(frames[no]) >= MOVIE_FRAMES and no not in encoded ]
+            if movies and len(ready) > 0:
+                for no in [ no for no in ready if no in corrupt ]:
+                    print(f'{COLORS.RED}Not encoding {no:04d}: corrupt files{COLORS.END}')
+                encoded.update(ready)
+                folders = [ os.path.join(frames_dir, f'{no:04d}') for no in ready if no not in corrupt ]
+                if len(folders) > 0:
+                    print(f'\nWATCH: {len(folders)} sequence(s) complete: {format_runs(runs([ int(os.path.basename(f)) for f in folders ]))}')
+                    create_movies(folders, movies_dir, jobs, threads, journal, force, outputs=outputs, segments=segments)
+        if idle > 0 and writing == 0 and time.time() - last_new >= idle: break
+        time.sleep(poll)
+    cache.close()
+    incomplete = { no: len(f) for no, f in frames.items() if len(f) < MOVIE_FRAMES }
+    print(f'\nWATCH: stopped after {idle}s without new tars; {len(processed)} tars processed, {len(frames) - len(incomplete)} sequences complete')
+    if len(incomplete) > 0: print(f'{COLORS.YELLOW}{len(incomplete)} incomplete sequence(s):{COLORS.END} {", ".join(f"{no:04d} ({n}/{MOVIE_FRAMES} frames)" for no, n in sorted(incomplete.items()))}')
+    if len(corrupt) > 0: print(f'{COLORS.RED}{len(corrupt)} sequence(s) with corrupt files:{COLORS.END} {format_runs(runs(sorted(corrupt)))}')
 
 def print_elapsed():
     if start_time:
@@ -256,52 +1428,79 @@ def format_runs(runs):
     strings = map(lambda x: '-'.join(str(s) for s in x) if isinstance(x, list) else str(x), runs)
     return ', '.join(strings)
 
-def check_complete(files, start_idx, stop_idx, idx_width=4, prefix='', postfix='.png'):
-    # files ... anything that supports the 'in' operator: list, dict, set
-    for i in range(start_idx, stop_idx):
-        name = prefix + str(i).zfill(idx_width) + postfix
-        if name not in files: return False
-    return True
-
-def partition_framelist(frames):
-    # frames/0001/0001_0000.png, frames/0001/0001_0001.png, ..., frames/0002/0002_0000.png, frames/0002/0002_0001.png, ...
-    # returns dict: seq_no -> [list of paths]
-    out = {}
-    start = len(TAR_FRAMES_DIR) + 1
-    end = start + 4
-    for path in frames:
-        no = int( path[start:end] )
-        if no not in out: out[no] = []
-        part = out[no]
-        part.append(path)
-    return out
+def parse_files(files):
+    '''
+    parse paths (images/NNNN.png, metadata/NNNN.json, frames/NNNN/NNNN_XXXX.png) into bitmaps, consuming files only once
+    returns dict with
+        count ... number of paths
+        images, meta ... bytearray indexed by sequence number, 1 if present
+        frames ... bytearray with CHECK_FRAMES entries per sequence number (i.e. frames[no * CHECK_FRAMES + frame]), 1 if present
+        extra_frames ... set of (no, frame) outside of the frames bitmap
+        stray ... other paths in these folders, including non-canonical numbers (e.g. images/12.png or images/00012.png), which aren't checked
+    numbers are zero-padded to 4 digits; a name has to match its number formatted that way, since checks rebuild paths from the numbers
+    '''
+    images = bytearray(CHECK_IMAGES + 1)
+    meta = bytearray(CHECK_IMAGES + 1)
+    frames = bytearray((CHECK_IMAGES + 1) * CHECK_FRAMES)
+    extra_frames = set()
+    stray = []
+    count = 0
+    match = MEMBER_SEQ.fullmatch
+    dirs = tuple( f'{dir}/' for dir in [TAR_IMAGES_DIR, TAR_META_DIR, TAR_FRAMES_DIR] )
+    for path in files:
+        count += 1
+        m = match(path)
+        if not m or not all( n == None or n == f'{int(n):04d}' for n in m.groups() ):
+            if path.startswith(dirs): stray.append(path)
+            continue
+        image_no, meta_no, frame_no, frame = m.groups()
+        if image_no:
+            no = int(image_no)
+            if no >= len(images): images.extend( bytes(no + 1 - len(images)) )
+            images[no] = 1
+        elif meta_no:
+            no = int(meta_no)
+            if no >= len(meta): meta.extend( bytes(no + 1 - len(meta)) )
+            meta[no] = 1
+        else:
+            no, frame = int(frame_no), int(frame)
+            if no <= CHECK_IMAGES and frame < CHECK_FRAMES: frames[no * CHECK_FRAMES + frame] = 1
+            else: extra_frames.add( (no, frame) )
+    return { 'count': count, 'images': images, 'meta': meta, 'frames': frames, 'extra_frames': extra_frames, 'stray': stray }
+
+def bitmap_numbers(bitmap):
+    # indices of set entries
+    return [ i for i, v in enumerate(bitmap) if v ]
 
-def check_files(files, pwd = None):
-    '''check tar contents: stills, movies, metadata for completeness'''
-    print(f'Checking {len(files)} files')
-    # files = list(set(files))
-    # print(f'{len(files)} files without duplicates')
-    # files = sorted(files)
+def check_files(files, pwd = None, jobs = CHECK_JOBS, check_zlib = False):
+    '''
+    check tar contents: stills, movies, metadata for completeness
+    complete means images and metadata 1..CHECK_IMAGES and frames 0..CHECK_FRAMES-1 of each of those sequences (all inclusive)
+    '''
+    parsed = parse_files(files)
+    print(f'Checking {parsed["count"]} files')
+    if len(parsed['stray']) > 0:
+        print(f'   {COLORS.YELLOW}{len(parsed["stray"])} stray file(s), not checked:{COLORS.END} {", ".join(parsed["stray"][:10])}{", ..." if len(parsed["stray"]) > 10 else ""}')
+    pool = ProcessPoolExecutor(max_workers=(jobs if jobs > 0 else None)) if pwd else None # shared by all png and json checks
+    cache = open_check_cache(pwd) if pwd else None
     
     # check images
-    images = set( filter(lambda x: x.startswith(TAR_IMAGES_DIR + '/'), files) )
-    print(f'{len(images)} images')
-    if len(images) == 0:
+    image_numbers = bitmap_numbers(parsed['images'])
+    image_runs = runs(image_numbers, sort=False)
+    print(f'{len(image_numbers)} images')
+    if len(image_numbers) == 0:
         print(f'   {COLORS.YELLOW}NO images{COLORS.END}')
     else:
-        images_complete = check_complete(images, 1, CHECK_IMAGES, prefix=TAR_IMAGES_DIR + '/')
+        images_complete = parsed['images'][1:CHECK_IMAGES+1].count(1) == CHECK_IMAGES
         print(f'   {COLORS.GREEN}images COMPLETE{COLORS.END}' if images_complete else f'   {COLORS.YELLOW}images NOT complete{COLORS.END}')
-        image_numbers = list(map(lambda x: int(os.path.splitext(os.path.basename(x))[0]), images))
-        image_numbers.sort()
-        image_runs = runs(image_numbers)
         print(f'   {len(image_runs)} image runs', end='')
         if (len(image_runs) < 100): print(f': {format_runs(image_runs)}')
         else: print()
         # check PNG integrity
         if pwd: # only if working directory is given, are we dealing with extracted files
-            paths = list(map(lambda x: os.path.join(pwd, x), images))
-            paths.sort()
-            errors = check_pngs(paths)
+            paths = [ os.path.join(pwd, TAR_IMAGES_DIR, f'{no:04d}.png') for no in image_numbers ]
+            with metrics.stage('check_images', len(paths)) as stage:
+                errors = check_pngs(paths, pool=pool, check_zlib=check_zlib, stage=stage)
             if len(errors) == 0:
                 print(f'   {COLORS.GREEN}image integrity VERIFIED{COLORS.END}')
             else:
@@ -310,28 +1509,24 @@ def check_files(files, pwd = None):
                 print(f'   {", ".join(errors)}')
     
     # check metadata
-    meta = set( filter(lambda x: x.startswith(TAR_META_DIR + '/'), files) )
-    # meta = list( set(meta) ) # remove duplicates
-    print(f'{len(meta)} metadata files')
-    if len(meta) == 0:
+    meta_numbers = bitmap_numbers(parsed['meta'])
+    print(f'{len(meta_numbers)} metadata files')
+    if len(meta_numbers) == 0:
         print(f'   {COLORS.YELLOW}NO metadata files{COLORS.END}')
     else:
-        meta_complete = check_complete(meta, 1, CHECK_IMAGES, prefix=TAR_META_DIR + '/', postfix='.json')
+        meta_complete = parsed['meta'][1:CHECK_IMAGES+1].count(1) == CHECK_IMAGES
         print(f'   {COLORS.GREEN}metadata COMPLETE{COLORS.END}' if meta_complete else f'   {COLORS.YELLOW}metadata NOT complete{COLORS.END}')
-        meta_numbers = list(map(lambda x: int(os.path.splitext(os.path.basename(x))[0]), meta))
-        meta_numbers.sort()
-        meta_runs = runs(meta_numbers)
+        meta_runs = runs(meta_numbers, sort=False)
         meta_matches_images = (meta_runs == image_runs)
         print(f'   {COLORS.GREEN}metadata MATCHES images{COLORS.END}' if meta_matches_images else f'   {COLORS.YELLOW}metadata NOT matching images{COLORS.END}')
-        # if not meta_matches_images:
         print(f'   {len(meta_runs)} metadata runs', end='')
         if (len(meta_runs) < 100): print(f': {format_runs(meta_runs)}')
         else: print()
         # check JSON integrity
         if pwd: # only if working directory is given, are we dealing with extracted files
-            paths = list(map(lambda x: os.path.join(pwd, x), meta))
-            paths.sort()
-            errors = check_jsons(paths)
+            paths = [ os.path.join(pwd, TAR_META_DIR, f'{no:04d}.json') for no in meta_numbers ]
+            with metrics.stage('check_metadata', len(paths)) as stage:
+                errors = check_jsons(paths, pool=pool, cache=cache, stage=stage)
             if len(errors) == 0:
                 print(f'   {COLORS.GREEN}metadata integrity VERIFIED{COLORS.END}')
             else:
@@ -340,106 +1535,430 @@ def check_files(files, pwd = None):
                 print(f'   {", ".join(errors)}')
     
     # check frames
-    frames = set( filter(lambda x: x.startswith(TAR_FRAMES_DIR + '/'), files) )
-    print(f'{len(frames)} frames')
-    if len(frames) == 0:
+    frames = parsed['frames']
+    extra_frames = parsed['extra_frames']
+    frame_counts = [ frames[no * CHECK_FRAMES:(no+1) * CHECK_FRAMES].count(1) for no in range(CHECK_IMAGES + 1) ] # per sequence
+    print(f'{sum(frame_counts) + len(extra_frames)} frames')
+    if sum(frame_counts) + len(extra_frames) == 0:
         print(f'   {COLORS.YELLOW}NO frames {COLORS.END}')
     else:
-        # print(frames)
-        complete_anims = []
-        incomplete = 0
-        for no in range(1, CHECK_IMAGES+1):
-            no_formatted = str(no).zfill(4)
-            complete = check_complete(frames, 0, CHECK_FRAMES-1, prefix=f'{TAR_FRAMES_DIR}/{no_formatted}/{no_formatted}_')
-            if complete: complete_anims.append(no)
-            else: incomplete += 1
-            if no % 100 == 0: print(f'   found complete anims: {len(complete_anims)}, incomplete: {incomplete}')
+        complete_anims = [ no for no in range(1, CHECK_IMAGES + 1) if frame_counts[no] == CHECK_FRAMES ]
+        incomplete = CHECK_IMAGES - len(complete_anims)
         print(f'   {len(complete_anims)} complete anims, {incomplete} incomplete')
         anims_complete = (len(complete_anims) == CHECK_IMAGES)
-        print(f'   {COLORS.GREEN}frames COMPLETE{COLORS.END}' if meta_complete else f'   {COLORS.YELLOW}frames NOT complete{COLORS.END}')
-        anim_runs = runs(complete_anims)
+        print(f'   {COLORS.GREEN}frames COMPLETE{COLORS.END}' if anims_complete else f'   {COLORS.YELLOW}frames NOT complete{COLORS.END}')
+        anim_runs = runs(complete_anims, sort=False)
         anims_match_images = (anim_runs == image_runs)
         print(f'   {COLORS.GREEN}complete anims MATCH images{COLORS.END}' if anims_match_images else f'   {COLORS.YELLOW}complete anims DON\'T match images{COLORS.END}')
-        # if not anims_match_images:
         print(f'   {len(anim_runs)} anim runs', end='')
         if (len(anim_runs) < 100): print(f': {format_runs(anim_runs)}')
         else: print()
         # check frames integrity
         if pwd: # only if working directory is given, are we dealing with extracted files
-            paths = list(frames)
-            paths.sort()
-            error_nos = []
-            errors = []
-            ok = 0
-            partitions = partition_framelist(paths) # dict with frames grouped by animation sequence
-            for no, anim_frames in partitions.items():
-                paths = list(map(lambda x: os.path.join(pwd, x), anim_frames))
-                anim_errors = check_pngs(paths)
-                if len(anim_errors) > 0:
-                    error_nos.append(no)
-                    errors.append(anim_errors)
-                else:
-                    ok += 1
-                if no % 1 == 0:
-                    print(f'   anims verified: {ok}, corrupt: {len(error_nos)}')    
+            extra_nos = set( no for no, frame in extra_frames )
+            anim_nos = sorted( set(no for no in range(CHECK_IMAGES + 1) if frame_counts[no] > 0) | extra_nos )
+            paths = [] # (sequence number, path) of all frames, checked in batches across animations so all workers are busy
+            for no in anim_nos:
+                anim_frames = [ f for f in range(CHECK_FRAMES) if no <= CHECK_IMAGES and frames[no * CHECK_FRAMES + f] ]
+                anim_frames += sorted( frame for n, frame in extra_frames if n == no ) if no in extra_nos else []
+                paths += [ (no, os.path.join(pwd, TAR_FRAMES_DIR, f'{no:04d}', f'{no:04d}_{f:04d}.png')) for f in anim_frames ]
+            batches = ( paths[i:i+CHECK_CHUNKSIZE] for i in range(0, len(paths), CHECK_CHUNKSIZE) )
+            ahead = CHECK_AHEAD * (jobs if jobs > 0 else (os.cpu_count() or 1)) # batches submitted at once
+            in_flight = {} # future -> batch
+            corrupt = {} # sequence number -> corrupt frames
+            with metrics.stage('check_frames', len(paths)) as stage:
+                while True:
+                    for batch in itertools.islice(batches, ahead - len(in_flight)):
+                        in_flight[ pool.submit(check_png_batch, [ path for no, path in batch ], check_zlib) ] = batch
+                    if len(in_flight) == 0: break
+                    finished, pending = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        batch = in_flight.pop(future)
+                        results = future.result()
+                        for (no, path), valid in zip(batch, results):
+                            if valid: continue
+                            corrupt.setdefault(no, []).append(path)
+                            print(f'      {COLORS.RED}CORRUPT frame: {path}{COLORS.END}')
+                        stage.add(len(batch), failures=results.count(False))
+            error_nos = sorted(corrupt)
+            errors = [ sorted(corrupt[no]) for no in error_nos ]
+            print(f'   anims verified: {len(anim_nos) - len(error_nos)}, corrupt: {len(error_nos)}')
             if len(errors) == 0:
                 print(f'   {COLORS.GREEN}frame integrity VERIFIED{COLORS.END}')
             else:
                 print(f'   {COLORS.RED}frame integrity NOT verified{COLORS.END}')
                 print(f'   {len(error_nos)} animations with error(s):')
                 print(f'   {", ".join(map(str, errors))}')
+    if pool: pool.shutdown()
+    if cache: cache.close()
 
-def check_png(path):
-    code = run_cmd(f"pngcheck '{path}' > /dev/null")
-    return code == 0
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_BIT_DEPTHS = { 0: (1, 2, 4, 8, 16), 2: (8, 16), 3: (1, 2, 4, 8), 4: (8, 16), 6: (8, 16) } # color type -> allowed bit depths
+PNG_CHANNELS = { 0: 1, 2: 3, 3: 1, 4: 2, 6: 4 } # color type -> samples per pixel
 
-def check_pngs(files):
+def png_error(data, check_zlib = False):
+    '''
+    verify png structure (similar to pngcheck): signature, chunk layout, chunk CRCs, IHDR, IDAT, IEND
+    data ... bytes-like (e.g. mmap)
+    check_zlib ... also check that the IDAT stream decompresses to the expected size
+    returns None if ok, an error message otherwise
+    '''
+    view = memoryview(data)
+    if bytes(view[0:8]) != PNG_SIGNATURE: return 'invalid signature'
+    pos = 8
+    ihdr = None
+    idats = [] # (start, end) of IDAT data
+    idat_done = False
+    while True:
+        if pos + 12 > len(view): return 'truncated (no IEND chunk)'
+        length, type = struct.unpack_from('>I4s', view, pos)
+        if length > 0x7fffffff: return f'invalid chunk length at {pos}'
+        if not type.isalpha(): return f'invalid chunk type at {pos}'
+        end = pos + 8 + length
+        if end + 4 > len(view): return f'truncated {type.decode()} chunk'
+        crc, = struct.unpack_from('>I', view, end)
+        if zlib.crc32(view[pos+8:end], zlib.crc32(type)) != crc: return f'CRC error in {type.decode()} chunk'
+        if ihdr == None and type != b'IHDR': return 'first chunk is not IHDR'
+        if type == b'IHDR':
+            if ihdr != None: return 'multiple IHDR chunks'
+            if length != 13: return 'invalid IHDR length'
+            ihdr = struct.unpack_from('>IIBBBBB', view, pos + 8) # width, height, bit depth, color type, compression, filter, interlace
+            width, height, depth, color, compression, filter, interlace = ihdr
+            if width == 0 or height == 0 or width > 0x7fffffff or height > 0x7fffffff: return f'invalid image size {width}x{height}'
+            if color not in PNG_BIT_DEPTHS or depth not in PNG_BIT_DEPTHS[color]: return f'invalid bit depth {depth} for color type {color}'
+            if compression != 0 or filter != 0 or interlace > 1: return 'invalid compression/filter/interlace method'
+        elif type == b'IDAT':
+            if idat_done: return 'non-consecutive IDAT chunks'
+            idats.append( (pos + 8, end) )
+        elif len(idats) > 0:
+            idat_done = True
+        if type == b'IEND':
+            if length != 0: return 'invalid IEND length'
+            if end + 4 != len(view): return 'additional data after IEND chunk'
+            break
+        pos = end + 4
+    if len(idats) == 0: return 'no IDAT chunks'
+    if check_zlib:
+        width, height, depth, color, compression, filter, interlace = ihdr
+        if interlace == 0: expected = height * (1 + math.ceil(width * PNG_CHANNELS[color] * depth / 8)) # filter byte + bytes per row
+        else: expected = None # adam7: don't check size
+        d = zlib.decompressobj()
+        size = 0
+        try:
+            for start, end in idats:
+                chunk = view[start:end]
+                while len(chunk) > 0 and not d.eof:
+                    size += len( d.decompress(chunk, 1 << 20) ) # limit output, to avoid allocating the whole image
+                    chunk = d.unconsumed_tail
+            while not d.eof:
+                out = d.decompress(b'', 1 << 20)
+                if len(out) == 0: break
+                size += len(out)
+        except zlib.error as e:
+            return f'zlib error: {e}'
+        if not d.eof: return 'zlib stream incomplete'
+        if expected != None and size != expected: return f'decompressed size {size}, expected {expected}'
+    return None
+
+def check_png(path, check_zlib = False):
+    try:
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0: return False # can't mmap empty files
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return png_error(data, check_zlib) == None
+    except OSError:
+        return False
+
+def check_png_batch(paths, check_zlib = False):
+    # check_png for several files in one task (worker process)
+    return [ check_png(path, check_zlib) for path in paths ]
+
+def check_pngs(files, jobs = CHECK_JOBS, pool = None, check_zlib = False, stage = None):
+    # checks files across worker processes (uses pool if given, otherwise creates one with jobs workers); counts files in stage (metrics) if given
     errors = []
     ok = 0
-    for i, file in enumerate(files):
-        if not check_png(file): 
-            errors.append(file)
-            print(f'      {COLORS.RED}CORRUPT image: {file}{COLORS.END}')
-        else: ok += 1
-        if (i+1) % 100 == 0:
-            print(f'      images verified: {ok}/{len(files)}, corrupt: {len(errors)}/{len(files)}')
+    own_pool = pool == None
+    if own_pool: pool = ProcessPoolExecutor(max_workers=(jobs if jobs > 0 else None))
+    try:
+        results = pool.map(partial(check_png, check_zlib=check_zlib), files, chunksize=CHECK_CHUNKSIZE)
+        for i, (file, valid) in enumerate(zip(files, results)):
+            if stage: stage.add(1, failures=int(not valid))
+            if not valid: 
+                errors.append(file)
+                print(f'      {COLORS.RED}CORRUPT image: {file}{COLORS.END}')
+            else: ok += 1
+            if (i+1) % 100 == 0:
+                print(f'      images verified: {ok}/{len(files)}, corrupt: {len(errors)}/{len(files)}')
+    finally:
+        if own_pool: pool.shutdown(cancel_futures=True)
     return errors
 
+def json_error(data):
+    '''
+    validate metadata json (everything metadata_to_csv relies on)
+    data ... bytes
+    returns None if ok, an error message otherwise
+    '''
+    if b'"_nft_metadata"' not in data: return 'no _nft_metadata' # fast path, before parsing
+    try:
+        obj = json.loads(data)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        return f'invalid json: {e}'
+    meta = obj.get('_nft_metadata') if isinstance(obj, dict) else None
+    if not isinstance(meta, dict): return 'no _nft_metadata'
+    if not isinstance(meta.get('No.'), int): return 'invalid No.'
+    if not isinstance(meta.get('_category_no'), int): return 'invalid _category_no'
+    edna = meta.get('_edna_target')
+    if not isinstance(edna, dict) or len(edna) == 0: return 'invalid _edna_target'
+    for key in edna:
+        if len(key.split('_')) < 2: return f'invalid _edna_target key {key}'
+    if not isinstance(meta.get('_weather_extra'), dict): return 'invalid _weather_extra'
+    return None
+
 def check_json(path):
+    # returns (valid, size, mtime_ns); stat is taken before reading, so a later change invalidates the cached result
     try:
-        with open(path, 'r') as file:
-            obj = json.load(file)
-            if '_nft_metadata' not in obj: return False
-            return True
-    except json.JSONDecodeError:
-        return False
+        with open(path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            return ( json_error(file.read()) == None, stat.st_size, stat.st_mtime_ns )
+    except OSError:
+        return (False, None, None)
+
+def open_check_cache(folder):
+    # results of successful checks, keyed by kind, path, size and mtime; placed in folder (the extract or output folder)
+    db = sqlite3.connect(os.path.join(folder, CHECK_CACHE_FILE))
+    db.execute('CREATE TABLE IF NOT EXISTS verified (kind TEXT, path TEXT, size INTEGER, mtime_ns INTEGER, PRIMARY KEY (kind, path))')
+    return db
+
+def cached_files(cache, kind, files):
+    # files that were verified before (with unchanged size and mtime); cached by absolute path
+    if cache == None: return set()
+    known = { path: (size, mtime_ns) for path, size, mtime_ns in cache.execute('SELECT path, size, mtime_ns FROM verified WHERE kind = ?', (kind,)) }
+    out = set()
+    for file in files:
+        path = os.path.abspath(file)
+        if path not in known: continue
+        try: stat = os.stat(path)
+        except FileNotFoundError: continue
+        if known[path] == (stat.st_size, stat.st_mtime_ns): out.add(file)
+    return out
 
-def check_jsons(files):
+def check_jsons(files, jobs = CHECK_JOBS, pool = None, cache = None, stage = None):
+    # checks files across worker processes (uses pool if given, otherwise creates one with jobs workers); skips files verified before according to cache; counts files in stage (metrics) if given
     errors = []
     ok = 0
-    for i, file in enumerate(files):
-        if not check_json(file): 
-            errors.append(file)
-            print(f'      {COLORS.RED}CORRUPT json: {file}{COLORS.END}')
-        else: ok += 1
-        if (i+1) % 100 == 0:
-            print(f'      json verified: {ok}/{len(files)}, corrupt: {len(errors)}/{len(files)}')
+    cached = cached_files(cache, 'json', files)
+    if len(cached) > 0: print(f'      json verified before (unchanged): {len(cached)}/{len(files)}')
+    if stage: stage.add(len(cached))
+    todo = [ file for file in files if file not in cached ]
+    ok += len(cached)
+    own_pool = pool == None
+    if own_pool: pool = ProcessPoolExecutor(max_workers=(jobs if jobs > 0 else None))
+    verified = []
+    try:
+        results = pool.map(check_json, todo, chunksize=CHECK_CHUNKSIZE)
+        for i, (file, (valid, size, mtime_ns)) in enumerate(zip(todo, results)):
+            if stage: stage.add(1, size or 0, failures=int(not valid))
+            if not valid: 
+                errors.append(file)
+                print(f'      {COLORS.RED}CORRUPT json: {file}{COLORS.END}')
+            else:
+                ok += 1
+                verified.append( ('json', os.path.abspath(file), size, mtime_ns) )
+            if (i+1) % 100 == 0:
+                print(f'      json verified: {ok}/{len(files)}, corrupt: {len(errors)}/{len(files)}')
+    finally:
+        if own_pool: pool.shutdown(cancel_futures=True)
+        if cache != None:
+            with cache: cache.executemany('INSERT OR REPLACE INTO verified VALUES (?, ?, ?, ?)', verified)
     return errors
 
-def check_mp4(path):
-    code = run_cmd(f"ffmpeg -v error -i {path} -f null -")
-    return code == 0
+def mp4_boxes(data, start = 0, end = None):
+    # yields (type, payload start, payload end) of the boxes in data[start:end]
+    if end == None: end = len(data)
+    pos = start
+    while pos + 8 <= end:
+        size, type = struct.unpack_from('>I4s', data, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end: return
+            size, = struct.unpack_from('>Q', data, pos + 8)
+            header = 16
+        elif size == 0: size = end - pos # box extends to the end
+        if size < header or pos + size > end: raise ValueError(f'invalid {type.decode(errors="replace")} box at {pos}')
+        yield (type, pos + header, pos + size)
+        pos += size
+
+def mp4_child(data, start, end, *path):
+    # payload (start, end) of the first box along path (e.g. b'mdia', b'minf'), or None
+    for name in path:
+        found = None
+        for type, s, e in mp4_boxes(data, start, end):
+            if type == name:
+                found = (s, e)
+                break
+        if found == None: return None
+        start, end = found
+    return (start, end)
 
-def check_mp4s(files):
+def mp4_moov(path):
+    '''
+    read the top level boxes of an mp4: ftyp, moov and mdat, with moov before mdat (faststart)
+    returns (moov box, None), or (None, error message)
+    '''
+    top = {} # box type -> (offset, size)
+    with open(path, 'rb') as file:
+        file_size = os.fstat(file.fileno()).st_size
+        pos = 0
+        while pos + 8 <= file_size:
+            file.seek(pos)
+            header = file.read(16)
+            size, type = struct.unpack_from('>I4s', header)
+            if size == 1 and len(header) == 16: size, = struct.unpack_from('>Q', header, 8)
+            elif size == 0: size = file_size - pos
+            if size < 8 or pos + size > file_size: return (None, f'truncated {type.decode(errors="replace")} box')
+            top.setdefault(type, (pos, size))
+            pos += size
+        if pos != file_size: return (None, 'trailing data')
+        for type in [b'ftyp', b'moov', b'mdat']:
+            if type not in top: return (None, f'no {type.decode()} box')
+        if top[b'moov'][0] > top[b'mdat'][0]: return (None, 'moov after mdat (no faststart)')
+        file.seek(top[b'moov'][0])
+        return (file.read(top[b'moov'][1]), None)
+
+def mp4_video_trak(moov):
+    # payload (start, end) of the first video trak in moov, or None
+    for type, s, e in mp4_boxes(moov, 8):
+        if type != b'trak': continue
+        hdlr = mp4_child(moov, s, e, b'mdia', b'hdlr')
+        if hdlr and moov[hdlr[0]+8:hdlr[0]+12] == b'vide': return (s, e)
+    return None
+
+def mp4_error(path):
+    '''
+    fast structural check of an mp4 (no decoding): ftyp, moov and mdat boxes, faststart (moov before mdat),
+    and frame count, duration and resolution of the video track according to the MOVIE_* settings
+    returns None if ok, an error message otherwise
+    '''
+    moov, error = mp4_moov(path)
+    if error: return error
+    try:
+        video = mp4_video_trak(moov)
+        if video == None: return 'no video track'
+        tkhd = mp4_child(moov, *video, b'tkhd')
+        mdhd = mp4_child(moov, *video, b'mdia', b'mdhd')
+        stsz = mp4_child(moov, *video, b'mdia', b'minf', b'stbl', b'stsz')
+        if not tkhd or not mdhd or not stsz: return 'incomplete video track'
+        width, height = [ x >> 16 for x in struct.unpack_from('>II', moov, tkhd[1] - 8) ] # 16.16 fixed point, at the end of tkhd
+        if moov[mdhd[0]] == 1: timescale, duration = struct.unpack_from('>IQ', moov, mdhd[0] + 20) # version 1: 64-bit times
+        else: timescale, duration = struct.unpack_from('>II', moov, mdhd[0] + 12)
+        frames, = struct.unpack_from('>I', moov, stsz[0] + 8)
+    except (ValueError, struct.error) as e:
+        return f'invalid moov: {e}'
+    expected_frames = int(MOVIE_FRAMES * MOVIE_LOOPS)
+    if frames != expected_frames: return f'{frames} frames, expected {expected_frames}'
+    if timescale == 0 or abs(duration / timescale - expected_frames / MOVIE_OUTPUT_FPS) > 1 / MOVIE_OUTPUT_FPS: return f'duration {duration / max(timescale, 1):.3f}s, expected {expected_frames / MOVIE_OUTPUT_FPS:.3f}s'
+    if MOVIE_RES and MOVIE_RES[0] > 0 and MOVIE_RES[1] > 0:
+        # scaled to fit (force_original_aspect_ratio=decrease), so one side matches exactly (up to rounding to even)
+        fits = width <= MOVIE_RES[0] and height <= MOVIE_RES[1]
+        touches = MOVIE_RES[0] - width <= 1 or MOVIE_RES[1] - height <= 1
+        if not fits or not touches: return f'resolution {width}x{height}, expected {MOVIE_RES[0]}x{MOVIE_RES[1]}'
+    return None
+
+def mp4_timestamps_error(path):
+    '''
+    check that the video frames of an mp4 are evenly spaced at MOVIE_OUTPUT_FPS: presentation times (decode times from stts plus composition offsets from ctts),
+    in order, without gaps or duplicates (as written by a single-pass encode); returns None if ok, an error message otherwise
+    '''
+    moov, error = mp4_moov(path)
+    if error: return error
+    try:
+        video = mp4_video_trak(moov)
+        if video == None: return 'no video track'
+        mdhd = mp4_child(moov, *video, b'mdia', b'mdhd')
+        stbl = mp4_child(moov, *video, b'mdia', b'minf', b'stbl')
+        if moov[mdhd[0]] == 1: timescale, = struct.unpack_from('>I', moov, mdhd[0] + 20)
+        else: timescale, = struct.unpack_from('>I', moov, mdhd[0] + 12)
+        dts = [0]
+        stts = mp4_child(moov, *stbl, b'stts')
+        count, = struct.unpack_from('>I', moov, stts[0] + 4)
+        for i in range(count):
+            n, delta = struct.unpack_from('>II', moov, stts[0] + 8 + i * 8)
+            for j in range(n): dts.append(dts[-1] + delta)
+        dts.pop() # end of the last frame
+        pts = dts
+        ctts = mp4_child(moov, *stbl, b'ctts')
+        if ctts:
+            offsets = []
+            count, = struct.unpack_from('>I', moov, ctts[0] + 4)
+            for i in range(count):
+                n, offset = struct.unpack_from('>Ii', moov, ctts[0] + 8 + i * 8)
+                offsets += [offset] * n
+            if len(offsets) != len(dts): return f'{len(offsets)} composition offsets for {len(dts)} frames'
+            pts = sorted( d + o for d, o in zip(dts, offsets) )
+    except (ValueError, struct.error, TypeError) as e:
+        return f'invalid moov: {e}'
+    if timescale == 0 or len(pts) == 0: return 'no frames'
+    frame = timescale / MOVIE_OUTPUT_FPS
+    for i in range(1, len(pts)):
+        if abs(pts[i] - pts[i-1] - frame) > 1: return f'timestamp {(pts[i] - pts[0]) / timescale:.3f}s of frame {i} is {(pts[i] - pts[i-1]) / timescale:.3f}s after the previous one, expected {1 / MOVIE_OUTPUT_FPS:.3f}s'
+    return None
+
+def check_mp4(path, full = True, procs = None):
+    '''
+    fast structural check (mp4 only), and if full, decode the whole movie with ffmpeg
+    (ffmpeg exits 0 for most decoding errors, e.g. damaged frame data, so any error output counts as corrupt; -xerror stops at the first one)
+    returns (valid, size, mtime_ns, error message); stat is taken before checking, so a later change invalidates the cached result
+    '''
+    try: stat = os.stat(path)
+    except OSError as e: return (False, None, None, str(e))
+    if path.endswith('.mp4'):
+        try: error = mp4_error(path)
+        except OSError as e: error = str(e)
+        if error: return (False, stat.st_size, stat.st_mtime_ns, error)
+    if full:
+        result = run_cmd_cancelable(f"ffmpeg -nostdin -v error -xerror -i '{path}' -f null -", procs if procs != None else set(), capture_output=True)
+        output = (result.stdout or '').strip()
+        if result.returncode != 0 or output: return (False, stat.st_size, stat.st_mtime_ns, output.splitlines()[0] if output else f'ffmpeg exit code {result.returncode}')
+    return (True, stat.st_size, stat.st_mtime_ns, None)
+
+def check_mp4s(files, jobs = CHECK_JOBS, cache = None, full = True):
+    # checks files in parallel (jobs threads); skips movies verified before (with the same tier) according to cache
     errors = []
     ok = 0
-    for i, file in enumerate(files):
-        if not check_mp4(file):
-            errors.append(file)
-            print(f'      {COLORS.RED}CORRUPT mp4: {file}{COLORS.END}')
-        else: ok += 1
-        if (i+1) % 10 == 0 or i==len(files)-1:
-            print(f'      mp4 verified: {ok}/{len(files)}, corrupt: {len(errors)}/{len(files)}')
+    kind = 'mp4_decode' if full else 'mp4_fast' # (not mp4_full, recorded by earlier versions that ignored ffmpeg's error output)
+    cached = cached_files(cache, 'mp4_decode', files)
+    if not full: cached |= cached_files(cache, 'mp4_fast', files) # fully verified implies fast
+    if len(cached) > 0: print(f'      mp4 verified before (unchanged): {len(cached)}/{len(files)}')
+    todo = [ file for file in files if file not in cached ]
+    ok += len(cached)
+    procs = set() # running ffmpeg processes
+    executor = ThreadPoolExecutor(max_workers=(jobs if jobs > 0 else (os.cpu_count() or 1)))
+    verified = []
+    stage = metrics.stage('check_movies', len(files))
+    stage.add(len(cached))
+    def check(file):
+        start = time.perf_counter()
+        return check_mp4(file, full, procs), time.perf_counter() - start
+    try:
+        results = executor.map(check, todo)
+        for i, (file, ((valid, size, mtime_ns, error), seconds)) in enumerate(zip(todo, results)):
+            stage.item(os.path.basename(file), seconds, size or 0, ok=valid, error=error)
+            if not valid:
+                errors.append(file)
+                print(f'      {COLORS.RED}CORRUPT mp4: {file} ({error}){COLORS.END}')
+            else:
+                ok += 1
+                verified.append( (kind, os.path.abspath(file), size, mtime_ns) )
+            if (i+1) % 10 == 0 or i==len(todo)-1:
+                print(f'      mp4 verified: {ok}/{len(files)}, corrupt: {len(errors)}/{len(files)}')
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        cancel_cmds(procs)
+        executor.shutdown(wait=True)
+        stage.end()
+        if cache != None:
+            with cache: cache.executemany('INSERT OR REPLACE INTO verified VALUES (?, ?, ?, ?)', verified)
     return errors
 
 def limit_range(names, from_=0, to=0):
@@ -452,39 +1971,532 @@ def limit_range(names, from_=0, to=0):
         return True
     return list( filter(in_range, names) )
     
-def run_archive(target, src_folder, dest_folder, use_001=False):
-    target_to_folder = {
-        'meta': TAR_META_DIR,
-        'sheets': OUT_SHEETS_DIR,
-        'images': TAR_IMAGES_DIR,
-        'movies': OUT_MOVIES_DIR,
-        'frames': TAR_FRAMES_DIR
-    }
-    fname = target_to_folder[target]
+def archive_parts(zip_path):
+    # all volumes of a (split) zip: .zip, .z01, .z02, ... or .zip.001, .zip.002, ...
+    return sorted( glob.glob(glob.escape(os.path.splitext(zip_path)[0]) + '.z*') )
+
+def parse_size(size):
+    # '5g' -> 5 * 1024^3 (k, m, g, t suffixes as used by zip -s and split -b)
+    units = { 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30, 't': 1 << 40 }
+    size = size.strip().lower()
+    if size[-1] in units: return int( float(size[:-1]) * units[size[-1]] )
+    return int(size)
+
+class VolumeWriter:
+    '''
+    sequential writer, that splits its output into volumes of volume_size bytes (volume_size = 0 ... single file)
+    mode 'zip' ... multipart zip volumes .z01, .z02, ..., .zip (the last volume); use ensure() to keep records from spanning volumes
+                   the first volume starts with the spanning signature PK\\x07\\x08, like zip -s writes it (also if there is only one volume)
+    mode '001' ... plain byte split .zip.001, .zip.002, ... (a single volume is named .zip)
+    '''
+    def __init__(self, zip_path, volume_size = 0, mode = 'zip'):
+        self.zip_path = zip_path
+        self.volume_size = volume_size
+        self.mode = mode
+        self.paths = [] # written volumes
+        self.file = None
+        self.disk = -1
+        self.offset = 0 # in current volume
+        self.total = 0 # in all volumes
+        self._next_volume()
+        if mode == 'zip' and volume_size > 0: self.write(struct.pack('<I', 0x08074b50)) # spanning signature, part of the first volume's offsets
+    
+    def _volume_path(self, n):
+        if self.volume_size <= 0: return self.zip_path
+        if self.mode == 'zip': return f'{os.path.splitext(self.zip_path)[0]}.z{n+1:02d}'
+        return f'{self.zip_path}.{n+1:03d}'
+    
+    def _next_volume(self):
+        if self.file: self.file.close()
+        self.disk += 1
+        self.offset = 0
+        self.paths.append( self._volume_path(self.disk) )
+        self.file = open(self.paths[-1], 'wb', buffering=ARCHIVE_BUFFER)
+    
+    def write(self, data):
+        view = memoryview(data)
+        while len(view) > 0:
+            if self.volume_size > 0 and self.offset >= self.volume_size: self._next_volume()
+            n = len(view) if self.volume_size <= 0 else min(len(view), self.volume_size - self.offset)
+            self.file.write(view[:n])
+            self.offset += n
+            self.total += n
+            view = view[n:]
+    
+    def ensure(self, n):
+        # start a new volume, if the next n bytes (a header or record) wouldn't fit into the current one (zip mode only)
+        if self.mode == 'zip' and self.volume_size > 0 and self.offset > 0 and self.offset + n > self.volume_size: self._next_volume()
+    
+    def position(self):
+        # (disk number, offset) as recorded in zip headers
+        if self.mode == 'zip': return (self.disk, self.offset)
+        return (0, self.total)
+    
+    def close(self):
+        self.file.close()
+        if self.volume_size <= 0: return [self.zip_path]
+        # the last volume of a multipart zip is .zip; a single .001 volume is .zip as well
+        if self.mode == 'zip' or len(self.paths) == 1:
+            os.replace(self.paths[-1], self.zip_path)
+            self.paths[-1] = self.zip_path
+        return self.paths
+
+def dos_time(mtime):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980: return (0, (1 << 5) | 1) # 1980-01-01
+    return ( (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday )
+
+def prepare_zip_entry(path):
+    '''
+    read and deflate a file in memory, or for already compressed files (ARCHIVE_STORE_EXTS) only compute the crc, the writer streams them;
+    runs in worker threads (zlib and file io release the GIL)
+    returns dict with crc, method (0 ... stored, 8 ... deflated), size (uncompressed) and data (None for streamed files)
+    '''
+    if path.lower().endswith(ARCHIVE_STORE_EXTS):
+        crc = 0
+        size = 0
+        with open(path, 'rb') as file:
+            while buf := file.read(ARCHIVE_BUFFER):
+                crc = zlib.crc32(buf, crc)
+                size += len(buf)
+        return { 'crc': crc, 'method': 0, 'size': size, 'data': None }
+    with open(path, 'rb') as file:
+        data = file.read()
+    crc = zlib.crc32(data)
+    comp = zlib.compressobj(ARCHIVE_DEFLATE_LEVEL, zlib.DEFLATED, -15) # raw deflate
+    deflated = comp.compress(data) + comp.flush()
+    if len(deflated) < len(data): return { 'crc': crc, 'method': 8, 'size': len(data), 'data': deflated }
+    return { 'crc': crc, 'method': 0, 'size': len(data), 'data': data }
+
+def write_zip(src_folder, fname, zip_path, volume_size = 0, use_001 = False, jobs = ARCHIVE_JOBS, print_progress = True, files = None, manifest = None, stage = None):
+    '''
+    write src_folder/fname (recursively) to zip_path, with entry names relative to src_folder
+    png, mp4, etc. (ARCHIVE_STORE_EXTS) are stored: their crc is computed in parallel (jobs threads), and they are streamed by the writer
+    other files are deflated in parallel, in memory; files are prepared up to ARCHIVE_AHEAD files and ARCHIVE_AHEAD_BYTES ahead of the writer
+    output is written in one sequential pass, split into volumes of volume_size bytes (see VolumeWriter)
+    other files larger than ARCHIVE_STREAM_SIZE are stored and streamed from the main thread (with data descriptor)
+    files ... only these files (paths relative to src_folder/fname, sorted), instead of all
+    manifest ... list to append (name, data offset, length, size, method, crc) of each file to (offsets are only meaningful without volumes)
+    stage ... metrics stage to count written files and bytes in
+    returns list of written volumes
+    '''
+    out = VolumeWriter(zip_path, volume_size, '001' if use_001 else 'zip')
+    central = [] # central directory records
+    
+    def local_header(name, flags, method, mtime, crc, csize, usize, zip64):
+        extra = struct.pack('<HHQQ', 1, 16, usize, csize) if zip64 else b''
+        t, d = dos_time(mtime)
+        out.ensure(30 + len(name) + len(extra))
+        disk, offset = out.position()
+        out.write( struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if zip64 else 20, flags, method, t, d, crc, 0xffffffff if zip64 else csize, 0xffffffff if zip64 else usize, len(name), len(extra)) + name + extra )
+        return disk, offset
+    
+    def central_record(name, flags, method, mtime, crc, csize, usize, disk, offset, mode, is_dir):
+        extra = b''
+        if usize >= 0xffffffff: extra += struct.pack('<Q', usize)
+        if csize >= 0xffffffff: extra += struct.pack('<Q', csize)
+        if offset >= 0xffffffff: extra += struct.pack('<Q', offset)
+        if disk >= 0xffff: extra += struct.pack('<I', disk)
+        zip64 = len(extra) > 0
+        if zip64: extra = struct.pack('<HH', 1, len(extra)) + extra
+        t, d = dos_time(mtime)
+        attr = ((mode & 0xffff) << 16) | (0x10 if is_dir else 0)
+        return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, 0x031e, 45 if zip64 else 20, flags, method, t, d, crc,
+            min(csize, 0xffffffff), min(usize, 0xffffffff), len(name), len(extra), 0, min(disk, 0xffff), 0, attr, min(offset, 0xffffffff)) + name + extra
+    
+    def add_dir(rel):
+        name = (rel + '/').encode()
+        stat = os.stat(os.path.join(src_folder, rel))
+        flags = 0x800 if not name.isascii() else 0
+        disk, offset = local_header(name, flags, 0, stat.st_mtime, 0, 0, 0, False)
+        central.append( central_record(name, flags, 0, stat.st_mtime, 0, 0, 0, disk, offset, stat.st_mode, True) )
+    
+    def add_file(rel, stat, entry):
+        name = rel.encode()
+        flags = 0x800 if not name.isascii() else 0
+        path = os.path.join(src_folder, rel)
+        if entry != None and entry['data'] == None:
+            # stored, crc known: stream it
+            usize = csize = entry['size']
+            crc, method = entry['crc'], 0
+            disk, offset = local_header(name, flags, method, stat.st_mtime, crc, csize, usize, usize >= 0xffffffff)
+            data_offset = out.position()[1]
+            copied = 0
+            with open(path, 'rb') as file:
+                while buf := file.read(ARCHIVE_BUFFER):
+                    copied += len(buf)
+                    if copied > usize: break
+                    out.write(buf)
+                changed = os.fstat(file.fileno())
+            if copied != usize or (changed.st_size, changed.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns): raise RuntimeError(f'{path} changed while archiving')
+        elif entry != None:
+            zip64 = entry['size'] >= 0xffffffff or len(entry['data']) >= 0xffffffff
+            disk, offset = local_header(name, flags, entry['method'], stat.st_mtime, entry['crc'], len(entry['data']), entry['size'], zip64)
+            data_offset = out.position()[1]
+            out.write(entry['data'])
+            crc, csize, usize, method = entry['crc'], len(entry['data']), entry['size'], entry['method']
+        else:
+            # large file: stream it, stored, sizes and crc follow in a (zip64) data descriptor
+            flags |= 0x08
+            disk, offset = local_header(name, flags, 0, stat.st_mtime, 0, 0, 0, True)
+            data_offset = out.position()[1]
+            crc = 0
+            usize = 0
+            with open(path, 'rb') as file:
+                while buf := file.read(ARCHIVE_BUFFER):
+                    crc = zlib.crc32(buf, crc)
+                    usize += len(buf)
+                    out.write(buf)
+            csize, method = usize, 0
+            out.ensure(24)
+            out.write( struct.pack('<IIQQ', 0x08074b50, crc, csize, usize) )
+        central.append( central_record(name, flags, method, stat.st_mtime, crc, csize, usize, disk, offset, stat.st_mode, False) )
+        if manifest != None: manifest.append( (rel, data_offset, csize, usize, method, crc) )
+        if stage: stage.add(1, usize)
+    
+    root = os.path.join(src_folder, fname)
+    dirs_written = set()
+    count = 0
+    pending = [] # (rel, stat, future), in order
+    pending_bytes = 0 # size of pending files
+    
+    def flush(limit, limit_bytes):
+        nonlocal count, pending_bytes
+        while len(pending) > limit or (len(pending) > 1 and pending_bytes > limit_bytes):
+            rel, stat, future = pending.pop(0)
+            pending_bytes -= stat.st_size
+            for i, ch in enumerate(rel):
+                if ch == '/' and rel[:i] not in dirs_written: # directory entries before their contents (like zip -r)
+                    add_dir(rel[:i])
+                    dirs_written.add(rel[:i])
+            add_file(rel, stat, future.result() if future else None)
+            count += 1
+            if print_progress and count % 1000 == 0: print(f'   {count} files, {out.total / 1_000_000_000:.2f} GB')
+    
+    pool = ThreadPoolExecutor(max_workers=(jobs if jobs > 0 else (os.cpu_count() or 1)))
+    try:
+        if files == None: files = ( path for path, size, mtime_ns in inventory(root, print_progress=False) )
+        for path in files:
+            rel = os.path.join(fname, path)
+            stat = os.stat(os.path.join(src_folder, rel))
+            prepare = stat.st_size <= ARCHIVE_STREAM_SIZE or rel.lower().endswith(ARCHIVE_STORE_EXTS)
+            future = pool.submit(prepare_zip_entry, os.path.join(src_folder, rel)) if prepare else None
+            pending.append( (rel, stat, future) )
+            pending_bytes += stat.st_size
+            flush(ARCHIVE_AHEAD, ARCHIVE_AHEAD_BYTES)
+        flush(0, 0)
+        if fname not in dirs_written: add_dir(fname) # empty folder
+        
+        # central directory; records don't span volumes
+        cd_start = None
+        entries_on_disk = {}
+        for record in central:
+            out.ensure(len(record))
+            if cd_start == None: cd_start = out.position()
+            out.write(record)
+            entries_on_disk[out.position()[0]] = entries_on_disk.get(out.position()[0], 0) + 1
+        cd_size = sum( len(record) for record in central )
+        cd_disk, cd_offset = cd_start
+        out.ensure(56 + 20 + 22)
+        disk, offset = out.position()
+        entries = len(central)
+        entries_here = entries_on_disk.get(disk, 0)
+        if entries >= 0xffff or cd_offset >= 0xffffffff or cd_size >= 0xffffffff or disk >= 0xffff:
+            out.write( struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 0x031e, 45, disk, cd_disk, entries_here, entries, cd_size, cd_offset) )
+            out.write( struct.pack('<IIQI', 0x07064b50, disk, offset, disk + 1) )
+        out.write( struct.pack('<IHHHHIIH', 0x06054b50, min(disk, 0xffff), min(cd_disk, 0xffff), min(entries_here, 0xffff), min(entries, 0xffff), min(cd_size, 0xffffffff), min(cd_offset, 0xffffffff), 0) )
+    except BaseException:
+        # don't leave incomplete volumes behind
+        pool.shutdown(cancel_futures=True)
+        out.file.close()
+        for path in out.paths:
+            if os.path.exists(path): os.remove(path)
+        raise
+    pool.shutdown()
+    if print_progress: print(f'   {count} files, {out.total / 1_000_000_000:.2f} GB')
+    return out.close()
+
+ARCHIVE_SEQ = re.compile(rf'(?:{SHEET_PREFIX}\d+_)?(\d+)') # sequence number of a file in an archived folder: 0042.png, 0042/0042_0001.png, 0042.mp4, overview_001_0042-0061.png
+
+def archive_seq(path):
+    # path relative to the archived folder (e.g. frames); None for files without a sequence number
+    match = ARCHIVE_SEQ.match(path)
+    return int(match.group(1)) if match else None
+
+def open_manifest(folder):
+    '''
+    manifest of sharded archives (--shard), placed in the shards folder
+    members: every archived file with its shard, data offset and length (compressed), so it can be read with a single seek
+    '''
+    db = sqlite3.connect(os.path.join(folder, ARCHIVE_MANIFEST_FILE))
+    db.execute('CREATE TABLE IF NOT EXISTS shards (name TEXT PRIMARY KEY, target TEXT, size INTEGER, mtime_ns INTEGER)')
+    db.execute('CREATE TABLE IF NOT EXISTS members (name TEXT PRIMARY KEY, target TEXT, seq INTEGER, shard TEXT, offset INTEGER, length INTEGER, size INTEGER, method INTEGER, crc INTEGER)')
+    db.execute('CREATE INDEX IF NOT EXISTS members_seq ON members (target, seq)')
+    return db
+
+def run_archive_shards(target, fname, src_folder, dest_folder, shard_size, journal = None, force = False, jobs = ARCHIVE_JOBS):
+    '''
+    archive src_folder/fname as shards of shard_size sequences each (dest_folder/shards/<fname>_0001-0100.zip, ...),
+    and record all members in the manifest (see open_manifest)
+    files without sequence number go to <fname>_other.zip; shards that are up to date are skipped, obsolete ones removed
+    '''
+    in_folder = os.path.join(src_folder, fname)
+    shards_dir = os.path.join(dest_folder, OUT_SHARDS_DIR)
+    os.makedirs(shards_dir, exist_ok=True)
+    groups = {} # shard name -> files (relative to in_folder)
+    for path, size, mtime_ns in inventory(in_folder, print_progress=False):
+        seq = archive_seq(path)
+        if seq == None: name = f'{fname}_other.zip'
+        else:
+            first = (seq - 1) // shard_size * shard_size + 1
+            name = f'{fname}_{first:04d}-{first + shard_size - 1:04d}.zip'
+        groups.setdefault(name, []).append(path)
+    db = open_manifest(shards_dir)
+    print(f'Archiving {target}: {in_folder} -> {shards_dir} ({len(groups)} shards of {shard_size} sequences)')
+    skipped = 0
+    stage = metrics.stage(f'archive {target}', len(groups)) # items are shards
+    try:
+        for i, name in enumerate(sorted(groups)):
+            files = groups[name]
+            shard_path = os.path.join(shards_dir, name)
+            fp = fingerprint([ os.path.join(in_folder, path) for path in files ], src_folder, repr( ('shard', shard_size) )) if journal else None
+            row = db.execute('SELECT size, mtime_ns FROM shards WHERE name = ?', (name,)).fetchone()
+            # the manifest needs to match the shard as well
+            if not force and up_to_date(journal, shard_path, fp) and row != None and file_stats([shard_path])[0][1:] == list(row):
+                skipped += 1
+                stage.add(1)
+                continue
+            print(f'({i+1}/{len(groups)}) {len(files)} files -> {name}')
+            members = []
+            partfile = partial_path(shard_path)
+            start = time.perf_counter()
+            try:
+                write_zip(src_folder, fname, partfile, jobs=jobs, print_progress=False, files=files, manifest=members)
+                os.replace(partfile, shard_path)
+            finally:
+                if os.path.exists(partfile): os.remove(partfile)
+            stat = os.stat(shard_path)
+            stage.item(name, time.perf_counter() - start, stat.st_size, files=len(files))
+            with db:
+                db.execute('DELETE FROM members WHERE shard = ?', (name,))
+                db.execute('INSERT OR REPLACE INTO shards VALUES (?, ?, ?, ?)', (name, target, stat.st_size, stat.st_mtime_ns))
+                db.executemany('INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    ( (member, target, archive_seq(member[len(fname)+1:]), name, offset, length, size, method, crc) for member, offset, length, size, method, crc in members ))
+            record_output(journal, shard_path, fp)
+        if skipped > 0: print(f'Skipping {skipped} up to date shards')
+        # shards of sequences that don't exist anymore (or of a different shard size)
+        for (name,) in db.execute('SELECT name FROM shards WHERE target = ?', (target,)).fetchall():
+            if name in groups: continue
+            print(f'Removing obsolete shard {name}')
+            with db:
+                db.execute('DELETE FROM members WHERE shard = ?', (name,))
+                db.execute('DELETE FROM shards WHERE name = ?', (name,))
+            if os.path.exists(os.path.join(shards_dir, name)): os.remove(os.path.join(shards_dir, name))
+    finally:
+        stage.end()
+        db.close()
+
+def fetch_members(shards_dir, dest_folder, targets = [], from_ = 0, to_ = 0, names = []):
+    '''
+    restore single files from sharded archives, with one seek per file, using the manifest (see open_manifest)
+    targets, from_, to_ ... all files of the targets ('images', 'frames', ...) with sequence numbers from_..to_ (0 ... no limit)
+    names ... files by name, e.g. images/0042.png
+    returns number of files written to dest_folder
+    '''
+    db = open_manifest(shards_dir)
+    query = 'SELECT members.name, members.shard, offset, length, members.size, method, crc, shards.size FROM members JOIN shards ON members.shard = shards.name WHERE '
+    rows = []
+    for target in targets:
+        rows += db.execute(query + 'members.target = ? AND (? = 0 OR seq >= ?) AND (? = 0 OR seq <= ?)', (target, from_, from_, to_, to_)).fetchall()
+    for name in names:
+        found = db.execute(query + 'members.name = ?', (name,)).fetchall()
+        if len(found) == 0: print(f'{COLORS.RED}Not found in manifest: {name}{COLORS.END}')
+        rows += found
+    db.close()
+    by_shard = {}
+    for row in rows: by_shard.setdefault(row[1], []).append(row)
+    count = 0
+    for shard in sorted(by_shard):
+        members = sorted(by_shard[shard], key=lambda x: x[2]) # read sequentially
+        print(f'Fetching {len(members)} files from {shard}')
+        with open(os.path.join(shards_dir, shard), 'rb') as src:
+            if os.fstat(src.fileno()).st_size != members[0][7]: raise RuntimeError(f'{shard} changed since the manifest was written')
+            for name, _, offset, length, size, method, crc, _ in members:
+                path = os.path.join(dest_folder, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                partfile = partial_path(path)
+                src.seek(offset)
+                inflate = zlib.decompressobj(-15) if method == 8 else None
+                check = 0
+                try:
+                    with open(partfile, 'wb') as dst:
+                        remaining = length
+                        while remaining > 0:
+                            buf = src.read(min(remaining, ARCHIVE_BUFFER))
+                            if len(buf) == 0: raise EOFError(f'{shard} truncated at {name}')
+                            remaining -= len(buf)
+                            if inflate: buf = inflate.decompress(buf)
+                            check = zlib.crc32(buf, check)
+                            dst.write(buf)
+                        if inflate:
+                            buf = inflate.flush()
+                            check = zlib.crc32(buf, check)
+                            dst.write(buf)
+                    if check != crc: raise ValueError(f'CRC mismatch: {name} in {shard}')
+                    os.replace(partfile, path)
+                finally:
+                    if os.path.exists(partfile): os.remove(partfile)
+                count += 1
+    print(f'{count} files fetched to {dest_folder}')
+    return count
+
+ARCHIVE_TARGETS = {
+    'meta': TAR_META_DIR,
+    'sheets': OUT_SHEETS_DIR,
+    'images': TAR_IMAGES_DIR,
+    'movies': OUT_MOVIES_DIR,
+    'frames': TAR_FRAMES_DIR
+}
+
+def run_archive(target, src_folder, dest_folder, use_001=False, journal=None, force=False, jobs=ARCHIVE_JOBS, shard=0):
+    fname = ARCHIVE_TARGETS[target]
     in_folder_relative = os.path.join(src_folder, fname)
     if not os.path.exists(in_folder_relative):
         print (f'Archiving {target}: Skipping. Folder doesn\'t exist: {in_folder_relative}')
         return
+    if shard > 0: return run_archive_shards(target, fname, src_folder, dest_folder, shard, journal, force, jobs)
     zip_path_relative = os.path.join(dest_folder, fname) + '.zip'
     zip_path_absolute = os.path.join( os.path.abspath(dest_folder), fname) + '.zip'
-    if os.path.exists(zip_path_absolute): os.remove(zip_path_absolute) # need to remove manually, since zip won't overwrite
+    fp = fingerprint([ os.path.join(in_folder_relative, path) for path in list_files_recursive(in_folder_relative, print_progress=False) ], src_folder, repr( (use_001, ZIP_SPLIT) )) if journal else None
+    if not force and up_to_date(journal, zip_path_absolute, fp):
+        print(f'Archiving {target}: Skipping. Up to date: {zip_path_relative}')
+        return
+    for part in archive_parts(zip_path_absolute): os.remove(part) # remove old volumes (there might be more than will be written now)
     print(f'Archiving {target}: {in_folder_relative} -> {zip_path_relative}{"[.001]" if use_001 else ""}')
-    if not use_001: run_cmd(f'cd {src_folder}; zip -s {ZIP_SPLIT} -r \'{zip_path_absolute}\' {fname}') # need to cd into the folder, so the zip contains correct relative paths
-    else:
-        s = '-d' if sys.platform == 'darwin' else '--numeric-suffixes=1' # starting index not supported on darwin (will start at 000)
-        run_cmd(f'cd {src_folder}; zip -r - {fname} | split {s} -a 3 -b {ZIP_SPLIT.upper()} - \'{zip_path_absolute}.\'')
-        parts = glob.glob(f'{zip_path_absolute}.*')
-        # remove suffix if only one file
-        if len(parts) == 1:
-            os.rename( parts[0], os.path.splitext(parts[0])[0] )
-        # rename on darwin so index starts at 001 (no need to rename if suffix was already removed)
-        elif sys.platform == 'darwin':     
-            parts.sort(reverse=True)
-            for part in parts:
-                split = os.path.splitext(part)
-                new_num = int( split[1][1:] ) + 1 
-                new_suffix = f'.{new_num:03d}'
-                os.rename( part, split[0] + new_suffix )
+    with metrics.stage(f'archive {target}') as stage:
+        parts = write_zip(src_folder, fname, zip_path_absolute, parse_size(ZIP_SPLIT), use_001, jobs, stage=stage)
+    print(f'   {len(parts)} volume(s)')
+    record_output(journal, zip_path_absolute, fp, parts)
+
+
+METADATA_CSV_FIELDS = ['id', 'name', 'description', 'external_url', 'image', 'Category No.', 'No.', 'Sample', 'Geolocation (Lat, Lon)', 'Timestamp', 'Temperature (°C)', 'Wind Direction (°)', 'Humus (Organic Matter)', 'Calcium (Ca)', 'Magnesium (Mg)', 'Potassium (K)', 'Phosphor (P)', 'Nitrogen (N)', 'Sulfate (SO4)', 'Iron (Fe)', 'eDNA_1_Kingdom', 'eDNA_2_Phylum', 'eDNA_3_Class', 'eDNA_4_Order', 'eDNA_5_Family', 'eDNA_6_Genus', 'eDNA_7_Species', 'Atmospheric Pressure (hPa)', 'Humidity (%)', 'Wind Speed (m/s)']
+
+# typed, queryable columns of the metadata store: (key in flattened metadata (see metadata_row), column, type)
+METADATA_COLUMNS = [
+    ('No.', 'no', 'INTEGER PRIMARY KEY'),
+    ('_category_no', 'category_no', 'INTEGER'),
+    ('_category_name', 'category_name', 'TEXT'),
+    ('Sample', 'sample', 'TEXT'),
+    ('Geolocation (Lat, Lon)', 'geolocation', 'TEXT'),
+    ('Timestamp', 'timestamp', 'TEXT'),
+    ('Temperature (°C)', 'temperature', 'REAL'),
+    ('Wind Direction (°)', 'wind_direction', 'REAL'),
+    ('Atmospheric Pressure (hPa)', 'pressure', 'REAL'),
+    ('Humidity (%)', 'humidity', 'REAL'),
+    ('Wind Speed (m/s)', 'wind_speed', 'REAL'),
+    ('Rain (mm/h)', 'rain', 'REAL'),
+    ('Humus (Organic Matter)', 'humus', 'REAL'),
+    ('Calcium (Ca)', 'calcium', 'REAL'),
+    ('Magnesium (Mg)', 'magnesium', 'REAL'),
+    ('Potassium (K)', 'potassium', 'REAL'),
+    ('Phosphor (P)', 'phosphor', 'REAL'),
+    ('Nitrogen (N)', 'nitrogen', 'REAL'),
+    ('Sulfate (SO4)', 'sulfate', 'REAL'),
+    ('Iron (Fe)', 'iron', 'REAL'),
+    ('eDNA Fraction (%)', 'edna_fraction', 'REAL'),
+    ('eDNA_1_Kingdom', 'edna_1_kingdom', 'TEXT'),
+    ('eDNA_2_Phylum', 'edna_2_phylum', 'TEXT'),
+    ('eDNA_3_Class', 'edna_3_class', 'TEXT'),
+    ('eDNA_4_Order', 'edna_4_order', 'TEXT'),
+    ('eDNA_5_Family', 'edna_5_family', 'TEXT'),
+    ('eDNA_6_Genus', 'edna_6_genus', 'TEXT'),
+    ('eDNA_7_Species', 'edna_7_species', 'TEXT'),
+]
+METADATA_INDEXES = ['category_no', 'temperature', 'humidity', 'wind_speed', 'timestamp', 'edna_5_family', 'edna_6_genus']
+
+def metadata_row(obj):
+    # flatten _nft_metadata (with special structure according to client)
+    obj['id'] = obj['No.']
+    obj['name'] = f'PONY EARTH ReArt No. {obj["No."]}'
+    obj['description'] = f'PONY EARTH ReArt No. {obj["No."]}. The original PONY EARTH ReArt is based on biodiversity data captured on the first living lab and birthplace of PONY EARTH in Austria.'
+    obj['external_url'] = ''
+    obj['image'] = ''
+    obj['Category No.'] = obj['_category_no']
+    for key, val in obj['_edna_target'].items():
+        parts = key.split('_')
+        if val == '*': val = '--'
+        obj[f'eDNA_{parts[0]}_{parts[1].title()}'] = val
+    for key, val in obj['_weather_extra'].items():
+        obj[key] = val
+    return obj
+
+def column_value(val, type):
+    if val == None: return None
+    if type == 'REAL':
+        try: return float(val)
+        except (TypeError, ValueError): return None # e.g. '--'
+    return val
+
+def update_metadata_db(meta, db_path, print_progress = True):
+    '''
+    bring the metadata store at db_path up to date with the metadata json files (only new or changed files are read), and return the (open) database
+    table metadata has a typed column per entry of METADATA_COLUMNS, plus the flattened metadata (json) for export
+    '''
+    db = sqlite3.connect(db_path)
+    columns = ', '.join( f'"{col}" {type}' for key, col, type in METADATA_COLUMNS )
+    db.executescript(f'''
+        CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY KEY, no INTEGER, size INTEGER, mtime_ns INTEGER);
+        CREATE TABLE IF NOT EXISTS metadata ({columns}, row TEXT);
+    ''' + ''.join( f'CREATE INDEX IF NOT EXISTS metadata_{col} ON metadata ("{col}");\n' for col in METADATA_INDEXES ))
+    known = { name: (no, size, mtime_ns) for name, no, size, mtime_ns in db.execute('SELECT name, no, size, mtime_ns FROM sources') }
+    names = set()
+    updated = 0
+    stage = metrics.stage('metadata', len(meta))
+    with db, stage:
+        for path in meta:
+            name = os.path.basename(path)
+            names.add(name)
+            stat = os.stat(path)
+            if name in known and known[name][1:] == (stat.st_size, stat.st_mtime_ns):
+                stage.add(1)
+                continue
+            try:
+                with open(path, 'rb') as file:
+                    row = metadata_row( json.loads(file.read())['_nft_metadata'] )
+            except (json.JSONDecodeError, KeyError, AttributeError, IndexError) as e:
+                print(f'   {COLORS.RED}Can\'t read {path}: {e!r}{COLORS.END}')
+                stage.add(1, stat.st_size, failures=1)
+                continue
+            stage.add(1, stat.st_size)
+            if name in known: db.execute('DELETE FROM metadata WHERE no = ?', (known[name][0],))
+            values = [ column_value(row.get(key), type.split()[0]) for key, col, type in METADATA_COLUMNS ]
+            db.execute(f'INSERT OR REPLACE INTO metadata VALUES ({", ".join("?" * (len(values) + 1))})', values + [json.dumps(row)])
+            db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)', (name, row['No.'], stat.st_size, stat.st_mtime_ns))
+            updated += 1
+        removed = [ (name, no) for name, (no, size, mtime_ns) in known.items() if name not in names ]
+        for name, no in removed:
+            db.execute('DELETE FROM metadata WHERE no = ?', (no,))
+            db.execute('DELETE FROM sources WHERE name = ?', (name,))
+    if print_progress: print(f'Metadata store {db_path}: {updated} updated, {len(removed)} removed, {len(names) - updated} unchanged')
+    return db
+
+def write_metadata_csv(meta, csv_path, db_path):
+    # single csv file of all metadata (with special structure according to client); exported from the metadata store
+    import csv
+    db = update_metadata_db(meta, db_path)
+    with open(csv_path, 'w') as csvfile:
+        writer = csv.DictWriter(csvfile, METADATA_CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for row, in db.execute('SELECT row FROM metadata ORDER BY no'):
+            writer.writerow( json.loads(row) )
+    db.close()
+
+def query_metadata(meta, db_path, where):
+    # sequence numbers of images matching the sql condition where, e.g. 'category_no = 3 AND temperature > 25'
+    db = update_metadata_db(meta, db_path)
+    nos = [ no for no, in db.execute(f'SELECT no FROM metadata WHERE {where} ORDER BY no') ]
+    db.close()
+    return nos
 
 
 extract_default = True
@@ -504,19 +2516,48 @@ if __name__ == '__main__':
     parser.add_argument('--sheets', action='store_true', default=False)
     parser.add_argument('--movies',  action='store_true', default=False)
     parser.add_argument('--metadata_to_csv',  action='store_true', default=False)
+    parser.add_argument('--query', type=str, default=None) # sql condition on metadata store columns
     parser.add_argument('-y', action='store_true', default=False)
     
     parser.add_argument('--check_tars', action='store_true', default=False)
     parser.add_argument('--check_extracted', action='store_true', default=False)
     parser.add_argument('--check_integrity', action='store_true', default=False)
     parser.add_argument('--check_movies', action='store_true', default=False)
+    parser.add_argument('--fast', action='store_true', default=False) # valid for check_movies (structure only, no decoding)
     parser.add_argument('--archive', type=str, default=None) # 'all', 'images', 'frames', 'movies', 'meta', 'sheets'
     parser.add_argument('--001', action='store_true', default=False)
+    parser.add_argument('--shard', type=int, default=0) # valid for archive (sequences per shard; 0 ... single archive)
+    parser.add_argument('--fetch', type=str, default=None) # targets and/or file names to restore from sharded archives
+    parser.add_argument('--force', action='store_true', default=False) # build outputs even if up to date
     
     # valid for extract, sheets and movies (for extract :counts tar files, not image sequence numbers)
     parser.add_argument('--from', type=int, default=0)
     parser.add_argument('--to', type=int, default=0)
     
+    parser.add_argument('--jobs', type=int, default=None) # valid for movies (concurrent encodes, default MOVIE_JOBS), extract (concurrent tars, default EXTRACT_JOBS), sheets (worker processes, default SHEET_JOBS) and checks (worker processes, default CHECK_JOBS)
+    parser.add_argument('--threads', type=int, default=MOVIE_THREADS) # valid for movies (total thread budget; 0 ... number of CPUs)
+    parser.add_argument('--stream', action='store_true', default=False) # valid for movies (encode directly from tars in in_folder)
+    parser.add_argument('--profile', type=str, default=MOVIE_PROFILE) # valid for movies (encoder profile, auto or fastest) and calibrate (comma separated profiles)
+    parser.add_argument('--max_size', type=str, default='0') # valid for movies with --profile fastest (max. calibrated movie size, e.g. 20m)
+    parser.add_argument('--segments', type=int, default=MOVIE_SEGMENTS) # valid for movies (encode each movie as this many segments in parallel)
+    parser.add_argument('--outputs', type=str, default=None) # valid for movies (comma separated profile[@resolution], encoded in one pass)
+    parser.add_argument('--calibrate', action='store_true', default=False) # encode a sample sequence with each profile, record frames/s and size
+    
+    parser.add_argument('--tar_index', type=str, default=None) # valid for check_tars and extract --seq (path of tar member index)
+    parser.add_argument('--seq', type=str, default=None) # valid for extract and fetch (sequence number range, e.g. 1501-3000)
+    parser.add_argument('--bwlimit', type=float, default=EXTRACT_BWLIMIT) # valid for extract (total read bandwidth in MB/s)
+    parser.add_argument('--disk_budget', type=str, default=None) # valid for extract with movies (max. size of frames on disk, e.g. 2t)
+    parser.add_argument('--snapshot', action='store_true', default=False) # valid for check_extracted, check_integrity (reuse/save listing of extract folder)
+    parser.add_argument('--check_zlib', action='store_true', default=False) # valid for check_integrity (also decompress png image data)
+    parser.add_argument('--queue', type=str, default=None) # valid for extract, sheets and movies (shared work queue folder, for workers on several hosts)
+    parser.add_argument('--worker', type=str, default=None) # valid for queue (worker name, default host:pid)
+    parser.add_argument('--lease', type=float, default=workqueue.LEASE) # valid for queue (seconds without heartbeat until a claim is taken over)
+    parser.add_argument('--watch', action='store_true', default=False) # index, extract and verify tars as they are recorded (and encode complete sequences with --movies)
+    parser.add_argument('--poll', type=float, default=WATCH_POLL) # valid for watch (seconds between listings of the tar folder)
+    parser.add_argument('--stable', type=float, default=WATCH_STABLE) # valid for watch (seconds a tar must stay unchanged to be complete)
+    parser.add_argument('--idle', type=float, default=0) # valid for watch (stop after this many seconds without a new tar; 0 ... run until interrupted)
+    parser.add_argument('--metrics', type=str, default=None) # path of metrics log (json lines, appended)
+    
     parser.add_argument('--tar_v', action='store_true', default=False) # valid for extract (tar option v, verbose)
     parser.add_argument('--tar_k', action='store_true', default=False) # valid for extract (tar option k, keep, i.d. don't overwrite)
     
@@ -536,7 +2577,7 @@ if __name__ == '__main__':
     # print(args)
     
     # if none of the options are enabled use default options
-    if (not extract and not sheets and not movies and not metadata_to_csv and not check_tars and not check_extracted and not check_integrity and not check_movies and not archive):
+    if (not extract and not sheets and not movies and not metadata_to_csv and not check_tars and not check_extracted and not check_integrity and not check_movies and not archive and not args.query and not args.fetch and not args.calibrate and not args.watch):
         extract = extract_default
         sheets = sheets_default
         movies = movies_default
@@ -548,7 +2589,8 @@ if __name__ == '__main__':
         print('Exiting')
         exit()
         
-    if extract or check_tars:
+    stream = args.movies and args.stream
+    if extract or check_tars or stream or args.watch:
         tar_folder = in_folder
         extract_folder = os.path.join( args.out_folder, os.path.basename(in_folder) + OUTDIR_SUFFIX )
         out_folder = extract_folder
@@ -559,6 +2601,40 @@ if __name__ == '__main__':
     print(f'                   Input TAR Folder: {tar_folder if tar_folder != None else "-"}')
     print(f'Extract Folder (Images/Frames/Meta): {extract_folder}')
     print(f'      Output Folder (Sheets/Movies): {out_folder}')
+    if movies or args.calibrate:
+        encoders = ffmpeg_encoders()
+        if encoders == None:
+            print(f'{COLORS.RED}Can\'t run ffmpeg{COLORS.END}')
+            print('Exiting')
+            exit(1)
+        for name in args.profile.split(','):
+            if name not in MOVIE_PROFILES and name not in ['auto', 'fastest']:
+                print(f'Unknown profile: {name} ({", ".join(MOVIE_PROFILES)}, auto, fastest)')
+                exit(1)
+    if movies and args.outputs:
+        if stream or args.disk_budget:
+            print('--outputs is not supported with --stream or --disk_budget')
+            exit(1)
+        for name, res, folder in parse_outputs(args.outputs):
+            if name not in MOVIE_PROFILES or len(usable_profiles(encoders, [name])) == 0:
+                print(f'{COLORS.RED}Output profile {name} not usable with the local ffmpeg{COLORS.END} (usable: {", ".join(usable_profiles(encoders)) or "none"})')
+                exit(1)
+        # each output has its own profile, --profile isn't used
+        print(f'                    Movie Profiles: {", ".join( f"{name} ({MOVIE_PROFILES[name][0]})" for name, res, folder in parse_outputs(args.outputs) )}')
+    elif movies:
+        profile = select_profile(args.profile, encoders, os.path.join(out_folder, MOVIE_CALIBRATION_FILE), parse_size(args.max_size))
+        if profile == None:
+            print(f'{COLORS.RED}Profile {args.profile} not usable with the local ffmpeg{COLORS.END} (usable: {", ".join(usable_profiles(encoders)) or "none"})')
+            print('Exiting')
+            exit(1)
+        MOVIE_ENCODE = MOVIE_PROFILES[profile][1:]
+        print(f'                     Movie Profile: {profile} ({MOVIE_PROFILES[profile][0]})')
+        if args.segments > 1 and (MOVIE_ENCODE[1] != 'mp4' or profile_gop(MOVIE_ENCODE) == None):
+            print(f'--segments needs an mp4 profile with a fixed keyframe interval ({", ".join(p for p in MOVIE_PROFILES if MOVIE_PROFILES[p][2] == "mp4" and profile_gop(MOVIE_PROFILES[p][1:]))}), not {profile}')
+            exit(1)
+    if movies and args.segments > 1 and MOVIE_INPUT_FPS != MOVIE_OUTPUT_FPS:
+        print('--segments needs MOVIE_INPUT_FPS == MOVIE_OUTPUT_FPS')
+        exit(1)
     if (not args.y):
         cont = input('Continue (y/n)? ')
         if (cont.lower() != 'y'): 
@@ -566,18 +2642,39 @@ if __name__ == '__main__':
             exit()
     
     start_time = time.time()
+    journal = None # build journal, opened once the output folder exists
+    if args.metrics: metrics.open_log(args.metrics)
+    work_queue = workqueue.WorkQueue(args.queue, args.worker, args.lease) if args.queue else None
     
     if check_tars:
         tars = list_files(tar_folder, '*.tar')
         print()
         print(f'CHECK_TARS: {len(tars)} TAR files found')
         if len(tars) > 0:
-            files = list_tar_contents(tars, remove_duplicates=True)
+            index_path = args.tar_index if args.tar_index else os.path.join(tar_folder, TAR_INDEX_FILE)
+            files = list_tar_contents(tars, remove_duplicates=True, index_path=index_path, jobs=(args.jobs if args.jobs != None else CHECK_JOBS))
             check_files(files)
         else:
             print('Exiting')
             exit()
     
+    if args.watch:
+        print()
+        if stream or args.disk_budget or work_queue:
+            print('--watch is not supported with --stream, --disk_budget or --queue')
+            exit(1)
+        os.makedirs(extract_folder, exist_ok=True)
+        index_path = args.tar_index if args.tar_index else os.path.join(tar_folder, TAR_INDEX_FILE)
+        outputs = None
+        if movies:
+            journal = journal or open_build_journal(out_folder)
+            if args.outputs:
+                outputs = [ (MOVIE_PROFILES[name][1:], res, os.path.join(out_folder, folder)) for name, res, folder in parse_outputs(args.outputs) ]
+                for encode, res, folder in outputs: os.makedirs(folder, exist_ok=True)
+        watch_tars(tar_folder, extract_folder, index_path, movies, args.poll, args.stable, args.idle, args.jobs if args.jobs != None else MOVIE_JOBS, args.threads, journal, args.force, outputs, args.segments, CHECK_JOBS)
+        extract = False # done
+        movies = False
+    
     print()
     if extract:
         tars = list_files(tar_folder, '*.tar')
@@ -585,7 +2682,23 @@ if __name__ == '__main__':
         print(f'EXTRACT: {len(tars)} TAR files found')
         if len(tars) > 0:
             os.makedirs(extract_folder, exist_ok=True);
-            extract_tars(tars, out_folder, getattr(args,'from'), args.to)
+            if args.disk_budget and movies:
+                index_path = args.tar_index if args.tar_index else os.path.join(tar_folder, TAR_INDEX_FILE)
+                from_, to_ = parse_range(args.seq) if args.seq else (0, 0)
+                journal = journal or open_build_journal(out_folder)
+                run_pipeline(tars, out_folder, index_path, parse_size(args.disk_budget), from_, to_, args.jobs if args.jobs != None else MOVIE_JOBS, args.threads, journal, args.force)
+                movies = False # done
+            elif args.seq:
+                index_path = args.tar_index if args.tar_index else os.path.join(tar_folder, TAR_INDEX_FILE)
+                from_, to_ = parse_range(args.seq)
+                extract_members(tars, out_folder, index_path, from_, to_, args.tar_k, args.jobs if args.jobs != None else CHECK_JOBS)
+            elif work_queue:
+                from_ = max(1, getattr(args, 'from'))
+                to_ = args.to if args.to > 0 else len(tars)
+                units = workqueue.units(list(range(from_, to_ + 1)), QUEUE_TARS, 'extract', key=lambda n: n)
+                work_queue.run(units, lambda name, nums: extract_tars(tars, out_folder, nums[0], nums[-1], args.jobs if args.jobs != None else EXTRACT_JOBS, args.bwlimit, args.force))
+            else:
+                extract_tars(tars, out_folder, getattr(args,'from'), args.to, args.jobs if args.jobs != None else EXTRACT_JOBS, args.bwlimit, args.force)
         else:
             print('Exiting')
             exit()
@@ -595,10 +2708,9 @@ if __name__ == '__main__':
     if check_extracted or check_integrity:
         print()
         print(f'CHECK_FILES: Checking {extract_folder}')
-        files = list_files_recursive(extract_folder)
-        # print(files)
-        # exit()
-        check_files(files, extract_folder if check_integrity else None)
+        snapshot = os.path.abspath(extract_folder) + INVENTORY_SUFFIX if args.snapshot else None
+        files = ( path for path, size, mtime_ns in inventory(extract_folder, snapshot=snapshot) ) # streamed into check_files
+        check_files(files, extract_folder if check_integrity else None, args.jobs if args.jobs != None else CHECK_JOBS, args.check_zlib)
     
     print()
     if sheets:
@@ -609,12 +2721,27 @@ if __name__ == '__main__':
         if len(pngs_limited) > 0:
             sheets_dir = os.path.join(out_folder, OUT_SHEETS_DIR)
             os.makedirs(sheets_dir, exist_ok=True);
-            create_contactsheets(pngs_limited, sheets_dir)
+            journal = journal or open_build_journal(out_folder)
+            if work_queue:
+                per_unit = QUEUE_PAGES * 8 * 5 # pages of tiles_x * tiles_y images
+                units = [ (f'sheets_{i // per_unit + 1:04d}', (i // (8 * 5), pngs_limited[i:i+per_unit])) for i in range(0, len(pngs_limited), per_unit) ]
+                work_queue.run(units, lambda name, data: create_contactsheets(data[1], sheets_dir, jobs=(args.jobs if args.jobs != None else SHEET_JOBS), journal=journal, force=args.force, first_page=data[0]))
+            else:
+                create_contactsheets(pngs_limited, sheets_dir, jobs=(args.jobs if args.jobs != None else SHEET_JOBS), journal=journal, force=args.force)
     else:
         print('Skipping SHEETS')
     
     print()
-    if movies:
+    if movies and stream:
+        tars = list_files(tar_folder, '*.tar')
+        print(f'MOVIES (STREAM): {len(tars)} TAR files found')
+        if len(tars) > 0:
+            movies_dir = os.path.join(out_folder, OUT_MOVIES_DIR)
+            os.makedirs(movies_dir, exist_ok=True);
+            journal = journal or open_build_journal(out_folder)
+            index_path = args.tar_index if args.tar_index else os.path.join(tar_folder, TAR_INDEX_FILE)
+            create_movies_from_tars(tars, movies_dir, getattr(args, 'from'), args.to, args.jobs if args.jobs != None else MOVIE_JOBS, args.threads, journal, args.force, index_path, CHECK_JOBS)
+    elif movies:
         anim_folders = list_folders( os.path.join(extract_folder, TAR_FRAMES_DIR), '[0-9]*' )
         anim_folders_limited = limit_range( anim_folders, getattr(args, 'from'), args.to )
         if len(anim_folders_limited) == len(anim_folders): print(f'MOVIES: {len(anim_folders)} animation folders found')
@@ -623,47 +2750,65 @@ if __name__ == '__main__':
         if len(anim_folders_limited) > 0:
             movies_dir = os.path.join(out_folder, OUT_MOVIES_DIR)
             os.makedirs(movies_dir, exist_ok=True);
-            create_movies(anim_folders_limited, movies_dir)
+            journal = journal or open_build_journal(out_folder)
+            outputs = None
+            if args.outputs:
+                outputs = [ (MOVIE_PROFILES[name][1:], res, os.path.join(out_folder, folder)) for name, res, folder in parse_outputs(args.outputs) ]
+                for encode, res, folder in outputs: os.makedirs(folder, exist_ok=True)
+                print(f'Encoding {len(outputs)} outputs per movie: {", ".join(folder for encode, res, folder in outputs)}')
+            if work_queue:
+                units = workqueue.units(anim_folders_limited, QUEUE_SEQUENCES, 'movies', key=lambda folder: int(os.path.basename(folder)))
+                work_queue.run(units, lambda name, folders: create_movies(folders, movies_dir, args.jobs if args.jobs != None else MOVIE_JOBS, args.threads, journal, args.force, outputs=outputs, segments=args.segments))
+            else:
+                create_movies(anim_folders_limited, movies_dir, args.jobs if args.jobs != None else MOVIE_JOBS, args.threads, journal, args.force, outputs=outputs, segments=args.segments)
     else:
         print('Skipping MOVIES')
     
+    if args.calibrate:
+        anim_folders = limit_range( list_folders( os.path.join(extract_folder, TAR_FRAMES_DIR), '[0-9]*' ), getattr(args, 'from'), args.to )
+        names = [ name for name in args.profile.split(',') if name in MOVIE_PROFILES ]
+        profiles = usable_profiles(encoders, names if len(names) > 0 else None)
+        print()
+        if len(anim_folders) == 0:
+            print('CALIBRATE: No animation folders found')
+        else:
+            calibration_path = os.path.join(out_folder, MOVIE_CALIBRATION_FILE)
+            print(f'CALIBRATE: {anim_folders[0]} with {len(profiles)} profiles ({", ".join(p for p in MOVIE_PROFILES if p not in profiles) or "none"} not usable)')
+            os.makedirs(out_folder, exist_ok=True)
+            results = calibrate_profiles(anim_folders[0], profiles, calibration_path, args.threads)
+            ranked = sorted( (r['fps'], p) for p, r in results.items() if r['ok'] )
+            if len(ranked) > 0: print(f'Fastest: {ranked[-1][1]} ({ranked[-1][0]:.1f} frames/s); results recorded in {calibration_path} (use with --profile fastest)')
+    
     if check_movies:
         movies_dir = os.path.join(out_folder, OUT_MOVIES_DIR)
         print()
         print(f'CHECK_MOVIES: Checking {movies_dir}')
-        files = list_files_recursive(movies_dir)
-        check_mp4s(files)
+        files = [ os.path.join(movies_dir, path) for path in list_files_recursive(movies_dir) ]
+        cache = open_check_cache(out_folder)
+        check_mp4s(files, args.jobs if args.jobs != None else CHECK_JOBS, cache, full=(not args.fast))
+        cache.close()
     
     if metadata_to_csv:
         meta = list_files( os.path.join(extract_folder, TAR_META_DIR), '[0-9]*.json' )
         print()
         print(f'METADATA_TO_CSV: {len(meta)} metadata files found')
-        import csv
-        with open(os.path.join(extract_folder, 'metadata.csv'), 'w') as csvfile:
-            fieldnames = ['id', 'name', 'description', 'external_url', 'image', 'Category No.', 'No.', 'Sample', 'Geolocation (Lat, Lon)', 'Timestamp', 'Temperature (°C)', 'Wind Direction (°)', 'Humus (Organic Matter)', 'Calcium (Ca)', 'Magnesium (Mg)', 'Potassium (K)', 'Phosphor (P)', 'Nitrogen (N)', 'Sulfate (SO4)', 'Iron (Fe)', 'eDNA_1_Kingdom', 'eDNA_2_Phylum', 'eDNA_3_Class', 'eDNA_4_Order', 'eDNA_5_Family', 'eDNA_6_Genus', 'eDNA_7_Species', 'Atmospheric Pressure (hPa)', 'Humidity (%)', 'Wind Speed (m/s)']
-            writer = csv.DictWriter(csvfile, fieldnames, extrasaction='ignore')
-            writer.writeheader()
-            for path in meta:
-                with open(path, 'r') as file:
-                    obj = json.load(file)['_nft_metadata']
-                    obj['id'] = obj['No.']
-                    obj['name'] = f'PONY EARTH ReArt No. {obj['No.']}'
-                    obj['description'] = f'PONY EARTH ReArt No. {obj['No.']}. The original PONY EARTH ReArt is based on biodiversity data captured on the first living lab and birthplace of PONY EARTH in Austria.'
-                    obj['external_url'] = ''
-                    obj['image'] = ''
-                    obj['Category No.'] = obj['_category_no']
-                    for key, val in obj['_edna_target'].items():
-                        parts = key.split('_')
-                        parts[1].title()
-                        if val == '*': val = '--'
-                        obj[f'eDNA_{parts[0]}_{parts[1].title()}'] = val
-                    for key, val in obj['_weather_extra'].items():
-                        obj[key] = val
-                    writer.writerow(obj)
-
+        csv_path = os.path.join(extract_folder, 'metadata.csv')
+        journal = journal or open_build_journal(out_folder)
+        fp = fingerprint(meta, extract_folder)
+        if not args.force and up_to_date(journal, csv_path, fp): print(f'Skipping. Up to date: {csv_path}')
+        else:
+            write_metadata_csv(meta, csv_path, os.path.join(extract_folder, METADATA_DB_FILE))
+            record_output(journal, csv_path, fp)
+    
+    if args.query:
+        meta = list_files( os.path.join(extract_folder, TAR_META_DIR), '[0-9]*.json' )
+        print()
+        print(f'QUERY: {args.query}')
+        nos = query_metadata(meta, os.path.join(extract_folder, METADATA_DB_FILE), args.query)
+        print(f'{len(nos)} images: {format_runs(runs(nos, sort=False, singles_as_list=False))}')
     
     if archive: 
-        all_targets = ['meta', 'sheets', 'images', 'movies', 'frames']
+        all_targets = list(ARCHIVE_TARGETS)
         # 'all', 'images', 'frames', 'movies', 'meta', 'sheets'
         targets = archive.split(',')
         targets = list( map(lambda x: x.strip(), targets) )
@@ -673,8 +2818,17 @@ if __name__ == '__main__':
             print(f'\nARCHIVE: no valid targets given ({", ".join(all_targets)}, all)')
         else: 
             print(f'\nARCHIVE: {", ".join(targets)}')
+            os.makedirs(out_folder, exist_ok=True)
             for target in targets:
-                run_archive(target, extract_folder, out_folder, getattr(args, '001'))
+                journal = journal or open_build_journal(out_folder)
+                run_archive(target, extract_folder, out_folder, getattr(args, '001'), journal, args.force, args.jobs if args.jobs != None else ARCHIVE_JOBS, args.shard)
+    
+    if args.fetch:
+        items = [ x.strip() for x in args.fetch.split(',') ]
+        from_, to_ = parse_range(args.seq) if args.seq else (0, 0)
+        print(f'\nFETCH: {", ".join(items)}{f" (sequences {from_}-{to_})" if args.seq else ""}')
+        fetch_members(in_folder, out_folder, [ x for x in items if x in ARCHIVE_TARGETS ], from_, to_, [ x for x in items if x not in ARCHIVE_TARGETS ])
     
+    metrics.summary()
     print()
     print_elapsed()
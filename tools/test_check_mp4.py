@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# Python 3.10
+
+'''
+Tests for the movie check (check_mp4) of process_pony.py
+
+    python3 -m unittest test_check_mp4 (in tools/)
+
+The decode tests need ffmpeg (with libx264) and are skipped without it; the others use a stand-in ffmpeg script.
+'''
+
+import os
+import io
+import shutil
+import struct
+import tempfile
+import unittest
+import subprocess
+import contextlib
+
+import process_pony
+
+FRAMES = 10
+
+
+def zero_mdat(path):
+    # overwrite the payload of the mdat box with zeros, keeping the file structure (and size) intact
+    with open(path, 'r+b') as file:
+        pos = 0
+        while True:
+            file.seek(pos)
+            header = file.read(8)
+            if len(header) < 8: raise ValueError('no mdat box')
+            size, type = struct.unpack('>I4s', header)
+            if type == b'mdat':
+                file.write(bytes(size - 8))
+                return
+            pos += size
+
+
+class CheckMp4Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved = (process_pony.MOVIE_FRAMES, process_pony.MOVIE_LOOPS, process_pony.MOVIE_RES, os.environ['PATH'])
+        process_pony.MOVIE_FRAMES, process_pony.MOVIE_LOOPS, process_pony.MOVIE_RES = FRAMES, 1, None
+
+    def tearDown(self):
+        process_pony.MOVIE_FRAMES, process_pony.MOVIE_LOOPS, process_pony.MOVIE_RES, os.environ['PATH'] = self.saved
+        shutil.rmtree(self.tmp)
+
+    def encode(self, name):
+        path = os.path.join(self.tmp, name)
+        subprocess.run(['ffmpeg', '-nostdin', '-v', 'error', '-f', 'lavfi', '-i', f'testsrc=size=64x64:rate={process_pony.MOVIE_OUTPUT_FPS}',
+                        '-frames:v', str(FRAMES), '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-movflags', '+faststart', path], check=True)
+        return path
+
+    def stand_in(self, script):
+        # ffmpeg on PATH replaced by a shell script
+        folder = os.path.join(self.tmp, 'bin')
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, 'ffmpeg'), 'w') as file: file.write('#!/bin/sh\n' + script + '\n')
+        os.chmod(os.path.join(folder, 'ffmpeg'), 0o755)
+        os.environ['PATH'] = folder + os.pathsep + os.environ['PATH']
+
+    @unittest.skipUnless(shutil.which('ffmpeg'), 'needs ffmpeg')
+    def test_valid(self):
+        valid, size, mtime_ns, error = process_pony.check_mp4(self.encode('ok.mp4'))
+        self.assertTrue(valid, error)
+
+    @unittest.skipUnless(shutil.which('ffmpeg'), 'needs ffmpeg')
+    def test_corrupt_mdat(self):
+        path = self.encode('corrupt.mp4')
+        zero_mdat(path)
+        # the structure is intact, so only decoding finds it
+        self.assertTrue(process_pony.check_mp4(path, full=False)[0])
+        valid, size, mtime_ns, error = process_pony.check_mp4(path)
+        self.assertFalse(valid)
+        self.assertTrue(error)
+
+    def test_error_output(self):
+        # decoding errors with exit code 0 (ffmpeg without -xerror)
+        path = os.path.join(self.tmp, 'movie.gif')
+        with open(path, 'wb') as file: file.write(b'GIF89a')
+        self.stand_in('echo "[gif @ 0x1] corrupt frame" >&2; exit 0')
+        self.assertEqual(process_pony.check_mp4(path), (False, 6, os.stat(path).st_mtime_ns, '[gif @ 0x1] corrupt frame'))
+        self.stand_in('exit 0')
+        self.assertTrue(process_pony.check_mp4(path)[0])
+        self.stand_in('exit 1')
+        self.assertEqual(process_pony.check_mp4(path)[3], 'ffmpeg exit code 1')
+
+    def test_cache_tier(self):
+        # results recorded by the earlier decode check (mp4_full) aren't trusted
+        path = os.path.join(self.tmp, 'movie.gif')
+        with open(path, 'wb') as file: file.write(b'GIF89a')
+        cache = process_pony.open_check_cache(self.tmp)
+        stat = os.stat(path)
+        with cache: cache.execute('INSERT INTO verified VALUES (?, ?, ?, ?)', ('mp4_full', os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+        self.stand_in('echo "[gif @ 0x1] corrupt frame" >&2; exit 0')
+        with contextlib.redirect_stdout(io.StringIO()): errors = process_pony.check_mp4s([path], jobs=1, cache=cache)
+        self.assertEqual(errors, [path])
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# Python 3.10
+
+'''
+Tests for upload.py against the stand-in dbxcli (fake_dbxcli.py)
+
+    python3 -m unittest test_upload (in tools/)
+'''
+
+import os
+import io
+import shutil
+import tempfile
+import unittest
+import contextlib
+
+import upload
+
+FAKE_DBXCLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_dbxcli.py')
+
+
+class UploadTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, 'videos')
+        self.remote = os.path.join(self.tmp, 'remote')
+        self.log = os.path.join(self.tmp, 'dbxcli.log')
+        os.makedirs(os.path.join(self.src, 'empty'))
+        for i in range(6):
+            with open(os.path.join(self.src, f'{i+1:04d}.mp4'), 'wb') as file: file.write(os.urandom(1000 + i))
+        self.env = { 'FAKE_DBXCLI_REMOTE': self.remote, 'FAKE_DBXCLI_DELAY': '0,0.02', 'FAKE_DBXCLI_LOG': self.log }
+        self.saved = (upload.DBXCLI, upload.RETRY_SLEEP, dict(os.environ))
+        upload.DBXCLI = FAKE_DBXCLI
+        upload.RETRY_SLEEP = [0.01, 0.05]
+
+    def tearDown(self):
+        upload.DBXCLI, upload.RETRY_SLEEP, environ = self.saved
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(self.tmp)
+
+    def put(self, sync = False, jobs = 3, **env):
+        os.environ.update(self.env, **env)
+        if os.path.exists(self.log): os.remove(self.log)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out): upload.put(self.src, '/backup', jobs=jobs, sync=sync)
+        try:
+            with open(self.log) as file: calls = [ line.split() for line in file ]
+        except FileNotFoundError:
+            calls = []
+        return out.getvalue(), calls
+
+    def puts(self, calls):
+        return [ call for call in calls if call[1] == 'put' ]
+
+    def assert_uploaded(self):
+        for name in os.listdir(self.src):
+            if name.startswith('.') or os.path.isdir(os.path.join(self.src, name)): continue
+            with open(os.path.join(self.src, name), 'rb') as a, open(os.path.join(self.remote, 'backup', 'videos', name), 'rb') as b:
+                self.assertEqual(a.read(), b.read())
+        self.assertTrue(os.path.isdir(os.path.join(self.remote, 'backup', 'videos', 'empty')))
+
+    def test_upload(self):
+        out, calls = self.put()
+        self.assert_uploaded()
+        self.assertEqual(len(self.puts(calls)), 6)
+        self.assertIn('Failed: 0', out)
+
+    def test_retries(self):
+        # every put fails twice, then succeeds; the other files keep uploading meanwhile
+        out, calls = self.put(FAKE_DBXCLI_FAIL_FIRST='2')
+        self.assert_uploaded()
+        puts = self.puts(calls)
+        self.assertEqual(len(puts), 18)
+        self.assertEqual(len([ call for call in puts if call[0] == '0' ]), 6)
+        self.assertIn('Retry 2/∞', out)
+        self.assertIn('Reducing concurrent uploads to 1', out)
+
+    def test_random_failures(self):
+        out, calls = self.put(FAKE_DBXCLI_FAIL='0.3', jobs=4)
+        self.assert_uploaded()
+        self.assertIn('Failed: 0', out.splitlines()[-1])
+
+    def test_gives_up(self):
+        os.environ.update(self.env, FAKE_DBXCLI_FAIL_FIRST='5')
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out): upload.put(self.src, '/backup', retry=1, jobs=2)
+        self.assertIn('Failed: 6', out.getvalue())
+        self.assertIn('To retry fails, type:', out.getvalue())
+
+    def test_backoff(self):
+        upload.RETRY_SLEEP = [5, 300]
+        for tries in range(1, 12):
+            sleep = min(5 * 2 ** (tries - 1), 300)
+            for i in range(20): self.assertTrue(sleep / 2 <= upload.retry_sleep(tries) <= sleep)
+
+    def test_sync(self):
+        out, calls = self.put(sync=True)
+        self.assert_uploaded()
+        self.assertEqual(len(self.puts(calls)), 6)
+        # resume: nothing changed, nothing uploaded (hashes match the recorded ones)
+        out, calls = self.put(sync=True)
+        self.assertEqual(len(self.puts(calls)), 0)
+        self.assertIn('Skipped: 7', out)
+        # changed and removed on dropbox: only those are uploaded again
+        with open(os.path.join(self.src, '0002.mp4'), 'wb') as file: file.write(b'changed')
+        os.remove(os.path.join(self.remote, 'backup', 'videos', '0005.mp4'))
+        out, calls = self.put(sync=True)
+        self.assertEqual(sorted( os.path.basename(call[3]) for call in self.puts(calls) ), ['0002.mp4', '0005.mp4'])
+        self.assert_uploaded()
+
+
+if __name__ == '__main__':
+    unittest.main()
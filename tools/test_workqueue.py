@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# Python 3.10
+
+'''
+Tests for workqueue.py with several worker processes on a temporary queue folder
+
+    python3 -m unittest test_workqueue (in tools/)
+'''
+
+import os
+import io
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import contextlib
+import multiprocessing
+
+import workqueue
+
+UNITS = [ f'unit_{i:04d}' for i in range(1, 31) ]
+
+
+def worker(folder, log, names, actions = {}, lease = 60, poll = 0.05):
+    # runs in its own process; fn logs each attempt, then acts on actions[name]: crash (exit mid-unit), raise, items (2 failed items)
+    workqueue.POLL = poll
+    queue = workqueue.WorkQueue(folder, lease=lease)
+    def fn(name, data):
+        with open(log, 'a') as file: file.write(f'{name} {os.getpid()}\n')
+        action = actions.get(name)
+        if action == 'crash': os._exit(3)
+        if action == 'raise': raise ValueError('broken unit')
+        if action == 'items': return 2
+        time.sleep(0.01)
+        return 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        queue.run([ (name, None) for name in names ], fn)
+
+
+class WorkQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.folder = os.path.join(self.tmp, 'queue')
+        self.log = os.path.join(self.tmp, 'attempts.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def workers(self, count, **kwargs):
+        # run count workers concurrently, returns their exit codes
+        procs = [ multiprocessing.Process(target=worker, args=(self.folder, self.log, UNITS), kwargs=kwargs) for i in range(count) ]
+        for proc in procs: proc.start()
+        for proc in procs: proc.join(60)
+        return [ proc.exitcode for proc in procs ]
+
+    def attempts(self):
+        # unit -> number of times fn ran for it
+        counts = {}
+        with open(self.log) as file:
+            for line in file: counts[line.split()[0]] = counts.get(line.split()[0], 0) + 1
+        return counts
+
+    def files(self, kind):
+        return sorted( name[:-len(kind) - 1] for name in os.listdir(self.folder) if name.endswith(f'.{kind}') )
+
+    def assert_clean(self):
+        # no claims left behind (including renamed stale ones)
+        self.assertEqual([ name for name in os.listdir(self.folder) if '.claim' in name or name.endswith('.part') ], [])
+
+    def test_exactly_once(self):
+        self.assertEqual(self.workers(4), [0, 0, 0, 0])
+        self.assertEqual(self.attempts(), { name: 1 for name in UNITS })
+        self.assertEqual(self.files('done'), UNITS)
+        self.assert_clean()
+
+    def test_takeover_crashed_worker(self):
+        # a worker exits in the middle of unit_0005, leaving its claim behind
+        self.assertEqual(self.workers(1, actions={'unit_0005': 'crash'}), [3])
+        self.assertEqual(self.files('claim'), ['unit_0005'])
+        self.assertEqual(self.workers(3), [0, 0, 0])
+        attempts = self.attempts()
+        self.assertEqual(attempts.pop('unit_0005'), 2)
+        self.assertEqual(set(attempts.values()), {1})
+        self.assertEqual(self.files('done'), UNITS)
+        self.assert_clean()
+
+    def test_takeover_expired_lease(self):
+        # claim of a worker on another host without heartbeat for longer than the lease
+        os.makedirs(self.folder)
+        with open(os.path.join(self.folder, 'unit_0003.claim'), 'w') as file:
+            json.dump({ 'worker': 'elsewhere:1', 'host': 'elsewhere', 'pid': 1, 'time': 0 }, file)
+        os.utime(os.path.join(self.folder, 'unit_0003.claim'), (time.time() - 10, time.time() - 10))
+        self.assertEqual(self.workers(2, lease=5), [0, 0])
+        self.assertEqual(self.attempts(), { name: 1 for name in UNITS })
+        self.assertEqual(self.files('done'), UNITS)
+        self.assert_clean()
+
+    def test_failed(self):
+        self.assertEqual(self.workers(3, actions={'unit_0002': 'raise', 'unit_0007': 'items'}), [0, 0, 0])
+        self.assertEqual(self.attempts(), { name: 1 for name in UNITS }) # failed units aren't retried by the other workers
+        self.assertEqual(self.files('failed'), ['unit_0002', 'unit_0007'])
+        self.assertEqual(self.files('done'), [ name for name in UNITS if name not in ['unit_0002', 'unit_0007'] ])
+        with open(os.path.join(self.folder, 'unit_0002.failed')) as file: self.assertIn('broken unit', json.load(file)['error'])
+        with open(os.path.join(self.folder, 'unit_0007.failed')) as file: self.assertEqual(json.load(file)['error'], '2 item(s) failed')
+        self.assert_clean()
+        # removing .failed retries the unit
+        os.remove(os.path.join(self.folder, 'unit_0007.failed'))
+        self.assertEqual(self.workers(2), [0, 0])
+        self.assertEqual(self.attempts()['unit_0007'], 2)
+        self.assertEqual(self.files('failed'), ['unit_0002'])
+        self.assert_clean()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,11 +8,21 @@ Required utilities:
 dbxcli (v3.0.0) https://github.com/dropbox/dbxcli
 
 Usage:
-./upload.py <source_path> [dest_folder=/]
+./upload.py <source_path> [dest_folder=/] [--jobs=n] [--sync] [--dbxcli=path] [--metrics=path]
 
 source_path ... path to local file or folder. 
                 if this is a folder, the whole folder will be placed into the dest_folder on the dropbox
 dest_folder ... path to dropbox folder. default is /, the root of the dropbox
+--jobs ...... max. number of concurrent uploads (default 4). concurrency is halved on every failed upload (e.g. throttling),
+              and increased again step by step after successful uploads
+--sync ...... upload only files that are missing on the dropbox or changed since they were uploaded, i.e. resume an interrupted upload
+              files are compared by content hash (as used by dropbox: sha256 of 4 MB block hashes) with the hash recorded on upload,
+              in .upload_sync.sqlite in the source folder (also caches hashes by size and mtime); the remote folder is listed once per run
+--dbxcli .... dbxcli executable (default dbxcli), e.g. the stand-in fake_dbxcli.py (simulated latency and failures, see test_upload.py)
+--metrics ... append an event per upload, retry and a summary to the given file as json lines (see metrics.py)
+
+Failed uploads are retried with exponential backoff (with jitter), while other files continue to upload.
+A progress line (rate, MB/s, ETA) is printed every 10 seconds, and a summary (throughput, percentiles and slowest uploads) at the end.
 
 TODOs:
 * allow multiple source paths, or globs
@@ -21,7 +31,13 @@ TODOs:
 '''
 
 RETRIES = -1 # 0 is no retries, -1 is indefinite retries
-RETRY_SLEEP = [5, 50] # [0] .. step (is multiplied by retry count), [1] .. max. sleep time
+RETRY_SLEEP = [5, 300] # [0] .. base (doubled with each retry), [1] .. max. sleep time; actual sleep is random between half and full value
+UPLOAD_JOBS = 4 # max. concurrent uploads
+DBXCLI = 'dbxcli'
+LARGE_FILE = 100 * 1_000_000 # 100 MB; dbxcli output (progress) is shown for larger files, when uploading one at a time
+SYNC_FILE = '.upload_sync.sqlite' # hashes and uploaded files (--sync), placed in the source folder (hidden files aren't uploaded)
+HASH_BLOCK = 4 * 1024 * 1024 # block size of dropbox content hash
+SKIPPED = 'skipped'
 
 
 import subprocess
@@ -31,6 +47,14 @@ import signal
 import time
 import datetime
 import math
+import random
+import heapq
+import hashlib
+import sqlite3
+import threading
+import re
+import metrics
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 
 class COLORS:
@@ -49,13 +73,13 @@ def run_cmd(cmd, return_exitcode_only=True):
 
 
 # check if target_folder exists and create if not
-def make_dir(target_folder, silent = True, prefix = ''):
+def make_dir(target_folder, silent = True, prefix = '', check = True):
     print(f'{prefix}Creating folder {target_folder}')
     if target_folder == '/': return 0
     redir = ' > /dev/null 2>&1' if silent else ''
-    code = run_cmd(f"dbxcli ls '{target_folder}'{redir}")
+    code = run_cmd(f"{DBXCLI} ls '{target_folder}'{redir}") if check else 1
     if code != 0:
-        code = run_cmd(f"dbxcli mkdir '{target_folder}'")
+        code = run_cmd(f"{DBXCLI} mkdir '{target_folder}'{redir}")
         if code != 0:
             print(f'Error creating folder (code {code})')
             return code
@@ -65,85 +89,193 @@ def make_dir(target_folder, silent = True, prefix = ''):
 def upload_file(src, dst, silent = True, prefix = ''):
     print(f'{prefix}Uploading {src} -> {dst}')
     redir = ' > /dev/null 2>&1' if silent else ''
-    return run_cmd(f"dbxcli put '{src}' '{dst}'{redir}")
+    return run_cmd(f"{DBXCLI} put '{src}' '{dst}'{redir}")
+
+
+def content_hash(path):
+    # dropbox content hash: sha256 of the concatenated sha256 digests of 4 MB blocks
+    h = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while block := file.read(HASH_BLOCK):
+            h.update( hashlib.sha256(block).digest() )
+    return h.hexdigest()
+
+
+def open_sync_db(path):
+    db = sqlite3.connect(path, check_same_thread=False) # used by upload threads, with a lock
+    db.execute('CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT)')
+    db.execute('CREATE TABLE IF NOT EXISTS uploaded (dst TEXT PRIMARY KEY, hash TEXT)')
+    return db
+
+
+def cached_hash(db, lock, path):
+    # content hash of a local file, cached by size and mtime
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    with lock:
+        row = db.execute('SELECT size, mtime_ns, hash FROM hashes WHERE path = ?', (key,)).fetchone()
+    if row != None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns: return row[2]
+    h = content_hash(path)
+    with lock, db:
+        db.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)', (key, stat.st_size, stat.st_mtime_ns, h))
+    return h
+
 
+def remote_listing(folder):
+    # (files, folders) below folder on the dropbox, as sets of lower case paths (dropbox is case insensitive); empty if folder doesn't exist
+    files = set()
+    folders = set()
+    result = subprocess.run(f"{DBXCLI} ls -l -R '{folder}'", shell=True, capture_output=True, text=True)
+    if result.returncode != 0: return files, folders
+    folders.add( folder.rstrip('/').lower() )
+    for line in result.stdout.splitlines():
+        # columns: revision, size, last modified, path (the only column starting with /); revision is - for folders
+        match = re.match(r'(\S+)\s.*?\s(/.*)$', line.rstrip())
+        if not match: continue
+        if match.group(1) == '-': folders.add( match.group(2).lower() )
+        else: files.add( match.group(2).lower() )
+    return files, folders
 
-def put(source_path, target_folder = '/', retry = RETRIES):
+
+def retry_sleep(tries):
+    # exponential backoff with jitter, so failed uploads don't retry in lockstep
+    sleep = min(RETRY_SLEEP[0] * 2 ** (tries - 1), RETRY_SLEEP[1])
+    return random.uniform(sleep / 2, sleep)
+
+
+def put(source_path, target_folder = '/', retry = RETRIES, jobs = UPLOAD_JOBS, sync = False):
     if not os.path.exists(source_path):
         print(f'File/folder doesn\'t exists: {source_path}')
     
     count = 0
     ok = 0
     fail = 0
+    skipped = 0
     fails = []
     
     def print_stats(prefix = ''):
+        skip = f'   Skipped: {skipped}' if sync else ''
         if (fail == 0):
-            print(f'{prefix}Total: {count}   {COLORS.GREEN}Ok: {ok}{COLORS.END}   Failed: {fail}')
+            print(f'{prefix}Total: {count}   {COLORS.GREEN}Ok: {ok}{COLORS.END}   Failed: {fail}{skip}')
         else:
-            print(f'{prefix}Total: {count}   {COLORS.GREEN}Ok: {ok}{COLORS.END}   {COLORS.RED}Failed: {fail}{COLORS.END}')
+            print(f'{prefix}Total: {count}   {COLORS.GREEN}Ok: {ok}{COLORS.END}   {COLORS.RED}Failed: {fail}{COLORS.END}{skip}')
     
     if os.path.isdir(source_path):
         # we want to copy the dir itself, append it to the target
         if source_path.endswith('/'): source_path = source_path[:-1]
         target_folder = os.path.join(target_folder, os.path.basename(source_path))
     
+    tasks = [] # (src, dst); src is None for empty dirs
     if os.path.isdir(source_path):
         # upload contents of folder
         for root, dirs, files in os.walk(source_path):
+            dirs.sort()
             files.sort()
             target_root = root[len(source_path):]
             if target_root.startswith('/'): target_root = target_root[1:] # remove leading /, won't join otherwise
             files = list( filter(lambda x: not x.startswith('.'), files) )
             if len(files) > 0:
-                for file in files:
-                    count += 1
-                    if file.startswith('.'): continue
-                    src = os.path.join(root, file)
-                    dst = os.path.join(target_folder, target_root, file)
-                    code = -1
-                    tries = 0
-                    while code != 0 and ( retry == -1 or tries < retry + 1 ):
-                        if tries > 0: 
-                            sleep = min(RETRY_SLEEP[0] * tries, RETRY_SLEEP[1])
-                            print(f'   Retry {tries}/{retry if retry > 0 else "∞"}, waiting {sleep}s...')
-                            time.sleep(sleep)
-                        small = os.path.getsize(src) < 100 * 1_000_000 # 100 MB
-                        code = upload_file(src, dst, silent=small, prefix=f'({count}) ')
-                        tries += 1
-                    if code == 0: ok += 1
-                    else:
-                        fail += 1
-                        print(f'   {COLORS.RED}FAILED ({code}){COLORS.END}')
-                        fails.append(f"./upload.py '{src}' '{os.path.dirname(dst)}'")
-                    print_stats()
-                        
+                for file in files: tasks.append( (os.path.join(root, file), os.path.join(target_folder, target_root, file)) )
             else: # empty dir, create it
-                count += 1
-                dst = os.path.join(target_folder, target_root)
-                code = make_dir(dst, prefix=f'({count}) ')
-                if code == 0:
-                    ok += 1
-                else:
-                    fail += 1
-                    print(f'   {COLORS.RED}FAILED ({code}){COLORS.END}')
-                    fails.append(f"EMPTY DIR: '{dst}'")
-                print_stats()
+                tasks.append( (None, os.path.join(target_folder, target_root)) )
     else:
         # single file
-        src = source_path
-        dst = os.path.join( target_folder, os.path.basename(source_path) )
-        small = os.path.getsize(src) < 100 * 1_000_000 # 100 MB
-        code = upload_file(src, dst, silent=small)
-        count += 1
+        tasks.append( (source_path, os.path.join( target_folder, os.path.basename(source_path) )) )
+    
+    jobs = max(1, jobs)
+    limit = jobs # current concurrency, adapts to failures
+    successes = 0 # since last change of limit
+    
+    if sync:
+        db = open_sync_db( os.path.join(source_path if os.path.isdir(source_path) else os.path.dirname(source_path), SYNC_FILE) )
+        lock = threading.Lock()
+        print(f'Listing {target_folder}')
+        remote_files, remote_folders = remote_listing(target_folder)
+        print(f'{len(remote_files)} files and {len(remote_folders)} folders on dropbox')
+    
+    def run(n, src, dst):
+        prefix = f'({n}) '
+        if src == None:
+            if not sync: return make_dir(dst, prefix=prefix)
+            if dst.rstrip('/').lower() in remote_folders: return SKIPPED
+            return make_dir(dst, prefix=prefix, check=False) # known to be missing
+        small = os.path.getsize(src) < LARGE_FILE
+        if not sync: return upload_file(src, dst, silent=(small or jobs > 1), prefix=prefix)
+        h = cached_hash(db, lock, src)
+        with lock:
+            row = db.execute('SELECT hash FROM uploaded WHERE dst = ?', (dst,)).fetchone()
+        if row != None and row[0] == h and dst.lower() in remote_files: return SKIPPED
+        code = upload_file(src, dst, silent=(small or jobs > 1), prefix=prefix)
         if code == 0:
-            ok += 1
-        else:
-            fail += 1
-            print(f'   FAILED')
-            fails.append(f"./upload.py '{src}' '{os.path.dirname(dst)}'")
-        print_stats()
+            with lock, db:
+                db.execute('INSERT OR REPLACE INTO uploaded VALUES (?, ?)', (dst, h))
+        return code
+    
+    queue = [ (n + 1, src, dst, 0) for n, (src, dst) in enumerate(tasks) ] # (number, src, dst, tries)
+    queue.reverse() # pop from the end
+    waiting = [] # heap of (retry time, number, src, dst, tries)
+    running = {} # future -> (number, src, dst, tries)
+    started = {} # future -> start time
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    stage = metrics.stage('upload', len(tasks))
+    try:
+        while len(queue) > 0 or len(waiting) > 0 or len(running) > 0:
+            while len(waiting) > 0 and waiting[0][0] <= time.time():
+                queue.append( heapq.heappop(waiting)[1:] ) # retries go first
+            while len(queue) > 0 and len(running) < limit:
+                task = queue.pop()
+                future = executor.submit(run, *task[:3])
+                running[future] = task
+                started[future] = time.perf_counter()
+            if len(running) == 0:
+                time.sleep( max(0, waiting[0][0] - time.time()) )
+                continue
+            timeout = max(0, waiting[0][0] - time.time()) if len(waiting) > 0 else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                n, src, dst, tries = running.pop(future)
+                seconds = time.perf_counter() - started.pop(future)
+                code = future.result()
+                tries += 1
+                if code == SKIPPED:
+                    count += 1
+                    skipped += 1
+                    stage.add(1)
+                    continue
+                if code == 0:
+                    count += 1
+                    ok += 1
+                    stage.item(dst, seconds, os.path.getsize(src) if src != None else 0, tries=tries)
+                    successes += 1
+                    if limit < jobs and successes >= limit:
+                        limit += 1
+                        successes = 0
+                    print_stats()
+                    continue
+                # failed: reduce concurrency, then retry later or give up
+                successes = 0
+                if limit > 1:
+                    limit = max(1, limit // 2)
+                    print(f'   Reducing concurrent uploads to {limit}')
+                if retry == -1 or tries < retry + 1:
+                    sleep = retry_sleep(tries)
+                    print(f'   {COLORS.YELLOW}({n}) Failed ({code}){COLORS.END} Retry {tries}/{retry if retry > 0 else "∞"} in {sleep:.0f}s: {src if src != None else dst}')
+                    metrics.emit('retry', stage='upload', item=dst, tries=tries, code=code, sleep=round(sleep, 1), limit=limit)
+                    heapq.heappush(waiting, (time.time() + sleep, n, src, dst, tries))
+                    continue
+                count += 1
+                fail += 1
+                stage.item(dst, seconds, ok=False, error=f'exit code {code}', tries=tries)
+                print(f'   {COLORS.RED}({n}) FAILED ({code}){COLORS.END}')
+                if src == None: fails.append(f"EMPTY DIR: '{dst}'")
+                else: fails.append(f"./upload.py '{src}' '{os.path.dirname(dst)}'")
+                print_stats()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        stage.end()
+        if sync: db.close()
     
+    if skipped > 0: print_stats()
     if len(fails) > 0:
         print()
         print('To retry fails, type:')
@@ -158,6 +290,7 @@ def print_elapsed():
 
 def signal_handler(sig, stack=None):
     print(f'\nCaught signal {signal.Signals(sig).name}: Exiting')
+    metrics.summary()
     print_elapsed()
     exit(1)
 
@@ -169,10 +302,17 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('source_path') # local source path. a file or a folder
     parser.add_argument('dest_folder', nargs='?', default='/') # remote destination folder 
+    parser.add_argument('--jobs', type=int, default=UPLOAD_JOBS) # max. concurrent uploads
+    parser.add_argument('--sync', action='store_true', default=False) # upload only missing or changed files
+    parser.add_argument('--dbxcli', type=str, default=DBXCLI) # dbxcli executable
+    parser.add_argument('--metrics', type=str, default=None) # path of metrics log (json lines, appended)
     args = parser.parse_args()
+    DBXCLI = args.dbxcli
     
     global start_time
     start_time = time.time()
-    put(args.source_path, args.dest_folder)
+    if args.metrics: metrics.open_log(args.metrics)
+    put(args.source_path, args.dest_folder, jobs=args.jobs, sync=args.sync)
+    metrics.summary()
     print()
     print_elapsed()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# Python 3.10
+
+'''
+Work queue on a shared filesystem, for process_pony.py workers on several hosts
+
+    queue = workqueue.WorkQueue('/Volumes/shared/pony_queue')
+    queue.run([ ('movies_0001-0020', folders), ... ], lambda name, data: create_movies(data, ...))
+
+Every worker computes the same list of units (name, data) and works through it; a unit is claimed by creating <name>.claim exclusively (O_EXCL),
+completion is recorded in <name>.done, failure (an exception, or fn returning a number of failed items > 0) in <name>.failed (remove it to try again).
+Claims are kept alive by a heartbeat (mtime of the claim file, every LEASE/4 seconds); a claim older than LEASE seconds,
+or of a process that no longer exists on this host, belongs to a crashed worker: it's taken over by renaming it (only one worker succeeds) and claiming the unit again.
+run() returns once all units are done or failed, waiting for units claimed by other workers (which might crash).
+'''
+
+LEASE = 300 # seconds without heartbeat, after which a claim is considered stale
+POLL = 10 # seconds between checks for units claimed by other workers
+
+import os
+import json
+import time
+import socket
+import threading
+
+
+class WorkQueue:
+    def __init__(self, folder, worker = None, lease = LEASE):
+        self.folder = folder
+        self.worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+        self.lease = lease
+        self.held = set() # claimed units, kept alive by the heartbeat
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, name, kind):
+        return os.path.join(self.folder, f'{name}.{kind}')
+
+    def state(self, name):
+        # 'done', 'failed', 'claimed', 'stale' or None (free)
+        if os.path.exists(self.path(name, 'done')): return 'done'
+        if os.path.exists(self.path(name, 'failed')): return 'failed'
+        try:
+            stat = os.stat(self.path(name, 'claim'))
+        except FileNotFoundError:
+            return None
+        if time.time() - stat.st_mtime > self.lease: return 'stale'
+        owner = self.owner(name)
+        if owner and owner.get('host') == socket.gethostname() and not pid_exists(owner.get('pid')): return 'stale' # crashed on this host
+        return 'claimed'
+
+    def owner(self, name):
+        try:
+            with open(self.path(name, 'claim')) as file: return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def claim(self, name):
+        # true if this worker now holds the unit
+        state = self.state(name)
+        if state in ['done', 'failed', 'claimed']: return False
+        if state == 'stale':
+            # take over: only one worker can rename the stale claim away
+            owner = self.owner(name)
+            stale = self.path(name, f'claim.stale.{self.worker.replace("/", "_")}')
+            try: os.rename(self.path(name, 'claim'), stale)
+            except FileNotFoundError: return False
+            if time.time() - os.stat(stale).st_mtime <= self.lease and (owner == None or owner.get('host') != socket.gethostname() or pid_exists(owner.get('pid'))):
+                # raced with another worker, and took its fresh claim: put it back (without replacing a newer one)
+                try: os.link(stale, self.path(name, 'claim'))
+                except FileExistsError: pass
+                os.remove(stale)
+                return False
+            os.remove(stale)
+            print(f'Reclaiming {name} from {owner.get("worker") if owner else "unknown worker"}')
+        try:
+            fd = os.open(self.path(name, 'claim'), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as file:
+            json.dump({ 'worker': self.worker, 'host': socket.gethostname(), 'pid': os.getpid(), 'time': time.time() }, file)
+        if os.path.exists(self.path(name, 'done')): # completed just before the claim
+            os.remove(self.path(name, 'claim'))
+            return False
+        with self.lock: self.held.add(name)
+        return True
+
+    def release(self, name):
+        with self.lock: self.held.discard(name)
+        owner = self.owner(name)
+        if owner and owner.get('worker') == self.worker: os.remove(self.path(name, 'claim'))
+
+    def finish(self, name, kind, **info):
+        # record completion ('done') or failure ('failed'), then release the claim
+        partfile = self.path(name, f'{kind}.{self.worker.replace("/", "_")}.part')
+        with open(partfile, 'w') as file:
+            json.dump({ 'worker': self.worker, 'time': time.time(), **info }, file)
+        os.replace(partfile, self.path(name, kind))
+        self.release(name)
+
+    def heartbeat(self):
+        while not self.stop.wait(self.lease / 4):
+            with self.lock: held = list(self.held)
+            for name in held:
+                try: os.utime(self.path(name, 'claim'))
+                except FileNotFoundError: pass # taken over after all (e.g. this host was suspended)
+
+    def run(self, units, fn):
+        '''
+        work through units (name, data) with fn(name, data), together with other workers
+        fn returns the number of failed items (or None); a unit with failed items is recorded as failed
+        returns (units done by this worker, units failed by this worker)
+        '''
+        done = []
+        failed = []
+        self.stop = threading.Event()
+        thread = threading.Thread(target=self.heartbeat, daemon=True)
+        thread.start()
+        try:
+            while True:
+                waiting = 0 # units held by other workers
+                for name, data in units:
+                    if not self.claim(name):
+                        if self.state(name) not in ['done', 'failed']: waiting += 1
+                        continue
+                    print(f'\n[{self.worker}] Unit {name}')
+                    start = time.time()
+                    try:
+                        errors = fn(name, data)
+                    except Exception as e:
+                        print(f'[{self.worker}] Unit {name} failed: {e!r}')
+                        self.finish(name, 'failed', error=repr(e))
+                        failed.append(name)
+                        continue
+                    except BaseException:
+                        self.release(name) # e.g. SIGINT: leave it to other workers right away
+                        raise
+                    if errors:
+                        print(f'[{self.worker}] Unit {name} failed: {errors} item(s) failed')
+                        self.finish(name, 'failed', error=f'{errors} item(s) failed', seconds=round(time.time() - start, 3))
+                        failed.append(name)
+                        continue
+                    self.finish(name, 'done', seconds=round(time.time() - start, 3))
+                    done.append(name)
+                if waiting == 0: break
+                print(f'[{self.worker}] Waiting for {waiting} unit(s) claimed by other workers')
+                time.sleep(min(POLL, self.lease))
+        finally:
+            self.stop.set()
+        print(f'[{self.worker}] {len(done)} unit(s) done, {len(failed)} failed by this worker')
+        return done, failed
+
+
+def pid_exists(pid):
+    if not isinstance(pid, int): return True # unknown, rely on the lease
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def units(items, size, prefix, key = None):
+    '''
+    group items (sorted) into units of size: [(name, items)], named <prefix>_<first>-<last>
+    key ... number of an item (e.g. sequence number): units cover fixed ranges of size numbers; default item positions (1-based)
+    '''
+    groups = {}
+    for i, item in enumerate(items):
+        n = key(item) if key else i + 1
+        groups.setdefault( (n - 1) // size, [] ).append(item)
+    return [ (f'{prefix}_{g * size + 1:04d}-{(g + 1) * size:04d}', group) for g, group in sorted(groups.items()) ]